@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        import api.search  # noqa: connects the search index receivers
+        import api.rendering  # noqa: connects the rendered example receivers
+        import api.conditional  # noqa: connects the `updated` timestamp receivers
+        import api.caching  # noqa: connects the payload cache invalidation receivers
+        import api.closure  # noqa: connects the hierarchy closure receivers
+        import api.geo  # noqa: connects the place geohash receiver
+        import api.rhymes  # noqa: connects the rhyme family receivers
@@ -0,0 +1,383 @@
+from collections import defaultdict
+from urllib.parse import urlparse
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When, prefetch_related_objects
+from django.urls import resolve, Resolver404
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import ValidationError
+from rest_framework.relations import ManyRelatedField, HyperlinkedRelatedField
+from rest_framework.response import Response
+
+from api.caching import invalidate, object_tag, foreign_key_tags, bump_generation
+from api.conditional import touch
+from api.models import Example, Annotation
+from api.rendering import store_rendered_examples
+from api.rhymes import family_ids, merge_clusters, split_clusters
+from api.serializers import queryset_plan
+
+
+###
+# Bulk create/update for list payloads.
+#
+# Every hyperlink in the payload is resolved up front, with one query per
+# target model, and the rows are validated together. Uniqueness is checked
+# for the whole batch with one query rather than one per row. Rows go in
+# with bulk_create (or one CASE-based UPDATE) plus bulk-inserted
+# many-to-many through rows, all in one transaction.
+#
+# None of that fires model signals, so written() does the receivers' work
+# for the batch in the same transaction: re-rendering examples, keeping
+# rhyme families current and bumping `updated` timestamps. Invalidating the
+# payload and result caches waits for the commit, so no reader can cache
+# the old rows again after it.
+###
+
+
+def hyperlink_pk(value, field):
+    if not isinstance(value, str):
+        return None
+    try:
+        match = resolve(urlparse(value).path)
+    except Resolver404:
+        return None
+    if match.view_name != field.view_name:
+        return None
+    return match.kwargs.get(field.lookup_url_kwarg)
+
+
+def relation_fields(serializer):
+    for name, field in serializer.fields.items():
+        if field.read_only:
+            continue
+        if isinstance(field, ManyRelatedField):
+            yield name, field.child_relation, True
+        elif isinstance(field, HyperlinkedRelatedField):
+            yield name, field, False
+
+
+def resolve_hyperlinks(serializer, rows):
+    """
+    {model: {pk string: instance}} for every hyperlink the writable relation
+    fields of `serializer` find in `rows`, read with one query per model.
+    """
+    wanted = {}
+    for name, field, many in relation_fields(serializer):
+        model = field.get_queryset().model
+        wanted.setdefault(model, set())
+        for row in rows:
+            values = row.get(name) if isinstance(row, dict) else None
+            for value in (values if many and isinstance(values, list) else [values]):
+                pk = hyperlink_pk(value, field)
+                try:
+                    wanted[model].add(model._meta.pk.to_python(pk))
+                except DjangoValidationError:
+                    pass
+    wanted = dict((model, pks - {None}) for model, pks in wanted.items())
+    return dict((model, dict((str(pk), obj) for pk, obj in model._default_manager.in_bulk(pks).items()))
+                for model, pks in wanted.items())
+
+
+def field_value(instance_or_value):
+    return getattr(instance_or_value, 'pk', instance_or_value)
+
+
+def column_field(field):
+    return field.target_field if field.is_relation else field
+
+
+def unique_together_errors(model, rows, exclude=()):
+    """
+    {row index: message} for rows whose unique_together values repeat an
+    earlier row's or a stored row's, read with one query per constraint.
+    `rows` maps index to the row's complete field values.
+    """
+    errors = {}
+    for names in model._meta.unique_together:
+        fields = [model._meta.get_field(name) for name in names]
+        keys = dict((index, tuple(field_value(values.get(name)) for name in names)) for index, values in rows.items())
+        if not keys:
+            continue
+        stored = model._default_manager.exclude(pk__in=exclude).filter(**dict(
+            (field.attname + '__in', set(key[i] for key in keys.values())) for i, field in enumerate(fields)))
+        taken = set(stored.values_list(*[field.attname for field in fields]))
+        message = "The fields {} must make a unique set.".format(", ".join(names))
+        for index in sorted(keys):
+            if keys[index] in taken:
+                errors[index] = message
+            taken.add(keys[index])
+    return errors
+
+
+LOOKUP_CHUNK_SIZE = 400
+
+
+def assign_ids(model, objects, using, key_names=None):
+    """
+    Primary keys for rows bulk_create could not report back (every backend
+    but PostgreSQL), read back by the natural key `key_names` (by default
+    the model's first unique_together), one query per chunk. Where older
+    rows share a key, the newest is the one just inserted.
+    """
+    if not objects or objects[0].pk is not None:
+        return
+    attnames = [model._meta.get_field(name).attname for name in key_names or model._meta.unique_together[0]]
+
+    found = {}
+    manager = model._default_manager.using(using)
+    for i in range(0, len(objects), LOOKUP_CHUNK_SIZE):
+        chunk = [tuple(getattr(obj, attname) for attname in attnames) for obj in objects[i:i + LOOKUP_CHUNK_SIZE]]
+        condition = Q()
+        for j, attname in enumerate(attnames):
+            values = set(k[j] for k in chunk)
+            field = Q(**{attname + '__in': values - {None}})
+            if None in values:
+                field |= Q(**{attname + '__isnull': True})
+            condition &= field
+        for row in manager.filter(condition).order_by('pk').values_list('pk', *attnames):
+            found[tuple(row[1:])] = row[0]
+    for obj in objects:
+        obj.pk = found[tuple(getattr(obj, attname) for attname in attnames)]
+        obj._state.adding = False
+        obj._state.db = using
+
+
+def through_rows(field, pairs):
+    through = field.remote_field.through
+    source = through._meta.get_field(field.m2m_field_name()).attname
+    target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+    if field.remote_field.symmetrical and field.related_model == field.model:
+        pairs = pairs | set((b, a) for a, b in pairs if a != b)
+    return [through(**{source: a, target: b}) for a, b in sorted(pairs)]
+
+
+def replace_relations(model, objects, relations, using, replace=False):
+    """
+    Bulk-insert the through rows for `relations` ({field name: targets} per
+    object), first deleting the existing ones if `replace`. Returns the
+    (model, pk) of every object on the far side of a removed row.
+    """
+    removed = set()
+    names = set(name for related in relations for name in related)
+    for name in names:
+        field = model._meta.get_field(name)
+        through = field.remote_field.through
+        pks = [obj.pk for obj, related in zip(objects, relations) if name in related]
+        if replace:
+            source = through._meta.get_field(field.m2m_field_name()).attname
+            target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+            stale = Q(**{source + '__in': pks})
+            if field.remote_field.symmetrical and field.related_model == model:
+                stale |= Q(**{target + '__in': pks})
+            stale = through._default_manager.using(using).filter(stale)
+            removed.update((field.related_model, pk) for pair in stale.values_list(source, target) for pk in pair)
+            stale.delete()
+        pairs = set((obj.pk, target.pk) for obj, related in zip(objects, relations)
+                    for target in related.get(name, []))
+        through._default_manager.using(using).bulk_create(through_rows(field, pairs))
+    return removed
+
+
+def written(model, objects, relations, previous=(), removed=(), using='default'):
+    """
+    What the save, delete and m2m_changed receivers would have done for a
+    batch of `objects` (and the `previous` state of updated ones, and the
+    objects whose relations to them were `removed`). Called inside the
+    write's transaction: the denormalised columns are kept with the rows, and
+    the caches are invalidated once it commits.
+    """
+    tags, touched = set(), defaultdict(set)
+    for related_model, pk in removed:
+        tags.add(object_tag(related_model, pk))
+        touched[related_model].add(pk)
+    for obj in list(objects) + list(previous):
+        tags.add(object_tag(model, obj.pk))
+        tags.update(foreign_key_tags(obj))
+        for field in model._meta.concrete_fields:
+            if field.is_relation and getattr(obj, field.attname) is not None:
+                touched[field.related_model].add(getattr(obj, field.attname))
+    related_models = set()
+    for related in relations:
+        for name, targets in related.items():
+            target_model = model._meta.get_field(name).related_model
+            related_models.add(target_model)
+            for target in targets:
+                tags.add(object_tag(target_model, target.pk))
+                touched[target_model].add(target.pk)
+
+    if model is Annotation:
+        store_rendered_examples(touched[Example])
+        split_clusters(family_ids([pk for related_model, pk in removed if related_model is Annotation]))
+        merge_clusters([(obj.pk, target.pk) for obj, related in zip(objects, relations)
+                        for target in related.get('rhymes', [])])
+    elif model is Example and previous:
+        store_rendered_examples([obj.pk for obj in objects])
+    for related_model, pks in touched.items():
+        touch(related_model, pks)
+
+    def invalidate_caches():
+        invalidate(tags)
+        for changed in {model} | related_models:
+            bump_generation(changed)
+    transaction.on_commit(invalidate_caches, using=using)
+
+
+class BulkWriter(object):
+    """
+    Validates and writes a list payload for `serializer_class`. `attributes`
+    is called with each row's validated data (and, on update, the instance)
+    and returns the attributes the viewset adds, like `perform_create` does.
+    """
+
+    def __init__(self, serializer_class, request, attributes):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self.request = request
+        self.attributes = attributes
+
+    def get_context(self, rows):
+        context = {'request': self.request}
+        context['resolved_objects'] = resolve_hyperlinks(self.serializer_class(context=context), rows)
+        return context
+
+    def m2m_names(self, data):
+        return [name for name in data if self.model._meta.get_field(name).many_to_many]
+
+    def reverse_names(self, data):
+        return [name for name in data if self.model._meta.get_field(name).one_to_many]
+
+    @staticmethod
+    def check_rows(rows):
+        if not isinstance(rows, list) or not rows:
+            raise ValidationError({'non_field_errors': ["Expected a non-empty list of items."]})
+
+    def validate(self, rows, instances=None):
+        """
+        (validated data, errors), one entry per row; errors are {} for good rows.
+        """
+        context = self.get_context(rows)
+        validated, errors = [], []
+        child = self.serializer_class(context=context)
+        child.validators = []
+        for index, row in enumerate(rows):
+            if instances is not None:
+                if not isinstance(instances[index], self.model):
+                    validated.append(None)
+                    errors.append({'url': [instances[index]]})
+                    continue
+                child = self.serializer_class(instances[index], data=row, partial=True, context=context)
+                child.validators = []
+            try:
+                data = child.run_validation(row)
+            except ValidationError as exc:
+                validated.append(None)
+                errors.append(exc.detail)
+                continue
+            # reverse foreign keys are set from the other side, one row at a time
+            moved = dict((name, ["Set this from the related items."]) for name in self.reverse_names(data)
+                         if data.pop(name))
+            validated.append(None if moved else data)
+            errors.append(moved)
+
+        complete = {}
+        for index, data in enumerate(validated):
+            if data is not None:
+                values = {}
+                if instances is not None:
+                    instance = instances[index]
+                    values = dict((field.name, getattr(instance, field.attname))
+                                  for field in self.model._meta.concrete_fields)
+                values.update(data)
+                complete[index] = values
+        exclude = [instance.pk for instance in instances or [] if isinstance(instance, self.model)]
+        for index, message in unique_together_errors(self.model, complete, exclude).items():
+            errors[index].setdefault('non_field_errors', []).append(message)
+        return validated, errors
+
+    def create(self, rows):
+        self.check_rows(rows)
+        validated, errors = self.validate(rows)
+        if any(errors):
+            return None, errors
+
+        using = self.model._default_manager.db
+        objects, relations = [], []
+        for data in validated:
+            data = dict(data)
+            relations.append(dict((name, data.pop(name)) for name in self.m2m_names(data)))
+            data.update(self.attributes(data))
+            objects.append(self.model(**data))
+        with transaction.atomic(using=using):
+            self.model._default_manager.bulk_create(objects)
+            assign_ids(self.model, objects, using)
+            replace_relations(self.model, objects, relations, using)
+            written(self.model, objects, relations, using=using)
+        return objects, None
+
+    def find_instances(self, rows):
+        """
+        The instance each row's `url` points at, or an error message in its place.
+        """
+        url_field = self.serializer_class(context={'request': self.request}).fields['url']
+        pks = [hyperlink_pk(row.get('url') if isinstance(row, dict) else None, url_field) for row in rows]
+        found = self.model._default_manager.in_bulk([pk for pk in pks if pk is not None])
+        found = dict((str(pk), obj) for pk, obj in found.items())
+        return [found.get(str(pk), "Invalid hyperlink - Object does not exist.") if pk is not None
+                else "A valid `url` is required to update an item." for pk in pks]
+
+    def update(self, rows):
+        self.check_rows(rows)
+        instances = self.find_instances(rows)
+        validated, errors = self.validate(rows, instances)
+        if any(errors):
+            return None, errors
+
+        using = self.model._default_manager.db
+        previous = [self.model(**dict((field.attname, getattr(instance, field.attname))
+                                      for field in self.model._meta.concrete_fields)) for instance in instances]
+        changes, relations = {}, []
+        for instance, data in zip(instances, validated):
+            data = dict(data)
+            relations.append(dict((name, data.pop(name)) for name in self.m2m_names(data)))
+            data.update(self.attributes(data, instance))
+            for name, value in data.items():
+                field = self.model._meta.get_field(name)
+                setattr(instance, name, value)
+                changes.setdefault(field, []).append(
+                    When(pk=instance.pk, then=Value(field_value(value), output_field=column_field(field))))
+        with transaction.atomic(using=using):
+            update = dict((field.name, Case(*whens, default=F(field.attname), output_field=column_field(field)))
+                          for field, whens in changes.items())
+            update['updated'] = timezone.now()
+            self.model._default_manager.filter(pk__in=[instance.pk for instance in instances]).update(**update)
+            removed = replace_relations(self.model, instances, relations, using, replace=True)
+            written(self.model, instances, relations, previous, removed, using)
+        return instances, None
+
+    def represent(self, objects):
+        select, prefetch, _ = queryset_plan(self.serializer_class)
+        prefetch_related_objects(objects, *prefetch)
+        return self.serializer_class(objects, many=True, context={'request': self.request}).data
+
+
+class BulkWriteMixin(object):
+    """
+    `POST` (create) and `PATCH` (update, rows identified by `url`) of a list
+    payload at `bulk/`. A payload with any bad row writes nothing and is
+    answered with one error object per row, empty for the good ones.
+    Viewsets add their own attributes in `get_bulk_attributes(data, instance=None)`.
+    """
+
+    @list_route(methods=['post', 'patch'])
+    def bulk(self, request, *args, **kwargs):
+        writer = BulkWriter(self.get_serializer_class(), request, self.get_bulk_attributes)
+        if request.method == 'POST':
+            objects, errors = writer.create(request.data)
+        else:
+            objects, errors = writer.update(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        created = request.method == 'POST'
+        return Response(writer.represent(objects), status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
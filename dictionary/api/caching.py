@@ -0,0 +1,368 @@
+import hashlib
+from collections import OrderedDict
+import time
+from django.core.cache import caches
+from django.db.models import Model, QuerySet
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils.http import urlencode
+from rest_framework.response import Response
+from api.hyperlinks import router_registry
+from api.serializers import requested_fields
+
+
+###
+# Read-through cache for retrieve and highlight payloads.
+#
+# Each cached payload is tagged with every object it was built from, and with
+# every object those point at through a foreign key. Every tag is a counter,
+# and a payload is stored with the values its tags had when it was built. A
+# write to an object bumps the tags of the object and of the objects it
+# points at (whose pages list it), and a payload whose tags have moved on is
+# rebuilt on its next read. For example, editing an example drops the page of
+# every sense whose annotations sit in that example. Counters are only ever
+# incremented, so concurrent workers can't lose each other's writes.
+#
+# List and search results cannot be tagged that way, as a write may add a row
+# to a result set it was never in. Instead every model has a generation
+# counter, bumped on any write to the model or its many-to-many relations, and
+# result keys include the generations of the listed model and of the models
+# related to it. A write moves the keys on, in every worker at once, and the
+# stale entries age out.
+#
+# The backend is the `payloads` alias in CACHES: local memory unless the
+# environment points it at a shared cache.
+###
+
+PAYLOAD_CACHE = 'payloads'
+PAYLOAD_TIMEOUT = 60 * 60 * 24
+
+
+def payload_cache():
+    return caches[PAYLOAD_CACHE]
+
+
+def object_tag(model, pk):
+    return "tag:" + model._meta.label_lower + ":" + str(pk)
+
+
+def foreign_keys(instance):
+    """
+    (related model, pk) for each set foreign key of `instance` to a cached model.
+    """
+    keys = set()
+    for field in instance._meta.concrete_fields:
+        if field.is_relation and is_cached_model(field.related_model):
+            pk = getattr(instance, field.attname)
+            if pk is not None:
+                keys.add((field.related_model, pk))
+    return keys
+
+
+def foreign_key_tags(instance):
+    return set(object_tag(model, pk) for model, pk in foreign_keys(instance))
+
+
+def collect_tags(data, tags=None):
+    """
+    Tags for every model instance reachable from `data`, walking dicts,
+    lists, evaluated querysets and prefetched relations.
+    """
+    if tags is None:
+        tags = set()
+    if isinstance(data, Model):
+        tag = object_tag(type(data), data.pk)
+        if tag in tags:
+            return tags
+        tags.add(tag)
+        tags.update(foreign_key_tags(data))
+        for related in getattr(data, '_prefetched_objects_cache', {}).values():
+            collect_tags(related, tags)
+    elif isinstance(data, QuerySet):
+        # evaluated here rather than when the payload is pickled
+        collect_tags(list(data), tags)
+    elif isinstance(data, dict):
+        for value in data.values():
+            collect_tags(value, tags)
+    elif isinstance(data, (list, tuple)):
+        for value in data:
+            collect_tags(value, tags)
+    return tags
+
+
+def plain_data(data):
+    """
+    Serializer output as plain dicts, lists and strings. DRF's Hyperlink
+    pickles through str() of the object it links to, which would cost a
+    query per link.
+    """
+    if isinstance(data, dict):
+        return OrderedDict((key, plain_data(value)) for key, value in data.items())
+    if isinstance(data, list):
+        return [plain_data(value) for value in data]
+    if isinstance(data, str):
+        return str(data)
+    return data
+
+
+def cache_payload(key, payload, tags):
+    # the versions the payload was built against, checked on every read
+    tags = sorted(tags)
+    versions = dict(zip(tags, counters(tags)))
+    payload_cache().set(key, {'payload': payload, 'versions': versions}, PAYLOAD_TIMEOUT)
+
+
+def invalidate(tags):
+    cache = payload_cache()
+    for tag in tags:
+        try:
+            cache.incr(tag)
+        except ValueError:
+            # never read, or evicted: payloads tagged with it are stale anyway
+            pass
+
+
+def read_through(key, build):
+    """
+    The payload cached under `key`, or `build()`'s result, cached and tagged
+    with the objects it contains.
+    """
+    cache = payload_cache()
+    entry = cache.get(key)
+    if entry is not None:
+        versions = entry['versions']
+        if cache.get_many(list(versions)) == versions:
+            return entry['payload']
+    payload = build()
+    cache_payload(key, payload, collect_tags(payload))
+    return payload
+
+
+class CachedPayloadMixin(object):
+    """
+    Serve `retrieve` and the viewset's highlight context from the payload cache.
+    Viewsets build their highlight context in `get_highlight_data(obj)`.
+    """
+
+    def payload_key(self, obj, action):
+        # hashed: hosts and field lists aren't memcached-safe
+        keep = requested_fields(self.get_serializer_class(), self.request.query_params)
+        parts = [action, self.request.scheme, self.request.get_host(),
+                 ",".join(sorted(keep)) if keep is not None else "*"]
+        return ":".join(["payload", obj._meta.label_lower, str(obj.pk),
+                         hashlib.md5(":".join(parts).encode('utf-8')).hexdigest()])
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+
+        def build():
+            return {'object': instance, 'data': plain_data(self.get_serializer(instance).data)}
+        return Response(read_through(self.payload_key(instance, 'retrieve'), build)['data'])
+
+    def get_cached_highlight_data(self):
+        obj = self.get_object()
+        return read_through(self.payload_key(obj, 'highlight'), lambda: self.get_highlight_data(obj))
+
+
+def generation_key(model):
+    return "generation:" + model._meta.label_lower
+
+
+def start_generation(key):
+    # counters start from the clock so that one evicted and restarted can't
+    # come back to a number that old result keys were built with
+    payload_cache().add(key, int(time.time() * 1000000), None)
+
+
+def counters(keys):
+    """
+    The current values of the counters `keys`, starting any that are missing.
+    """
+    cache = payload_cache()
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            start_generation(key)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def generations(models):
+    return counters([generation_key(model) for model in models])
+
+
+def bump_generation(model):
+    key = generation_key(model)
+    try:
+        payload_cache().incr(key)
+    except ValueError:
+        start_generation(key)
+
+
+def cached_values(namespace, models, keys, build):
+    """
+    {key: value} for `keys`, cached under the current generations of
+    `models`; `build(missing)` computes the values the cache lacks.
+    """
+    prefix = ":".join(["values", namespace] + [str(generation) for generation in generations(models)]) + ":"
+    found = payload_cache().get_many([prefix + str(key) for key in keys])
+    values = dict((key, found[prefix + str(key)]) for key in keys if prefix + str(key) in found)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        built = build(missing)
+        payload_cache().set_many(dict((prefix + str(key), value) for key, value in built.items()), PAYLOAD_TIMEOUT)
+        values.update(built)
+    return values
+
+
+def related_models(model):
+    """
+    `model` and every model it is related to, whose writes can change how
+    its rows are listed.
+    """
+    models = {model}
+    for field in model._meta.get_fields():
+        if field.is_relation and field.related_model is not None and is_cached_model(field.related_model):
+            models.add(field.related_model)
+    return sorted(models, key=lambda m: m._meta.label_lower)
+
+
+def normalized_params(query_params):
+    return urlencode(sorted((key, sorted(values)) for key, values in query_params.lists()), doseq=True)
+
+
+def result_key(namespace, request, models):
+    parts = [request.scheme, request.get_host(), normalized_params(request.query_params)]
+    parts.extend(str(generation) for generation in generations(models))
+    return "results:" + namespace + ":" + hashlib.md5(":".join(parts).encode('utf-8')).hexdigest()
+
+
+def count_lookup(namespace, hit):
+    key = "stats:" + namespace + (":hits" if hit else ":misses")
+    try:
+        payload_cache().incr(key)
+    except ValueError:
+        payload_cache().add(key, 1, None)
+
+
+def result_cache_stats():
+    """
+    {namespace: {'hits': n, 'misses': n}} for every cached action of the
+    routed viewsets used so far, counted across all workers.
+    """
+    keys = {}
+    for prefix, viewset, basename in router_registry():
+        if not issubclass(viewset, CachedResultsMixin):
+            continue
+        for action in viewset.cached_result_actions:
+            namespace = viewset.queryset.model._meta.label_lower + "." + action
+            keys[namespace] = ("stats:" + namespace + ":hits", "stats:" + namespace + ":misses")
+    found = payload_cache().get_many([key for pair in keys.values() for key in pair])
+    return dict((namespace, {'hits': found.get(hits, 0), 'misses': found.get(misses, 0)})
+                for namespace, (hits, misses) in keys.items() if hits in found or misses in found)
+
+
+class CachedResultsMixin(object):
+    """
+    Serve `list` and the viewset's search context from the result cache.
+    Viewsets build their search context in `get_search_data()`; responses
+    carry an `X-Cache: HIT` or `MISS` header. Other actions that call
+    `cached_results()` are listed in `cached_result_actions` so their
+    counts show up in the stats.
+    """
+    cached_result_actions = ('list', 'search')
+
+    def get_cache_models(self):
+        return related_models(self.queryset.model)
+
+    def cached_results(self, build):
+        namespace = self.queryset.model._meta.label_lower + "." + self.action
+        key = result_key(namespace, self.request, self.get_cache_models())
+        results = payload_cache().get(key)
+        count_lookup(namespace, results is not None)
+        self.cache_status = "MISS" if results is None else "HIT"
+        if results is None:
+            results = build()
+            payload_cache().set(key, results, PAYLOAD_TIMEOUT)
+        return results
+
+    def list(self, request, *args, **kwargs):
+        return Response(self.cached_results(
+            lambda: plain_data(super(CachedResultsMixin, self).list(request, *args, **kwargs).data)))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(CachedResultsMixin, self).finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'cache_status', None):
+            response['X-Cache'] = self.cache_status
+        return response
+
+
+def is_cached_model(model):
+    return model._meta.app_label == 'api'
+
+
+@receiver(pre_save)
+def remember_foreign_keys(sender, instance=None, raw=False, **kwargs):
+    if raw or not is_cached_model(sender) or instance.pk is None:
+        return
+    previous = sender._default_manager.filter(pk=instance.pk).first()
+    instance._previous_foreign_keys = foreign_keys(previous) if previous else set()
+
+
+def previous_foreign_keys(instance):
+    """
+    foreign_keys() of the row `instance` replaced when it was last saved.
+    """
+    return getattr(instance, '_previous_foreign_keys', set())
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_object(sender, instance=None, **kwargs):
+    if not is_cached_model(sender):
+        return
+    tags = {object_tag(sender, instance.pk)} | foreign_key_tags(instance)
+    invalidate(tags | set(object_tag(model, pk) for model, pk in previous_foreign_keys(instance)))
+    bump_generation(sender)
+
+
+def related_pks(sender, instance, reverse, model, using='default'):
+    """
+    The pks of the `model` objects related to `instance` through the M2M
+    table `sender`, e.g. those a clear() is about to unlink.
+    """
+    for field in model._meta.many_to_many if reverse else type(instance)._meta.many_to_many:
+        if field.remote_field.through is sender:
+            source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+            if reverse:
+                source, target = target, source
+            return set(sender._default_manager.using(using).filter(**{source: instance.pk})
+                       .values_list(target + '_id', flat=True))
+    return set()
+
+
+def cleared_pks(instance, sender):
+    return getattr(instance, '_cleared_pks', {}).get(sender, set())
+
+
+def remember_cleared(sender, instance, reverse, model, using='default'):
+    # post_clear comes with pk_set=None
+    if not hasattr(instance, '_cleared_pks'):
+        instance._cleared_pks = {}
+    instance._cleared_pks[sender] = related_pks(sender, instance, reverse, model, using)
+
+
+@receiver(m2m_changed)
+def invalidate_relation(sender, instance=None, action=None, reverse=False, model=None, pk_set=None,
+                        using='default', **kwargs):
+    if action == 'pre_clear':
+        remember_cleared(sender, instance, reverse, model, using)
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        pk_set = cleared_pks(instance, sender)
+    tags = {object_tag(type(instance), instance.pk)}
+    tags.update(object_tag(model, pk) for pk in pk_set or [])
+    invalidate(tags)
+    bump_generation(type(instance))
+    bump_generation(model)
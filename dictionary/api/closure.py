@@ -0,0 +1,217 @@
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, pre_delete, post_delete
+from django.dispatch import receiver
+from api.models import Sense, SenseClosure, SENSE_TAXONOMIES, Place, PlaceClosure, Domain, DomainClosure, \
+    SemanticClass, SemanticClassClosure
+
+
+###
+# Transitive closure of the self-referential hierarchies: the sense
+# taxonomies (hypernyms, meronyms), place containment and the broader/narrower
+# trees of domains and semantic classes.
+#
+# Each closure table holds a row for every (ancestor, descendant) pair with
+# the length of the shortest path between them, so ancestors, descendants
+# and depth are each one indexed query.
+#
+# Whenever edges change, the rows of the objects below the changed edges are
+# recomputed with a recursive CTE over the M2M table (both SQLite and
+# PostgreSQL support WITH RECURSIVE). Serializers reject updates that would
+# close a cycle (see circular_fields); the m2m_changed receiver refuses such
+# edges again as a last resort for writes made outside them.
+###
+
+MAX_DEPTH = 100
+CHUNK_SIZE = 400
+
+
+class Hierarchy(object):
+    """
+    A self-referential M2M field and the closure table that mirrors it.
+    `upwards` says whether the field points from descendant to ancestor, and
+    `scope` picks the hierarchy's rows when the table is shared.
+    """
+
+    def __init__(self, model, field_name, upwards, closure_model, **scope):
+        self.model = model
+        self.field_name = field_name
+        self.upwards = upwards
+        self.closure_model = closure_model
+        self.scope = scope
+
+    @property
+    def field(self):
+        return self.model._meta.get_field(self.field_name)
+
+    @property
+    def through(self):
+        return self.field.remote_field.through
+
+    def relation_names(self):
+        """
+        (accessor name, whether it follows the field in reverse) for both ends.
+        """
+        return (self.field.name, False), (self.field.related_query_name(), True)
+
+    def edges(self):
+        """
+        (table, lower column, upper column) of the M2M table, the lower
+        column holding the descendant end of each edge.
+        """
+        columns = (self.field.m2m_column_name(), self.field.m2m_reverse_name())
+        lower, upper = columns if self.upwards else columns[::-1]
+        return self.through._meta.db_table, lower, upper
+
+    def edge(self, instance_pk, pk, reverse):
+        """
+        (lower, upper) for an edge added or removed through an M2M manager.
+        """
+        source, target = (pk, instance_pk) if reverse else (instance_pk, pk)
+        return (source, target) if self.upwards else (target, source)
+
+    def rows(self, using='default'):
+        return self.closure_model.objects.using(using).filter(**self.scope)
+
+    def closure_sql(self, ids, using='default'):
+        qn = connections[using].ops.quote_name
+        table, lower, upper = self.edges()
+        sql = ("WITH RECURSIVE up (descendant, ancestor, depth) AS ("
+               "SELECT {lower}, {upper}, 1 FROM {table} WHERE {lower} IN ({placeholders}) "
+               "UNION "
+               "SELECT up.descendant, e.{upper}, up.depth + 1 FROM up INNER JOIN {table} e ON e.{lower} = up.ancestor "
+               "WHERE up.depth < %s) "
+               "SELECT descendant, ancestor, MIN(depth) FROM up WHERE descendant <> ancestor "
+               "GROUP BY descendant, ancestor").format(
+            table=qn(table), lower=qn(lower), upper=qn(upper), placeholders=", ".join(["%s"] * len(ids)))
+        return sql, list(ids) + [MAX_DEPTH]
+
+    def subtree(self, ids, using='default'):
+        """
+        `ids` and every object below them.
+        """
+        ids = set(ids)
+        return ids | set(self.rows(using).filter(ancestor_id__in=ids).values_list('descendant_id', flat=True))
+
+    def closure_rows(self, ids, using='default'):
+        """
+        Unsaved closure rows for the ancestors of the objects `ids`, computed
+        from the M2M table a chunk at a time.
+        """
+        ids = sorted(set(ids))
+        rows = []
+        for i in range(0, len(ids), CHUNK_SIZE):
+            with connections[using].cursor() as cursor:
+                cursor.execute(*self.closure_sql(ids[i:i + CHUNK_SIZE], using))
+                rows += [self.closure_model(descendant_id=descendant, ancestor_id=ancestor, depth=depth, **self.scope)
+                         for descendant, ancestor, depth in cursor.fetchall()]
+        return rows
+
+    def refresh(self, ids, using='default'):
+        """
+        Recompute the ancestors of the objects `ids` from the M2M table.
+        """
+        ids = sorted(set(ids))
+        with transaction.atomic(using=using):
+            for i in range(0, len(ids), CHUNK_SIZE):
+                self.rows(using).filter(descendant_id__in=ids[i:i + CHUNK_SIZE]).delete()
+            self.closure_model.objects.using(using).bulk_create(self.closure_rows(ids, using))
+
+    def cycle_edges(self, edges, using='default'):
+        """
+        The (lower, upper) edges that would close a cycle: those whose upper
+        end is the lower end or already sits below it.
+        """
+        edges = set(edges)
+        found = set((lower, upper) for lower, upper in edges if lower == upper)
+        others = list(edges - found)
+        for i in range(0, len(others), CHUNK_SIZE):
+            condition = Q()
+            for lower, upper in others[i:i + CHUNK_SIZE]:
+                condition |= Q(ancestor_id=lower, descendant_id=upper)
+            found.update(self.rows(using).filter(condition).values_list('ancestor_id', 'descendant_id'))
+        return found
+
+
+HIERARCHIES = [Hierarchy(Sense, field_name, upwards, SenseClosure, taxonomy=taxonomy)
+               for taxonomy, field_name, upwards in SENSE_TAXONOMIES]
+HIERARCHIES += [
+    Hierarchy(Place, 'contains', False, PlaceClosure),
+    Hierarchy(Domain, 'broader', True, DomainClosure),
+    Hierarchy(SemanticClass, 'broader', True, SemanticClassClosure),
+]
+
+
+def model_hierarchies(model):
+    return [hierarchy for hierarchy in HIERARCHIES if hierarchy.model is model]
+
+
+def sender_hierarchy(sender):
+    for hierarchy in HIERARCHIES:
+        if sender is hierarchy.through:
+            return hierarchy
+    return None
+
+
+def circular_fields(instance, relations, using='default'):
+    """
+    The names among `relations` ({accessor name: objects}, e.g. a
+    serializer's hypernyms or hyponyms) whose objects would make `instance`
+    its own ancestor.
+    """
+    found = []
+    for hierarchy in model_hierarchies(type(instance)):
+        names = [(name, reverse) for name, reverse in hierarchy.relation_names() if name in relations]
+        for name, reverse in names:
+            edges = [hierarchy.edge(instance.pk, obj.pk, reverse) for obj in relations[name]]
+            if hierarchy.cycle_edges(edges, using):
+                found.append(name)
+        if len(names) == 2 and not any(name in found for name, reverse in names):
+            # both ends at once: each new lower end would sit below each new
+            # upper end through the instance
+            ends = dict((reverse, [obj.pk for obj in relations[name]]) for name, reverse in names)
+            lowers, uppers = (ends[True], ends[False]) if hierarchy.upwards else (ends[False], ends[True])
+            if hierarchy.cycle_edges([(lower, upper) for lower in lowers for upper in uppers], using):
+                found.extend(name for name, reverse in names)
+    return found
+
+
+@receiver(m2m_changed)
+def maintain_closure(sender, instance=None, action=None, reverse=False, pk_set=None, using='default', **kwargs):
+    hierarchy = sender_hierarchy(sender)
+    if hierarchy is None:
+        return
+    if action == 'pre_add':
+        edges = [hierarchy.edge(instance.pk, pk, reverse) for pk in pk_set]
+        if hierarchy.cycle_edges(edges, using):
+            raise ValidationError("Those %s would make the hierarchy circular." % hierarchy.field_name)
+    elif action == 'pre_clear':
+        # the lower ends that are about to lose an edge
+        if reverse == hierarchy.upwards:
+            table, lower, upper = hierarchy.edges()
+            lowers = sender._default_manager.using(using).filter(**{upper: instance.pk}) \
+                .values_list(lower, flat=True)
+            instance._closure_lowers = set(lowers)
+        else:
+            instance._closure_lowers = {instance.pk}
+    elif action in ('post_add', 'post_remove'):
+        lowers = set(hierarchy.edge(instance.pk, pk, reverse)[0] for pk in pk_set)
+        hierarchy.refresh(hierarchy.subtree(lowers, using), using)
+    elif action == 'post_clear':
+        lowers = getattr(instance, '_closure_lowers', set())
+        hierarchy.refresh(hierarchy.subtree(lowers, using), using)
+
+
+@receiver(pre_delete)
+def remember_subtrees(sender, instance=None, using='default', **kwargs):
+    hierarchies = model_hierarchies(sender)
+    if hierarchies:
+        instance._closure_subtrees = [(hierarchy, hierarchy.subtree([instance.pk], using) - {instance.pk})
+                                      for hierarchy in hierarchies]
+
+
+@receiver(post_delete)
+def refresh_subtrees(sender, instance=None, using='default', **kwargs):
+    for hierarchy, below in getattr(instance, '_closure_subtrees', []):
+        hierarchy.refresh(below, using)
@@ -0,0 +1,121 @@
+import calendar
+import hashlib
+from collections import defaultdict
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from api.caching import cleared_pks, foreign_keys, previous_foreign_keys
+from api.models import Sense, Artist, Place, Song, Domain, SemanticClass, Annotation, Dictionary, Example
+from api.serializers import requested_fields
+
+
+###
+# Conditional GET for `retrieve` and `highlight`.
+#
+# Validators come from each object's `updated` timestamp. Besides the object's
+# own saves, the receivers below bump it when its many-to-many relations
+# change, when an annotation pointing (or that used to point) at it changes,
+# when an example annotated with it changes, and (for songs and places) when
+# one of their examples or artists changes.
+###
+
+TIMESTAMPED_MODELS = (Sense, Artist, Place, Song, Domain, SemanticClass, Annotation, Dictionary, Example)
+
+
+class NotModified(Exception):
+
+    def __init__(self, response):
+        super(NotModified, self).__init__()
+        self.response = response
+
+
+class ConditionalGetMixin(object):
+    """
+    ETag and Last-Modified support for the `retrieve` and `highlight` actions.
+    A request whose validators match is answered with 304 before the
+    serializer or the template runs.
+    """
+    conditional_actions = ('retrieve', 'highlight')
+
+    def get_object(self):
+        if getattr(self, '_object', None) is None:
+            self._object = super(ConditionalGetMixin, self).get_object()
+        return self._object
+
+    def get_etag(self, obj):
+        # ?fields= and ?omit= change the representation, however they are spelled
+        keep = requested_fields(self.get_serializer_class(), self.request.query_params)
+        key = ":".join([obj._meta.label, str(obj.pk), obj.updated.isoformat(), self.action,
+                        self.request.accepted_renderer.format, ",".join(sorted(keep)) if keep is not None else "*"])
+        return '"' + hashlib.md5(key.encode('utf-8')).hexdigest() + '"'
+
+    def initial(self, request, *args, **kwargs):
+        super(ConditionalGetMixin, self).initial(request, *args, **kwargs)
+        self.etag = self.last_modified = None
+        if self.action in self.conditional_actions and request.method in ('GET', 'HEAD'):
+            obj = self.get_object()
+            self.etag = self.get_etag(obj)
+            self.last_modified = calendar.timegm(obj.updated.utctimetuple())
+            response = get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+            if response is not None:
+                raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super(ConditionalGetMixin, self).handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ConditionalGetMixin, self).finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            response['Last-Modified'] = http_date(self.last_modified)
+        return response
+
+
+def touch(model, pks):
+    pks = [pk for pk in pks if pk is not None]
+    if pks and model in TIMESTAMPED_MODELS:
+        model.objects.filter(pk__in=pks).update(updated=timezone.now())
+
+
+@receiver(m2m_changed)
+def touch_related_objects(sender, instance=None, action=None, reverse=False, model=None, pk_set=None,
+                          using='default', **kwargs):
+    # api.caching remembers what clear() removes
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        pk_set = cleared_pks(instance, sender)
+    touch(type(instance), [instance.pk])
+    if pk_set:
+        touch(model, pk_set)
+
+
+@receiver(post_save, sender=Annotation)
+@receiver(post_delete, sender=Annotation)
+def touch_annotated_objects(sender, instance=None, **kwargs):
+    # the targets it was moved away from lose it too
+    touched = defaultdict(set)
+    for model, pk in foreign_keys(instance) | previous_foreign_keys(instance):
+        touched[model].add(pk)
+    for model, pks in touched.items():
+        touch(model, pks)
+
+
+@receiver(post_save, sender=Example)
+@receiver(post_delete, sender=Example)
+def touch_example_pages(sender, instance=None, **kwargs):
+    touch(Song, [instance.from_song_id] + [pk for model, pk in previous_foreign_keys(instance) if model is Song])
+    # the highlight pages of its annotations' targets show its text
+    targets = Annotation.objects.filter(example_id=instance.pk).values_list('sense_id', 'artist_id', 'place_id')
+    for model, pks in zip((Sense, Artist, Place), zip(*targets)):
+        touch(model, set(pks))
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+def touch_origin(sender, instance=None, **kwargs):
+    touch(Place, [instance.origin_id] + [pk for model, pk in previous_foreign_keys(instance) if model is Place])
@@ -0,0 +1,75 @@
+import json
+from collections import OrderedDict
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import prefetch_related_objects
+from api.models import Sense, Artist, Place, Song, Domain, SemanticClass, Annotation, Dictionary, Example
+
+
+###
+# NDJSON export, one model at a time.
+#
+# Rows are read in primary key order, a chunk per query (keyset, so deep
+# chunks cost the same as the first), and everything each chunk's to_dict()
+# output reaches is prefetched for the chunk as a whole. Only one chunk is
+# held at a time, so memory stays flat however large the table.
+###
+
+EXPORT_CHUNK_SIZE = 500
+
+# what Example.to_xref() reaches
+EXAMPLE_XREF = ('from_song', 'primary_artists', 'featured_artists', 'annotations__sense', 'annotations__artist',
+                'annotations__place', 'annotations__rhymes')
+
+
+def example_xrefs(relation):
+    return tuple(relation + '__' + lookup for lookup in EXAMPLE_XREF)
+
+
+# name: (model, select_related, prefetch_related) in the order a dump is written
+EXPORTS = OrderedDict([
+    ('places', (Place, (), ('artists', 'contains') + example_xrefs('mentioned_in'))),
+    ('artists', (Artist, ('origin',), ('also_known_as', 'members', 'primary_songs__primary_artists',
+                                       'primary_songs__featured_artists', 'featured_songs__primary_artists',
+                                       'featured_songs__featured_artists') +
+                 example_xrefs('primary_examples') + example_xrefs('featured_examples') +
+                 example_xrefs('mentioned_in'))),
+    ('songs', (Song, (), ('primary_artists', 'featured_artists'))),
+    ('examples', (Example, ('from_song',), ('primary_artists', 'featured_artists'))),
+    ('annotations', (Annotation, ('example__from_song', 'sense', 'artist', 'place'),
+                     ('rhymes__sense', 'rhymes__artist', 'rhymes__place', 'rhymes__rhymes') +
+                     example_xrefs('example')[1:])),
+    ('senses', (Sense, (), example_xrefs('mentioned_in'))),
+    ('domains', (Domain, (), ())),
+    ('semantic-classes', (SemanticClass, (), ())),
+    ('dictionaries', (Dictionary, (), ())),
+])
+
+
+def iter_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        chunk = list(chunk[:chunk_size].iterator())
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1].pk
+
+
+def export_records(name, chunk_size=EXPORT_CHUNK_SIZE):
+    model, select, prefetch = EXPORTS[name]
+    queryset = model._default_manager.all()
+    if select:
+        queryset = queryset.select_related(*select)
+    for chunk in iter_chunks(queryset, chunk_size):
+        if model is Sense:
+            Sense.objects.load_relations(chunk)
+        prefetch_related_objects(chunk, *prefetch)
+        for obj in chunk:
+            yield obj.to_dict()
+
+
+def export_lines(name, chunk_size=EXPORT_CHUNK_SIZE):
+    for record in export_records(name, chunk_size):
+        yield json.dumps(record, cls=DjangoJSONEncoder) + "\n"
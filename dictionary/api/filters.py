@@ -1,10 +1,60 @@
 import django_filters
 from api.models import Artist, Song, Place, Sense, Example
 from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+from django_filters.constants import EMPTY_VALUES
+from api.geo import box_filter, parse_bbox
+from api.search import search_lyrics, search_similar
+
+
+class TrigramFilter(django_filters.CharFilter):
+    """
+    Fuzzy match on `name`, most similar first, so misspellings still find something.
+    """
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        return search_similar(qs, self.name, value)
+
+
+class WithinFilter(django_filters.CharFilter):
+    """
+    Rows whose place (`name`) is the place with the given slug or inside it:
+    directly, or at any depth with `recursive=1`. Places themselves
+    (`name='pk'`) are filtered to the ones inside it.
+    """
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        recursive = self.parent.data.get('recursive') in ('1', 'true', 'True')
+        places = Place.objects.within(value, recursive, inclusive=self.name != 'pk')
+        qs = qs.filter(**{self.name + '__in': places.values('pk')})
+        return qs.distinct() if self.distinct else qs
+
+
+class BoundingBoxFilter(django_filters.CharFilter):
+    """
+    Rows whose place (`name`, or the places themselves with `name='pk'`) lies
+    in the box "west,south,east,north"; west > east crosses the antimeridian.
+    """
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        try:
+            box = parse_bbox(value)
+        except ValueError as e:
+            raise ValidationError({'bbox': [str(e)]})
+        return qs.filter(box_filter(*box, prefix="" if self.name == 'pk' else self.name + "__"))
 
 
 class ArtistFilter(filters.FilterSet):
     name = django_filters.CharFilter(lookup_expr='icontains')
+    name_fuzzy = TrigramFilter(name='name')
+    within = WithinFilter(name='origin')
+    bbox = BoundingBoxFilter(name='origin')
 
     class Meta:
         model = Artist
@@ -14,7 +64,10 @@ class ArtistFilter(filters.FilterSet):
 class PlaceFilter(filters.FilterSet):
     name = django_filters.CharFilter(lookup_expr='icontains')
     full_name = django_filters.CharFilter(lookup_expr='icontains')
+    full_name_fuzzy = TrigramFilter(name='full_name')
     artists = django_filters.CharFilter(name="artists__name", lookup_expr='icontains', )
+    within = WithinFilter(name='pk')
+    bbox = BoundingBoxFilter(name='pk')
 
     class Meta:
         model = Place
@@ -24,6 +77,7 @@ class PlaceFilter(filters.FilterSet):
 class ExampleFilter(filters.FilterSet):
     text = django_filters.CharFilter(lookup_expr='icontains')
     primary_artists_name = django_filters.CharFilter(name="primary_artists__name", lookup_expr='icontains', )
+    within = WithinFilter(name='mentions_place', distinct=True)
 
     class Meta:
         model = Example
@@ -32,6 +86,7 @@ class ExampleFilter(filters.FilterSet):
 
 class SenseFilter(filters.FilterSet):
     headword = django_filters.CharFilter(lookup_expr='icontains')
+    headword_fuzzy = TrigramFilter(name='headword')
     definition = django_filters.CharFilter(lookup_expr='icontains')
     part_of_speech = django_filters.CharFilter(lookup_expr='icontains')
 
@@ -41,7 +96,7 @@ class SenseFilter(filters.FilterSet):
 
 
 class SongFilter(filters.FilterSet):
-    lyrics = django_filters.CharFilter(lookup_expr='icontains')
+    lyrics = django_filters.CharFilter(method='filter_lyrics')
     release_date_string = django_filters.CharFilter(lookup_expr='icontains')
     primary_artists_name = django_filters.CharFilter(name="primary_artists__name", lookup_expr='icontains', )
     featured_artists_name = django_filters.CharFilter(name="featured_artists__name", lookup_expr='icontains', )
@@ -50,4 +105,7 @@ class SongFilter(filters.FilterSet):
         model = Song
         fields = ['album', 'release_date']
 
+    def filter_lyrics(self, queryset, name, value):
+        return search_lyrics(queryset, value)
+
 
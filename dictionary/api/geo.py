@@ -0,0 +1,234 @@
+import math
+from django.db.models import Q, Count, Avg, Min
+from django.db.models.functions import Substr
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from api.models import Place
+
+
+###
+# Spatial lookups on Place.latitude/longitude without a geometry backend.
+#
+# Every place with coordinates stores their geohash, a string whose prefixes
+# name ever smaller cells of the globe, in an indexed column. A bounding box
+# becomes a handful of cells, each of which is one range scan on that index,
+# and the exact coordinates only trim the cells' overhang. Nearest-place
+# queries widen a box around the point until it holds enough places, and the
+# map clusters group by geohash prefix in the database, so none of them load
+# more rows than they return.
+###
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 9
+MAX_COVER_CELLS = 32
+EARTH_RADIUS_KM = 6371.0
+NEAREST_START_KM = 25.0
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    latitude, longitude = float(latitude), float(longitude)
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        if even:
+            middle = (west + east) / 2
+            value = value * 2 + (longitude >= middle)
+            west, east = (middle, east) if longitude >= middle else (west, middle)
+        else:
+            middle = (south + north) / 2
+            value = value * 2 + (latitude >= middle)
+            south, north = (middle, north) if latitude >= middle else (south, middle)
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def place_geohash(place):
+    if place.latitude is None or place.longitude is None:
+        return ""
+    return encode(place.latitude, place.longitude)
+
+
+def cell_size(precision):
+    """
+    (height, width) in degrees of the cells named by geohashes of `precision`.
+    """
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def prefix_upper(prefix):
+    """
+    The first geohash after every one starting with `prefix`, or None.
+    """
+    while prefix and prefix[-1] == GEOHASH_ALPHABET[-1]:
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + GEOHASH_ALPHABET[GEOHASH_ALPHABET.index(prefix[-1]) + 1]
+
+
+def cell_indices(low, high, offset, size, count):
+    return range(max(int((low + offset) // size), 0), min(int((high + offset) // size), count - 1) + 1)
+
+
+def covering_cells(south, west, north, east):
+    """
+    The geohash prefixes of the smallest cells of which at most
+    MAX_COVER_CELLS cover the box.
+    """
+    cells = [""]
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        height, width = cell_size(precision)
+        rows = cell_indices(south, north, 90.0, height, int(round(180.0 / height)))
+        columns = cell_indices(west, east, 180.0, width, int(round(360.0 / width)))
+        if len(rows) * len(columns) > MAX_COVER_CELLS:
+            break
+        cells = [encode(-90.0 + (row + 0.5) * height, -180.0 + (column + 0.5) * width, precision)
+                 for row in rows for column in columns]
+    return cells
+
+
+def cell_ranges(cells):
+    """
+    [lower, upper) geohash ranges for the `cells`, adjacent ones merged.
+    """
+    ranges = []
+    for cell in sorted(cells):
+        upper = prefix_upper(cell)
+        if ranges and ranges[-1][1] == cell:
+            ranges[-1][1] = upper
+        else:
+            ranges.append([cell, upper])
+    return ranges
+
+
+def split_box(south, west, north, east):
+    """
+    A box that crosses the antimeridian (`west` > `east`) as two that don't.
+    """
+    if west > east:
+        return [(south, west, north, 180.0), (south, -180.0, north, east)]
+    return [(south, west, north, east)]
+
+
+def box_filter(south, west, north, east, prefix=""):
+    """
+    Q for the rows whose place lies in the box; `prefix` is the lookup path
+    to the place, e.g. "origin__".
+    """
+    condition = Q(pk__in=[])
+    for box in split_box(south, west, north, east):
+        cells = Q(pk__in=[])
+        for lower, upper in cell_ranges(covering_cells(*box)):
+            cell = Q(**{prefix + "geohash__gte": lower})
+            if upper is not None:
+                cell &= Q(**{prefix + "geohash__lt": upper})
+            cells |= cell
+        condition |= cells & Q(**{prefix + "latitude__gte": box[0], prefix + "latitude__lte": box[2],
+                                  prefix + "longitude__gte": box[1], prefix + "longitude__lte": box[3]})
+    return condition
+
+
+def parse_bbox(value):
+    """
+    (south, west, north, east) from a GeoJSON-ordered "west,south,east,north".
+    """
+    try:
+        west, south, east, north = [float(part) for part in value.split(",")]
+    except ValueError:
+        raise ValueError("Expected west,south,east,north in degrees.")
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError("Latitudes must lie in [-90, 90] with south <= north, longitudes in [-180, 180].")
+    return south, west, north, east
+
+
+def distance_km(latitude, longitude, other_latitude, other_longitude):
+    phi, other_phi = math.radians(float(latitude)), math.radians(float(other_latitude))
+    d_phi = other_phi - phi
+    d_lambda = math.radians(float(other_longitude) - float(longitude))
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi) * math.cos(other_phi) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_box(latitude, longitude, radius_km):
+    """
+    The box around the point that holds the circle of `radius_km`.
+    """
+    d_latitude = math.degrees(radius_km / EARTH_RADIUS_KM)
+    south, north = max(latitude - d_latitude, -90.0), min(latitude + d_latitude, 90.0)
+    if south == -90.0 or north == 90.0:
+        return south, -180.0, north, 180.0
+    d_longitude = d_latitude / math.cos(math.radians(max(abs(south), abs(north))))
+    if d_longitude >= 180.0:
+        return south, -180.0, north, 180.0
+    west, east = longitude - d_longitude, longitude + d_longitude
+    return south, (west + 540.0) % 360.0 - 180.0, north, (east + 540.0) % 360.0 - 180.0
+
+
+def nearest(queryset, latitude, longitude, k):
+    """
+    The `k` places of `queryset` nearest the point, nearest first, each with
+    its `distance` in kilometres. The search box doubles until the circle it
+    holds contains `k` places, or covers the globe.
+    """
+    radius = NEAREST_START_KM
+    while True:
+        everywhere = radius >= math.pi * EARTH_RADIUS_KM
+        if everywhere:
+            candidates = queryset.exclude(latitude=None).exclude(longitude=None)
+        else:
+            candidates = queryset.filter(box_filter(*radius_box(latitude, longitude, radius)))
+        found = []
+        for place in candidates:
+            place.distance = distance_km(latitude, longitude, place.latitude, place.longitude)
+            if everywhere or place.distance <= radius:
+                found.append(place)
+        if len(found) >= k or everywhere:
+            return sorted(found, key=lambda p: (p.distance, p.pk))[:k]
+        radius *= 2
+
+
+def cluster_precision(zoom):
+    """
+    The geohash precision whose cells are about a quarter of a map tile
+    wide at `zoom`.
+    """
+    tile_width = 360.0 / 2 ** (zoom + 2)
+    precision = 1
+    while precision < GEOHASH_PRECISION and cell_size(precision + 1)[1] >= tile_width:
+        precision += 1
+    return precision
+
+
+def clusters(queryset, zoom, prefix=""):
+    """
+    One row per occupied cell at `zoom`: its prefix, how many rows it holds,
+    their mean position, and the slug and name of its first place (enough
+    to label a cluster of one).
+    """
+    geohash = prefix + "geohash"
+    return queryset.exclude(**{geohash: ""}).order_by() \
+        .annotate(cell=Substr(geohash, 1, cluster_precision(zoom))).values('cell') \
+        .annotate(count=Count('pk'), latitude=Avg(prefix + "latitude"), longitude=Avg(prefix + "longitude"),
+                  slug=Min('slug'), name=Min('name')).order_by('cell')
+
+
+def cluster_features(rows, layer):
+    for row in rows:
+        properties = {"layer": layer, "cell": row['cell'], "count": row['count']}
+        if row['count'] == 1:
+            properties.update(slug=row['slug'], name=row['name'])
+        yield {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(row['longitude']), float(row['latitude'])]},
+            "properties": properties,
+        }
+
+
+@receiver(pre_save, sender=Place)
+def store_geohash(sender, instance=None, raw=False, **kwargs):
+    instance.geohash = place_geohash(instance)
@@ -0,0 +1,110 @@
+from django.urls import reverse, NoReverseMatch
+from rest_framework.relations import HyperlinkedRelatedField, HyperlinkedIdentityField
+from rest_framework.reverse import preserve_builtin_query_params
+
+
+###
+# URL building without reverse().
+#
+# The router's `{basename}-detail` and `{basename}-highlight` routes are
+# reversed once per process (and format suffix) with a placeholder pk, and
+# URLs are then formatted straight from pks. Anything else falls back to
+# reverse().
+###
+
+PK_PLACEHOLDER = "PKPLACEHOLDER"
+ROUTE_SUFFIXES = ('detail', 'highlight')
+
+_templates = {}
+_prefixes = {}
+
+
+def router_registry():
+    from api.urls import router
+    return router.registry
+
+
+def url_template(view_name, format=None):
+    """
+    (before, after) the pk in the path of `view_name`, or None if it isn't a
+    precompiled route.
+    """
+    key = (view_name, format)
+    if key not in _templates:
+        template = None
+        if view_name.rsplit('-', 1)[-1] in ROUTE_SUFFIXES:
+            kwargs = {'pk': PK_PLACEHOLDER}
+            if format:
+                kwargs['format'] = format
+            try:
+                template = tuple(reverse(view_name, kwargs=kwargs).split(PK_PLACEHOLDER, 1))
+            except NoReverseMatch:
+                pass
+        _templates[key] = template
+    return _templates[key]
+
+
+def detail_view_name(object_type):
+    """
+    The detail route of the router prefix `object_type` (e.g. 'semantic-classes').
+    """
+    if not _prefixes:
+        _prefixes.update((prefix, basename + '-detail') for prefix, viewset, basename in router_registry())
+    return _prefixes[object_type]
+
+
+def base_uri(request):
+    # scheme and host are the same for every link in a response
+    if not hasattr(request, '_base_uri'):
+        request._base_uri = request.build_absolute_uri('/')[:-1]
+    return request._base_uri
+
+
+def build_path(view_name, pk, format=None):
+    template = url_template(view_name, format)
+    if template is None:
+        kwargs = {'pk': pk}
+        if format:
+            kwargs['format'] = format
+        return reverse(view_name, kwargs=kwargs)
+    return template[0] + str(pk) + template[1]
+
+
+def build_url(view_name, pk, request=None, format=None):
+    path = build_path(view_name, pk, format)
+    if request is None:
+        return path
+    return preserve_builtin_query_params(base_uri(request) + path, request)
+
+
+class FastUrlMixin(object):
+    """
+    Also looks hyperlinked objects up in the `resolved_objects` context
+    ({model: {pk string: instance}}) that bulk writes fill in advance.
+    """
+
+    def get_url(self, obj, view_name, request, format):
+        if self.lookup_field != 'pk' or getattr(request, 'versioning_scheme', None) is not None \
+                or url_template(view_name, format) is None:
+            return super(FastUrlMixin, self).get_url(obj, view_name, request, format)
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+        return build_url(view_name, obj.pk, request, format)
+
+    def get_object(self, view_name, view_args, view_kwargs):
+        model = self.get_queryset().model
+        resolved = self.context.get('resolved_objects', {})
+        if model not in resolved:
+            return super(FastUrlMixin, self).get_object(view_name, view_args, view_kwargs)
+        try:
+            return resolved[model][str(view_kwargs[self.lookup_url_kwarg])]
+        except KeyError:
+            raise model.DoesNotExist
+
+
+class FastHyperlinkedRelatedField(FastUrlMixin, HyperlinkedRelatedField):
+    pass
+
+
+class FastHyperlinkedIdentityField(FastUrlMixin, HyperlinkedIdentityField):
+    pass
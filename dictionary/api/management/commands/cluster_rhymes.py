@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.models import Annotation
+from api.rhymes import rebuild_clusters
+
+
+class Command(BaseCommand):
+    help = "Recompute every rhyme family from the annotations' rhymes."
+
+    def handle(self, *args, **options):
+        start = time.time()
+        with transaction.atomic():
+            changed = rebuild_clusters()
+        families = Annotation.objects.exclude(rhyme_cluster=None).order_by().values('rhyme_cluster').distinct().count()
+        self.stdout.write("%d annotations changed family; %d families in %.1fs" % (changed, families, time.time() - start))
+        self.stdout.write(self.style.SUCCESS("Done!"))
@@ -0,0 +1,34 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.export import EXPORTS, EXPORT_CHUNK_SIZE, export_lines
+
+
+class Command(BaseCommand):
+    help = "Export the dictionary as one NDJSON file per model."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Directory for the <model>.ndjson files, or - for stdout")
+        parser.add_argument('--model', action='append', dest='models', choices=list(EXPORTS),
+                            help="Only export this model (repeatable)")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help="Rows read per query")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        names = options['models'] or list(EXPORTS)
+        output = options['output']
+        if output == '-':
+            for name in names:
+                for line in export_lines(name, options['chunk_size']):
+                    self.stdout.write(line, ending='')
+            return
+        os.makedirs(output, exist_ok=True)
+        for name in names:
+            start, count = time.time(), 0
+            with open(os.path.join(output, name + ".ndjson"), "w", encoding='utf-8') as f:
+                for line in export_lines(name, options['chunk_size']):
+                    f.write(line)
+                    count += 1
+            self.stdout.write("Exported %d %s in %.1fs" % (count, name, time.time() - start))
+        self.stdout.write(self.style.SUCCESS("Done!"))
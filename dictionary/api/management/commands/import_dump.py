@@ -0,0 +1,192 @@
+import json
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import transaction
+from api.management.commands.seed_database import extract_dict, persist_records, IdentityMap
+
+
+RECORD_TYPES = ("sense", "song", "artist", "example", "place")
+
+
+class Command(BaseCommand):
+    help = "Import a local NDJSON or JSON-array dump of senses, artists, places, songs and examples."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dump', help="Path to the dump (.ndjson/.jsonl: one record per line; otherwise a JSON array)")
+        parser.add_argument('--what',
+                            default=None,
+                            help="Type of records that carry no \"type\" key (sense | song | artist | example | place)")
+        parser.add_argument('--batch-size', type=int, default=500, help="Records committed per transaction")
+        parser.add_argument('--checkpoint', default=None, help="Checkpoint file (default: <dump>.checkpoint)")
+        parser.add_argument('--resume', action='store_true', help="Carry on after the last committed batch")
+
+    def handle(self, *args, **options):
+        owner = User.objects.filter(is_superuser=True).first()
+        if owner is None:
+            raise CommandError("Add a superuser first!")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        path = options['dump']
+        checkpoint_path = options['checkpoint'] or path + ".checkpoint"
+        done, offset = 0, 0
+        if options['resume']:
+            done, offset = read_checkpoint(checkpoint_path, path)
+            self.stdout.write("Resuming after %d records" % done)
+
+        importer = DumpImporter(owner, options['what'], options['batch_size'], self.report)
+        # NDJSON is read as bytes so the resume offset is counted, not asked of the file
+        with (open(path, 'rb') if is_ndjson(path) else open(path, encoding='utf-8')) as stream:
+            records = iter_dump(stream, path, done, offset)
+            try:
+                importer.run(records, lambda count, position: write_checkpoint(checkpoint_path, path, count,
+                                                                               position))
+            except Exception as e:
+                raise CommandError("Import stopped after %d records (%s). Fix the dump and rerun with --resume."
+                                   % (importer.committed + done, e))
+        self.stdout.write(self.style.SUCCESS("Imported %d records" % importer.committed))
+
+    def report(self, committed, elapsed):
+        rate = committed / elapsed if elapsed else 0
+        self.stdout.write("%d records, %.0f rows/s" % (committed, rate))
+
+
+class DumpImporter(object):
+    """
+    Persists records through the seed_database pipeline, one transaction per
+    batch, calling `checkpoint(count, position)` after each commit. One
+    identity map serves the whole run.
+    """
+
+    def __init__(self, owner, what, batch_size, report):
+        self.owner = owner
+        self.what = what
+        self.batch_size = batch_size
+        self.report = report
+        self.committed = 0
+        self.identity = IdentityMap()
+
+    def record_type(self, record):
+        what = record.get("type", self.what)
+        if what not in RECORD_TYPES:
+            raise ValueError("unknown record type %r" % (what,))
+        return what
+
+    def run(self, records, checkpoint):
+        start = time.time()
+        batch, count, position = [], 0, 0
+        for count, position, record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.commit(batch)
+                checkpoint(count, position)
+                self.report(self.committed, time.time() - start)
+                batch = []
+        if batch:
+            self.commit(batch)
+            checkpoint(count, position)
+            self.report(self.committed, time.time() - start)
+
+    def commit(self, batch):
+        records = []
+        for record in batch:
+            what = self.record_type(record)
+            records.append((what, extract_dict(record, self.owner, what)))
+        with transaction.atomic():
+            persist_records(records, self.identity)
+        self.committed += len(batch)
+
+
+def is_ndjson(path):
+    return os.path.splitext(path)[1].lower() in ('.ndjson', '.jsonl')
+
+
+def iter_dump(stream, path, skip=0, offset=0):
+    """
+    (records read, resume offset, record) for each record after the first
+    `skip`. NDJSON dumps are resumed by seeking to `offset`; JSON arrays are
+    re-read, skipping the records already imported.
+    """
+    if is_ndjson(path):
+        stream.seek(offset)
+        return iter_ndjson(stream, skip, offset)
+    return ((count, 0, record) for count, record in enumerate(iter_json_array(stream), 1) if count > skip)
+
+
+def iter_ndjson(stream, count=0, offset=0):
+    """
+    (records read, byte offset after the record, record) for each line of
+    the binary `stream`, which starts `offset` bytes into the file.
+    """
+    for line in stream:
+        offset += len(line)
+        if line.strip():
+            count += 1
+            yield count, offset, json.loads(line.decode('utf-8'))
+
+
+def iter_json_array(stream, chunk_size=1 << 16):
+    """
+    The objects of a top-level JSON array, decoded one at a time from
+    `stream`, so memory is bounded by the largest record.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = "", 0, False
+
+    def next_char():
+        nonlocal buffer, position, eof
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or eof:
+                return buffer[position] if position < len(buffer) else ""
+            buffer, position = stream.read(chunk_size), 0
+            eof = not buffer
+
+    if next_char() != "[":
+        raise ValueError("Expected a JSON array")
+    position += 1
+    first = True
+    while True:
+        char = next_char()
+        if char == "]":
+            return
+        if not first:
+            if char != ",":
+                raise ValueError("Expected ',' or ']' in the JSON array")
+            position += 1
+            next_char()
+        if buffer[position:position + 1] != "{":
+            raise ValueError("Expected an object in the JSON array")
+        while True:
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+                break
+            except ValueError:
+                more = stream.read(chunk_size)
+                if not more:
+                    raise
+                buffer, position = buffer[position:] + more, 0
+        buffer, position = buffer[end:], 0
+        first = False
+        yield record
+
+
+def read_checkpoint(checkpoint_path, path):
+    try:
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    except (IOError, ValueError):
+        raise CommandError("No usable checkpoint at %s" % checkpoint_path)
+    if checkpoint.get("dump") != os.path.abspath(path):
+        raise CommandError("%s belongs to another dump" % checkpoint_path)
+    return checkpoint["records"], checkpoint["offset"]
+
+
+def write_checkpoint(checkpoint_path, path, records, offset):
+    partial = checkpoint_path + ".tmp"
+    with open(partial, "w") as f:
+        json.dump({"dump": os.path.abspath(path), "records": records, "offset": offset}, f)
+    os.replace(partial, checkpoint_path)
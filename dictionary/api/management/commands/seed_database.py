@@ -1,19 +1,49 @@
 import json
+import logging
+import os
+import time
 import requests
+from collections import defaultdict, OrderedDict
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.text import slugify
 import django.conf.global_settings as settings
 from django.contrib.auth.models import User
 from api.models import Sense, Artist, Song, Example, Place
+from api.bulk import assign_ids, through_rows, written
+from api.geo import place_geohash
+from api.rendering import render_example
+from api.search import index_songs_lyrics
 from api.utils import clean_text
 
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = os.environ.get("SEED_BASE_URL", "https://www.therightrhymes.com/data")
+
+RANDOM_PATHS = {
+    "song": "/songs/random",
+    "sense": "/senses/random",
+    "place": "/places/random",
+    "artist": "/artists/random",
+    "example": "/examples/random",
+}
+
+
 class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--what',
                             default="sense",
                             help="What would you like to seed? (sense | song | artist | example | place)")
+        parser.add_argument('--count', type=int, default=1, help="How many random items to fetch")
+        parser.add_argument('--concurrency', type=int, default=1, help="How many fetches to run at once")
+        parser.add_argument('--batch-size', type=int, default=50, help="Items persisted per transaction")
+        parser.add_argument('--base-url', default=DEFAULT_BASE_URL, help="Where to fetch random items from")
+        parser.add_argument('--retries', type=int, default=3, help="Retries per fetch, with exponential backoff")
+        parser.add_argument('--timeout', type=float, default=10, help="Seconds before a fetch is abandoned")
 
     def handle(self, *args, **options):
         owner = User.objects.first()
@@ -21,34 +51,97 @@ class Command(BaseCommand):
             what = "sense"
             if 'what' in options:
                 what = options['what']
-            r = random_pipeline(owner, what)
-            print(r)
+            if what not in RANDOM_PATHS:
+                raise CommandError("Can't seed %r" % what)
+            if options['count'] < 1 or options['concurrency'] < 1 or options['batch_size'] < 1:
+                raise CommandError("--count, --concurrency and --batch-size must be at least 1")
+            start = time.time()
+            persisted = seed_pipeline(owner, what, options['count'], options['concurrency'], options['batch_size'],
+                                      options['base_url'], options['retries'], options['timeout'])
+            if options['count'] == 1:
+                print(persisted[0] if persisted else None)
+            self.stdout.write("Seeded %d of %d in %.1fs" % (len(persisted), options['count'], time.time() - start))
             self.stdout.write(self.style.SUCCESS('Done!'))
         else:
             self.stdout.write(self.style.SUCCESS('Add a superuser first!'))
 
 
-def get_random_thing(what="sense"):
-    urls = {
-        "song": "https://www.therightrhymes.com/data/songs/random",
-        "sense": "https://www.therightrhymes.com/data/senses/random",
-        "place": "https://www.therightrhymes.com/data/places/random",
-        "artist": "https://www.therightrhymes.com/data/artists/random",
-        "example": "https://www.therightrhymes.com/data/examples/random",
-    }
+def make_session(pool_size=1):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-    if what in urls:
-        url = urls[what]
 
-        try:
-            r = requests.get(url)
-        except Exception as e:
-            print(e)
-        else:
-            return json.loads(r.text)
+def get_random_thing(what="sense", session=None, base_url=DEFAULT_BASE_URL, retries=0, backoff=0.5, timeout=None):
+    if what in RANDOM_PATHS:
+        url = base_url.rstrip("/") + RANDOM_PATHS[what]
+        client = session or requests
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(backoff * 2 ** (attempt - 1))
+            try:
+                r = client.get(url, timeout=timeout)
+            except requests.RequestException as e:
+                logger.warning("Fetching %s failed: %s", url, e)
+                continue
+            if r.status_code >= 500:
+                logger.warning("%d from %s", r.status_code, url)
+                continue
+            if r.status_code >= 400:
+                # asking again won't help
+                logger.error("%d from %s", r.status_code, url)
+                return None
+            try:
+                return json.loads(r.text)
+            except ValueError as e:
+                logger.error("Bad JSON from %s: %s", url, e)
+                return None
     return None
 
 
+def fetch_random_things(what, count, concurrency=1, base_url=DEFAULT_BASE_URL, retries=3, backoff=0.5, timeout=10):
+    """
+    Yield `count` fetch results (None where a fetch gave up) as they arrive,
+    with at most `concurrency` requests in flight over one pooled session.
+    """
+    session = make_session(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending, submitted = set(), 0
+        while submitted < count or pending:
+            while submitted < count and len(pending) < concurrency:
+                pending.add(executor.submit(get_random_thing, what, session, base_url, retries, backoff, timeout))
+                submitted += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def persist_batch(owner, what, results, identity=None):
+    with transaction.atomic():
+        return persist_records([(what, extract_dict(result, owner, what)) for result in results], identity)
+
+
+def seed_pipeline(owner, what, count=1, concurrency=1, batch_size=50, base_url=DEFAULT_BASE_URL, retries=3,
+                  timeout=10):
+    """
+    Fetch `count` random items concurrently and persist them from this
+    thread only, one transaction per `batch_size` items.
+    """
+    identity = IdentityMap()
+    persisted, batch = [], []
+    for result in fetch_random_things(what, count, concurrency, base_url, retries, timeout=timeout):
+        if result:
+            batch.append(result)
+        if len(batch) >= batch_size:
+            persisted += persist_batch(owner, what, batch, identity)
+            batch = []
+    if batch:
+        persisted += persist_batch(owner, what, batch, identity)
+    return persisted
+
+
 def extract_dict(result, owner, what="sense"):
     keys = {
         "sense": ('headword', 'part_of_speech', 'definition', 'notes', 'etymology'),
@@ -64,58 +157,247 @@ def extract_dict(result, owner, what="sense"):
     return s
 
 
-def persist(what, data_dict):
-    if what == 'sense':
-        obj, created = Sense.objects.get_or_create(**data_dict)
-    elif what == 'artist':
-        obj = create_an_artist(data_dict)
-    elif what == 'place':
-        obj, created = Place.objects.get_or_create(**data_dict)
-    elif what == 'song':
-        featured_artists, primary_artists, data_dict = extract_and_process_artists(data_dict)
-        obj = create_a_song(data_dict, featured_artists, primary_artists)
-    elif what == 'example':
-        featured_artists, primary_artists, data_dict = extract_and_process_artists(data_dict)
-        obj = create_an_example(data_dict, featured_artists, primary_artists)
+def persist(what, data_dict, identity=None):
+    return persist_records([(what, data_dict)], identity)[0]
+
+
+NATURAL_KEYS = {
+    Place: ('full_name',),
+    Artist: ('slug',),
+    Song: ('title', 'album', 'release_date_string'),
+    Example: ('text', 'from_song_id'),
+    Sense: ('headword', 'part_of_speech', 'definition'),
+}
+
+LOOKUP_CHUNK_SIZE = 400
+
+
+def natural_key(obj):
+    return tuple(getattr(obj, name) for name in NATURAL_KEYS[type(obj)])
+
+
+def model_attributes(model, data_dict):
+    names = set(field.name for field in model._meta.concrete_fields)
+    return dict((k, v) for k, v in data_dict.items() if k in names)
+
+
+class IdentityMap(object):
+    """
+    Every object written or looked up during a run, keyed on its natural key,
+    so an artist repeated across a dump is fetched or inserted only once.
+    """
+
+    def __init__(self, using='default'):
+        self.using = using
+        self.objects = defaultdict(dict)
+
+    def get(self, candidate):
+        return self.objects[type(candidate)][natural_key(candidate)]
+
+    def resolve(self, candidates):
+        """
+        Map unsaved candidates (all of one model) to stored objects, looking
+        the keys not seen yet up with one query per chunk and bulk-inserting
+        the rest. Returns the inserted objects.
+        """
+        if not candidates:
+            return []
+        model = type(candidates[0])
+        known = self.objects[model]
+        missing = OrderedDict()
+        for candidate in candidates:
+            key = natural_key(candidate)
+            if key not in known:
+                missing.setdefault(key, candidate)
+        manager = model._default_manager.using(self.using)
+        names = NATURAL_KEYS[model]
+        keys = list(missing)
+        for i in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+            chunk = keys[i:i + LOOKUP_CHUNK_SIZE]
+            stored = manager.filter(**dict((name + '__in', set(key[j] for key in chunk))
+                                           for j, name in enumerate(names)))
+            for obj in stored:
+                if natural_key(obj) in missing:
+                    known.setdefault(natural_key(obj), obj)
+        created = [candidate for key, candidate in missing.items() if key not in known]
+        manager.bulk_create(created)
+        assign_ids(model, created, self.using, names)
+        for obj in created:
+            known[natural_key(obj)] = obj
+        return created
+
+
+def place_candidate(data_dict):
+    data_dict = dict(data_dict)
+    # origins nested in artists carry no full_name, only their slug
+    data_dict.setdefault("full_name", data_dict.get("slug", ""))
+    place = Place(**model_attributes(Place, data_dict))
+    # bulk_create skips the pre_save receiver
+    place.geohash = place_geohash(place)
+    return place
+
+
+def artist_candidate(data_dict):
+    """
+    (artist, origin): the origin is an unsaved Place when it still has to be
+    resolved.
+    """
+    data_dict = dict(data_dict)
+    remove_image(data_dict)
+    origin = data_dict.pop("origin", None)
+    if isinstance(origin, dict):
+        origin = place_candidate(origin)
+    data_dict.setdefault("slug", slugify(data_dict.get("name", "")))
+    return Artist(**model_attributes(Artist, data_dict)), origin
+
+
+def example_candidate(data_dict):
+    text = clean_text(data_dict["text"])
+    return Example(text=text, slug=slugify(text), owner=data_dict["owner"],
+                   rendered=render_example(Example(text=text), []))
+
+
+def record_plan(what, data_dict):
+    plan = {"what": what}
+    if what == "sense":
+        plan["object"] = Sense(**model_attributes(Sense, data_dict))
+    elif what == "place":
+        plan["object"] = place_candidate(data_dict)
+    elif what == "artist":
+        plan["object"], plan["origin"] = artist_candidate(data_dict)
+    elif what in ("song", "example"):
+        plan["song"] = Song(**model_attributes(Song, data_dict))
+        plan["primary_artists"] = [artist_candidate(a) for a in data_dict.get("primary_artists", [])]
+        plan["featured_artists"] = [artist_candidate(a) for a in data_dict.get("featured_artists", [])]
+        plan["object"] = example_candidate(data_dict) if what == "example" else plan["song"]
     else:
-        obj = None
+        plan["object"] = None
         print("Failed to persist", what, ": ", str(data_dict))
-    return obj
+    return plan
 
 
-def create_an_artist(data_dict):
-    process_origin(data_dict)
-    remove_image(data_dict)
-    obj, created = Artist.objects.get_or_create(**data_dict)
-    return obj
+def persist_records(records, identity=None):
+    """
+    Persist (what, data_dict) records together. Each model's objects are
+    resolved through `identity` in one pass, places first and examples last,
+    and credited artists are linked with bulk-inserted through rows. If the
+    batch fails, its records are retried one at a time and those that still
+    fail are logged and skipped. Returns the object persisted for each
+    record (None for unknown types and skipped records).
+    """
+    identity = identity or IdentityMap()
+    persisted, plans = [None] * len(records), []
+    for i, (what, data_dict) in enumerate(records):
+        try:
+            plan = record_plan(what, data_dict)
+        except Exception:
+            logger.exception("Skipped a bad %s record: %r", what, data_dict)
+            continue
+        if plan["object"] is not None:
+            plans.append((i, plan))
+    try:
+        write_batch(plans, identity, persisted)
+    except Exception:
+        logger.warning("Batch of %d records failed, retrying them one at a time", len(plans), exc_info=True)
+        for i, plan in plans:
+            try:
+                write_batch([(i, plan)], identity, persisted)
+            except Exception:
+                logger.exception("Skipped a bad %s record: %r", plan["what"], records[i][1])
+    return persisted
+
+
+def write_batch(plans, identity, persisted):
+    """
+    Write `plans` ([(record index, plan)]) in one transaction, filling in
+    `persisted` at the record indexes.
+    """
+    try:
+        with transaction.atomic(using=identity.using):
+            write_plans([plan for i, plan in plans], identity)
+    except Exception:
+        # the rows inserted for these plans were rolled back
+        identity.objects.clear()
+        raise
+    for i, plan in plans:
+        persisted[i] = identity.get(plan["object"])
+
+
+def write_plans(plans, identity):
+    """
+    Resolve every object the plans mention, link the credited artists, and
+    do what the save and m2m_changed receivers would have done (the cache
+    invalidation waits for the commit).
+    """
+    credits = [plan for plan in plans if "song" in plan]
+    artists = [(plan["object"], plan["origin"]) for plan in plans if plan["what"] == "artist"]
+    artists += [a for plan in credits for a in plan["primary_artists"] + plan["featured_artists"]]
+
+    created = defaultdict(list)
+    created[Place] = identity.resolve(
+        [plan["object"] for plan in plans if plan["what"] == "place"] +
+        [origin for artist, origin in artists if isinstance(origin, Place) and origin.pk is None])
+    for artist, origin in artists:
+        if isinstance(origin, Place):
+            artist.origin = identity.get(origin) if origin.pk is None else origin
+    created[Artist] = identity.resolve([artist for artist, origin in artists])
+    created[Song] = identity.resolve([plan["song"] for plan in credits])
+    examples = [plan for plan in credits if plan["what"] == "example"]
+    for plan in examples:
+        plan["object"].from_song = identity.get(plan["song"])
+    created[Example] = identity.resolve([plan["object"] for plan in examples])
+    created[Sense] = identity.resolve([plan["object"] for plan in plans if plan["what"] == "sense"])
+
+    relations = defaultdict(dict)
+    for model, field in ((Song, "song"), (Example, "object")):
+        credited = [(identity.get(plan[field]), dict((name, [identity.get(a) for a, o in plan[name]])
+                                                     for name in ("primary_artists", "featured_artists")))
+                    for plan in credits if model is Song or plan["what"] == "example"]
+        relations[model] = link_artists(model, credited, identity.using)
+    index_songs_lyrics(created[Song], identity.using)
+    for model in (Place, Artist, Song, Example, Sense):
+        changed = list(OrderedDict((obj.pk, obj) for obj in created[model] + list(relations[model])).values())
+        if changed:
+            written(model, changed, [relations[model].get(obj, {}) for obj in changed], using=identity.using)
 
 
-def create_an_example(data_dict, featured_artists, primary_artists):
-    text = clean_text(data_dict.pop("text"))
-    links = data_dict.pop("links")
-    song = create_a_song(data_dict, featured_artists, primary_artists)
-    obj, created = Example.objects.get_or_create(text=text, from_song=song, owner=data_dict["owner"])
-    obj.primary_artists.add(*primary_artists)
-    obj.featured_artists.add(*featured_artists)
-    return obj
+def link_artists(model, credited, using):
+    """
+    Bulk-insert the primary and featured artist through rows that
+    `credited` ([(song or example, {field name: artists})]) is missing.
+    Returns {object: {field name: newly linked artists}}.
+    """
+    added = defaultdict(dict)
+    for name in ("primary_artists", "featured_artists"):
+        field = model._meta.get_field(name)
+        through = field.remote_field.through
+        source = through._meta.get_field(field.m2m_field_name()).attname
+        target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+        wanted = dict(((obj.pk, artist.pk), (obj, artist)) for obj, related in credited for artist in related[name])
+        if not wanted:
+            continue
+        stored = set(through._default_manager.using(using)
+                     .filter(**{source + '__in': set(pk for pk, _ in wanted)})
+                     .values_list(source, target))
+        pairs = set(wanted) - stored
+        through._default_manager.using(using).bulk_create(through_rows(field, pairs))
+        for pair in sorted(pairs):
+            obj, artist = wanted[pair]
+            added[obj].setdefault(name, []).append(artist)
+    return added
 
 
-def create_a_song(data_dict, featured_artists, primary_artists):
-    obj, created = Song.objects.get_or_create(**data_dict)
-    obj.primary_artists.add(*primary_artists)
-    obj.featured_artists.add(*featured_artists)
-    return obj
+def create_an_artist(data_dict, identity=None):
+    return persist("artist", data_dict, identity)
 
 
-def extract_and_process_artists(data_dict):
+def extract_and_process_artists(data_dict, identity=None):
     PA = "primary_artists"
     FA = "featured_artists"
-    primary_artists, featured_artists = [], []
-    if PA in data_dict:
-        primary_artists += [create_an_artist(artist) for artist in data_dict.pop(PA)]
-    if FA in data_dict:
-        primary_artists += [create_an_artist(artist) for artist in data_dict.pop(FA)]
-    return featured_artists, primary_artists, data_dict
+    primary = data_dict.pop(PA, [])
+    featured = data_dict.pop(FA, [])
+    artists = persist_records([("artist", artist) for artist in primary + featured], identity)
+    return artists[len(primary):], artists[:len(primary)], data_dict
 
 
 def random_pipeline(owner, what):
@@ -138,10 +420,10 @@ def inject_owner(owner, data_dict):
                     inject_owner(owner, item)
 
 
-def process_origin(data_dict):
+def process_origin(data_dict, identity=None):
     if "origin" in data_dict:
         origin = data_dict["origin"]
-        data_dict["origin"] = persist("place", origin)
+        data_dict["origin"] = persist("place", origin, identity)
 
 
 def remove_image(data_dict):
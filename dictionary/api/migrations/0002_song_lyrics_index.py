@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def create_lyrics_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE api_song ADD COLUMN lyrics_vector tsvector")
+        schema_editor.execute("UPDATE api_song SET lyrics_vector = to_tsvector('simple', coalesce(lyrics, ''))")
+        schema_editor.execute("CREATE INDEX song_lyrics_vector_idx ON api_song USING GIN (lyrics_vector)")
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute("CREATE VIRTUAL TABLE api_song_lyrics_fts USING fts5(lyrics)")
+        schema_editor.execute("INSERT INTO api_song_lyrics_fts (rowid, lyrics) "
+                              "SELECT id, coalesce(lyrics, '') FROM api_song")
+
+
+def drop_lyrics_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS song_lyrics_vector_idx")
+        schema_editor.execute("ALTER TABLE api_song DROP COLUMN IF EXISTS lyrics_vector")
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS api_song_lyrics_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_lyrics_index, drop_lyrics_index),
+    ]
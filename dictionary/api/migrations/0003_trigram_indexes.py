@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+TRIGRAM_INDEXES = (
+    ('sense_headword_trgm_idx', 'api_sense', 'headword'),
+    ('artist_name_trgm_idx', 'api_artist', 'name'),
+    ('place_full_name_trgm_idx', 'api_place', 'full_name'),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for name, table, column in TRIGRAM_INDEXES:
+            schema_editor.execute("CREATE INDEX {} ON {} USING GIN ({} gin_trgm_ops)".format(name, table, column))
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, table, column in TRIGRAM_INDEXES:
+            schema_editor.execute("DROP INDEX IF EXISTS {}".format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_song_lyrics_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+LINK_TARGETS = (
+    ('sense_id', 'senses'),
+    ('artist_id', 'artists'),
+    ('place_id', 'places'),
+)
+
+
+def build_link(annotation):
+    for attname, prefix in LINK_TARGETS:
+        pk = getattr(annotation, attname)
+        if pk is not None:
+            return '<a href="/{}/{}/">{}</a>'.format(prefix, pk, annotation.text)
+    return "<span>{}</span>".format(annotation.text)
+
+
+def render_example(example, annotations):
+    """
+    `example.text` with its annotations linked, leaving out those that
+    overlap an earlier one or run outside the text.
+    """
+    text = example.text
+    fragments, position = [], 0
+    for annotation in sorted(annotations, key=lambda a: a.offset):
+        start, end = annotation.offset, annotation.offset + len(annotation.text)
+        if start < position or end > len(text):
+            continue
+        fragments.append(text[position:start])
+        fragments.append(build_link(annotation))
+        position = end
+    fragments.append(text[position:])
+    return "".join(fragments)
+
+
+def render_examples(apps, schema_editor):
+    Example = apps.get_model('api', 'Example')
+    Annotation = apps.get_model('api', 'Annotation')
+    annotations = {}
+    for annotation in Annotation.objects.all():
+        annotations.setdefault(annotation.example_id, []).append(annotation)
+    for example in Example.objects.all():
+        rendered = render_example(example, annotations.get(example.pk, []))
+        Example.objects.filter(pk=example.pk).update(rendered=rendered)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='example',
+            name='rendered',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(render_examples, migrations.RunPython.noop),
+    ]
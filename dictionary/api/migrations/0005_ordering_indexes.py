@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_example_rendered'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sense',
+            index=models.Index(fields=['headword', 'created', 'id'], name='sense_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dictionary',
+            index=models.Index(fields=['name', 'created', 'id'], name='dictionary_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='artist',
+            index=models.Index(fields=['name', 'created', 'id'], name='artist_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['name', 'created', 'id'], name='place_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['title', 'album', 'id'], name='song_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='example',
+            index=models.Index(fields=['text', 'id'], name='example_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='domain',
+            index=models.Index(fields=['name', 'id'], name='domain_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='semanticclass',
+            index=models.Index(fields=['name', 'id'], name='semantic_class_ordering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['text', 'id'], name='annotation_ordering_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+MAX_DEPTH = 100
+
+
+def edges(model, field_name, upwards, using):
+    """
+    (lower, upper) pairs of a self-referential M2M field, read from the
+    historical through model.
+    """
+    field = model._meta.get_field(field_name)
+    through = field.remote_field.through
+    source = through._meta.get_field(field.m2m_field_name()).attname
+    target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+    pairs = through.objects.using(using).values_list(source, target).iterator()
+    return pairs if upwards else ((upper, lower) for lower, upper in pairs)
+
+
+def closure_rows(pairs):
+    """
+    (descendant, ancestor, shortest depth) for every path up the `pairs`.
+    """
+    parents = defaultdict(set)
+    for lower, upper in pairs:
+        parents[lower].add(upper)
+    for descendant in list(parents):
+        depths, frontier, depth = {descendant: 0}, [descendant], 0
+        while frontier and depth < MAX_DEPTH:
+            depth += 1
+            frontier = [upper for lower in frontier for upper in parents.get(lower, ()) if upper not in depths]
+            for ancestor in frontier:
+                depths.setdefault(ancestor, depth)
+        for ancestor, depth in depths.items():
+            if ancestor != descendant:
+                yield descendant, ancestor, depth
+
+
+def build_closure(apps, schema_editor):
+    using = schema_editor.connection.alias
+    Place = apps.get_model('api', 'Place')
+    PlaceClosure = apps.get_model('api', 'PlaceClosure')
+    PlaceClosure.objects.using(using).bulk_create(
+        PlaceClosure(descendant_id=descendant, ancestor_id=ancestor, depth=depth)
+        for descendant, ancestor, depth in closure_rows(edges(Place, 'contains', False, using)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_sense_closure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceClosure',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('depth', models.IntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='api.Place')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='api.Place')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='placeclosure',
+            index=models.Index(fields=['descendant', 'depth'], name='place_closure_descendant_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='placeclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
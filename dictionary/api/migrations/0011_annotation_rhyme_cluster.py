@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+CHUNK_SIZE = 400
+
+
+def find(parent, x):
+    parent.setdefault(x, x)
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def build_clusters(apps, schema_editor):
+    Annotation = apps.get_model('api', 'Annotation')
+    annotations = Annotation.objects.using(schema_editor.connection.alias)
+    # union-find whose roots are the smallest annotation id of each family
+    parent = {}
+    links = Annotation.rhymes.through.objects.using(schema_editor.connection.alias)
+    for source, target in links.values_list('from_annotation_id', 'to_annotation_id').iterator():
+        source, target = find(parent, source), find(parent, target)
+        if source != target:
+            parent[max(source, target)] = min(source, target)
+    members = defaultdict(list)
+    for pk in parent:
+        members[find(parent, pk)].append(pk)
+    for cluster, pks in members.items():
+        if len(pks) < 2:
+            continue
+        for i in range(0, len(pks), CHUNK_SIZE):
+            annotations.filter(pk__in=pks[i:i + CHUNK_SIZE]).update(rhyme_cluster=cluster)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_place_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotation',
+            name='rhyme_cluster',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(build_clusters, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from collections import defaultdict
+from django.db import models, connections
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
@@ -24,10 +25,102 @@ PARTS_OF_SPEECH = [
 ]
 
 
+# (relation, Sense M2M field, whether the relation follows the field forwards)
+SENSE_RELATIONS = (
+    ('derivatives', 'derivatives', True),
+    ('derives_from', 'derivatives', False),
+    ('synonyms', 'synonyms', True),
+    ('antonyms', 'antonyms', True),
+    ('hypernyms', 'hypernyms', True),
+    ('hyponyms', 'hypernyms', False),
+    ('meronyms', 'meronyms', True),
+    ('holonyms', 'meronyms', False),
+)
+
+
+class SenseManager(models.Manager):
+
+    relation_batch_size = 100
+
+    def load_relations(self, senses):
+        """
+        Fetch the lexical relations of every sense in `senses` with one UNION ALL
+        query over the self-referential through tables (per batch of senses),
+        and store them in each sense's prefetch cache, so that e.g.
+        `sense.synonyms.all()` or `sense.hyponyms.all()` no longer hit the database.
+        """
+        senses = list(senses)
+        pending = [s for s in senses if not self.relations_loaded(s)]
+        for i in range(0, len(pending), self.relation_batch_size):
+            batch = pending[i:i + self.relation_batch_size]
+            related = defaultdict(lambda: defaultdict(list))
+            for sense in self.raw(*self.relations_sql([s.pk for s in batch])):
+                related[sense.relation_source][sense.relation].append(sense)
+            for sense in batch:
+                cache = sense.__dict__.setdefault('_prefetched_objects_cache', {})
+                for relation, _, _ in SENSE_RELATIONS:
+                    found = related[sense.pk][relation]
+                    queryset = self.filter(pk__in=[r.pk for r in found])
+                    queryset._result_cache = found
+                    queryset._prefetch_done = True
+                    cache[relation] = queryset
+        return senses
+
+    def ancestors(self, sense, taxonomy='hypernyms'):
+        """
+        Every sense above `sense` in `taxonomy`, nearest first, each with its
+        `depth` (1 for a direct hypernym or holonym).
+        """
+        return self.filter(descendant_links__descendant=sense, descendant_links__taxonomy=taxonomy) \
+            .annotate(depth=models.F('descendant_links__depth')).order_by('depth', 'headword', 'id')
+
+    def descendants(self, sense, taxonomy='hypernyms'):
+        """
+        Every sense below `sense` in `taxonomy`, nearest first, each with its
+        `depth` (1 for a direct hyponym or meronym).
+        """
+        return self.filter(ancestor_links__ancestor=sense, ancestor_links__taxonomy=taxonomy) \
+            .annotate(depth=models.F('ancestor_links__depth')).order_by('depth', 'headword', 'id')
+
+    def depth(self, sense, taxonomy='hypernyms'):
+        """
+        How far `sense` sits below the top of `taxonomy`: the greatest depth
+        among its ancestors (0 for a root).
+        """
+        return SenseClosure.objects.filter(descendant=sense, taxonomy=taxonomy) \
+            .aggregate(depth=models.Max('depth'))['depth'] or 0
+
+    @staticmethod
+    def relations_loaded(sense):
+        cache = getattr(sense, '_prefetched_objects_cache', {})
+        return all(relation in cache for relation, _, _ in SENSE_RELATIONS)
+
+    def relations_sql(self, ids):
+        qn = connections[self.db].ops.quote_name
+        placeholders = ", ".join(["%s"] * len(ids))
+        selects, params = [], []
+        for relation, field_name, forward in SENSE_RELATIONS:
+            field = self.model._meta.get_field(field_name)
+            source, target = field.m2m_column_name(), field.m2m_reverse_name()
+            if not forward:
+                source, target = target, source
+            selects.append("SELECT {source} AS relation_source, {target} AS relation_target, "
+                           "'{relation}' AS relation FROM {table} WHERE {source} IN ({placeholders})".format(
+                               source=qn(source), target=qn(target), relation=relation,
+                               table=qn(field.remote_field.through._meta.db_table), placeholders=placeholders))
+            params += ids
+        sql = ("SELECT s.*, r.relation_source, r.relation FROM {table} s INNER JOIN ({union}) r "
+               "ON s.{pk} = r.relation_target ORDER BY s.{headword}, s.{created}").format(
+            table=qn(self.model._meta.db_table), union=" UNION ALL ".join(selects),
+            pk=qn(self.model._meta.pk.column), headword=qn('headword'), created=qn('created'))
+        return sql, params
+
+
 class Sense(models.Model):
 
     id = models.AutoField(primary_key=True)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     headword = models.CharField(max_length=500)
     headword_slug = models.SlugField(max_length=500)
     published = models.BooleanField(default=False)
@@ -46,17 +139,21 @@ class Sense(models.Model):
     dictionaries = models.ManyToManyField('Dictionary', blank=True, symmetrical=False)
     owner = models.ForeignKey("auth.User", related_name="senses")
 
+    objects = SenseManager()
+
     class Meta:
         ordering = ('headword', 'created',)
         unique_together = ('headword', 'part_of_speech', 'definition')
         indexes = [
             models.Index(fields=['headword'], name='sense_headword_idx'),
+            models.Index(fields=['headword', 'created', 'id'], name='sense_ordering_idx'),
         ]
 
     def __str__(self):
         return self.headword + ', ' + self.part_of_speech + ' - ' + self.definition + ' [Published: ' + str(self.published) + ']'
 
     def to_dict(self):
+        Sense.objects.load_relations([self])
         return {
             "pub_date": self.created,
             "headword": self.headword,
@@ -82,9 +179,38 @@ class Sense(models.Model):
         }
 
 
+# (taxonomy, Sense M2M field, whether the field points from descendant to ancestor)
+SENSE_TAXONOMIES = (
+    ('hypernyms', 'hypernyms', True),
+    ('meronyms', 'meronyms', False),
+)
+
+
+class SenseClosure(models.Model):
+    """
+    Every (ancestor, descendant) pair of a sense taxonomy, with the length of
+    the shortest path between them. Maintained by api.closure.
+    """
+    id = models.AutoField(primary_key=True)
+    taxonomy = models.CharField(choices=[(t, t) for t, _, _ in SENSE_TAXONOMIES], max_length=20)
+    ancestor = models.ForeignKey(Sense, related_name="descendant_links", on_delete=models.CASCADE)
+    descendant = models.ForeignKey(Sense, related_name="ancestor_links", on_delete=models.CASCADE)
+    depth = models.IntegerField()
+
+    class Meta:
+        unique_together = ('taxonomy', 'ancestor', 'descendant')
+        indexes = [
+            models.Index(fields=['taxonomy', 'descendant', 'depth'], name='sense_closure_descendant_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.ancestor_id) + ' > ' + str(self.descendant_id) + ' (' + self.taxonomy + ')'
+
+
 class Dictionary(models.Model):
     id = models.AutoField(primary_key=True)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     slug = models.SlugField(max_length=500)
     senses = models.ManyToManyField('Sense', through=Sense.dictionaries.through, related_name='+', blank=True)
     name = models.CharField(max_length=1000)
@@ -92,15 +218,25 @@ class Dictionary(models.Model):
 
     class Meta:
         ordering = ('name', 'created',)
+        indexes = [
+            models.Index(fields=['name', 'created', 'id'], name='dictionary_ordering_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "slug": self.slug
+        }
+
 
 class Artist(models.Model):
 
     id = models.AutoField(primary_key=True)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     name = models.CharField(max_length=1000)
     slug = models.SlugField(max_length=1000)
     also_known_as = models.ManyToManyField("self", related_name="+", blank=True, symmetrical=True)
@@ -115,6 +251,9 @@ class Artist(models.Model):
 
     class Meta:
         ordering = ('name', 'created',)
+        indexes = [
+            models.Index(fields=['name', 'created', 'id'], name='artist_ordering_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -125,7 +264,7 @@ class Artist(models.Model):
             "slug": self.slug,
             "also_known_as": [a.to_xref() for a in self.also_known_as.all()],
             "members": [a.to_xref() for a in self.members.all()],
-            "origin": self.origin.to_xref(),
+            "origin": self.origin.to_xref() if self.origin_id else None,
             "primary_songs": [s.to_xref() for s in self.primary_songs.all()],
             "featured_songs": [s.to_xref() for s in self.featured_songs.all()],
             "primary_examples": [s.to_xref() for s in self.primary_examples.all()],
@@ -145,21 +284,44 @@ class Artist(models.Model):
         yield "slug", self.slug
 
 
+class PlaceManager(models.Manager):
+
+    def within(self, slug, recursive=False, inclusive=False):
+        """
+        The places directly inside the place with `slug`, or at any depth if
+        `recursive`; with `inclusive`, that place as well.
+        """
+        if recursive:
+            places = self.filter(ancestor_links__ancestor__slug=slug)
+        else:
+            places = self.filter(within__slug=slug)
+        if inclusive:
+            places = self.filter(models.Q(slug=slug) | models.Q(pk__in=places.values('pk')))
+        return places
+
+
 class Place(models.Model):
 
     id = models.AutoField(primary_key=True)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     name = models.CharField(max_length=1000)
     full_name = models.CharField(max_length=1000, unique=True)
     slug = models.CharField(max_length=1000)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, default="", db_index=True, editable=False)
     contains = models.ManyToManyField("self", related_name="within", blank=True, symmetrical=False)
     mentioned_in = models.ManyToManyField("Example", related_name="mentions_place", blank=True, symmetrical=False)
     owner = models.ForeignKey("auth.User", related_name="places")
 
+    objects = PlaceManager()
+
     class Meta:
         ordering = ('name', 'created',)
+        indexes = [
+            models.Index(fields=['name', 'created', 'id'], name='place_ordering_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -184,9 +346,31 @@ class Place(models.Model):
         }
 
 
+class PlaceClosure(models.Model):
+    """
+    Every (ancestor, descendant) pair of the place containment hierarchy,
+    with the length of the shortest path between them. Maintained by
+    api.closure.
+    """
+    id = models.AutoField(primary_key=True)
+    ancestor = models.ForeignKey(Place, related_name="descendant_links", on_delete=models.CASCADE)
+    descendant = models.ForeignKey(Place, related_name="ancestor_links", on_delete=models.CASCADE)
+    depth = models.IntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [
+            models.Index(fields=['descendant', 'depth'], name='place_closure_descendant_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.ancestor_id) + ' > ' + str(self.descendant_id)
+
+
 class Song(models.Model):
     id = models.AutoField(primary_key=True)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     slug = models.CharField(max_length=1000)
     title = models.CharField(max_length=1000)
     primary_artists = models.ManyToManyField(Artist, through=Artist.primary_songs.through, related_name="+")
@@ -203,6 +387,7 @@ class Song(models.Model):
         unique_together = ('title', 'album', 'release_date_string')
         indexes = [
             models.Index(fields=['release_date'], name='song_release_date_idx'),
+            models.Index(fields=['title', 'album', 'id'], name='song_ordering_idx'),
         ]
 
     def __str__(self):
@@ -227,7 +412,7 @@ class Song(models.Model):
             "release_date": self.release_date,
             "release_date_string": self.release_date_string,
             "album": self.album,
-            "primary_artists": [a.to_xef() for a in self.primary_artists.all()],
+            "primary_artists": [a.to_xref() for a in self.primary_artists.all()],
             "featured_artists": [a.to_xref() for a in self.featured_artists.all()]
         }
 
@@ -235,11 +420,13 @@ class Song(models.Model):
 class Example(models.Model):
     id = models.AutoField(primary_key=True)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     slug = models.CharField(max_length=1000)
     from_song = models.ForeignKey("Song", related_name="examples", on_delete=models.CASCADE)
     primary_artists = models.ManyToManyField(Artist, through=Artist.primary_examples.through, related_name="+")
     featured_artists = models.ManyToManyField(Artist, through=Artist.featured_examples.through, related_name="+", blank=True)
     text = models.CharField(max_length=1000)
+    rendered = models.TextField(null=True, blank=True, editable=False)
     owner = models.ForeignKey("auth.User", related_name="examples")
 
     class Meta:
@@ -247,6 +434,7 @@ class Example(models.Model):
         unique_together = ('text', 'from_song')
         indexes = [
             models.Index(fields=['text'], name='example_text_idx'),
+            models.Index(fields=['text', 'id'], name='example_ordering_idx'),
         ]
 
     def __str__(self):
@@ -272,17 +460,75 @@ class Example(models.Model):
         }
 
 
+class CategoryManager(models.Manager):
+    """
+    For the `broader`/`narrower` hierarchies of domains and semantic classes.
+    """
+
+    def subtree(self, node):
+        """
+        `node` and every narrower node below it, at any depth.
+        """
+        closure = self.model._meta.get_field('ancestor_links').related_model
+        below = closure.objects.filter(ancestor=node).values('descendant')
+        return self.filter(models.Q(pk=node.pk) | models.Q(pk__in=below))
+
+    def subtree_senses(self, node):
+        """
+        The senses filed under `node` or any node below it, each once.
+        """
+        field = self.model._meta.get_field('senses')
+        links = field.remote_field.through.objects.filter(**{
+            field.m2m_field_name() + '__in': self.subtree(node).values('pk')})
+        return Sense.objects.filter(pk__in=links.values(field.m2m_reverse_field_name()))
+
+    def subtree_sense_counts(self, pks):
+        """
+        {pk: number of distinct senses in that node's subtree} for `pks`, in
+        one query over the closure and through tables.
+        """
+        pks = list(pks)
+        if not pks:
+            return {}
+        closure = self.model._meta.get_field('ancestor_links').related_model
+        field = self.model._meta.get_field('senses')
+        qn = connections[self.db].ops.quote_name
+        placeholders = ", ".join(["%s"] * len(pks))
+        sql = ("SELECT subtree.root, COUNT(DISTINCT t.{sense}) FROM ("
+               "SELECT {pk} AS root, {pk} AS node FROM {table} WHERE {pk} IN ({placeholders}) "
+               "UNION ALL "
+               "SELECT {ancestor}, {descendant} FROM {closure} WHERE {ancestor} IN ({placeholders})"
+               ") subtree INNER JOIN {through} t ON t.{node} = subtree.node "
+               "GROUP BY subtree.root").format(
+            sense=qn(field.m2m_reverse_name()), node=qn(field.m2m_column_name()),
+            pk=qn(self.model._meta.pk.column), table=qn(self.model._meta.db_table),
+            ancestor=qn(closure._meta.get_field('ancestor').column),
+            descendant=qn(closure._meta.get_field('descendant').column),
+            closure=qn(closure._meta.db_table), through=qn(field.remote_field.through._meta.db_table),
+            placeholders=placeholders)
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, pks + pks)
+            counts = dict(cursor.fetchall())
+        return dict((pk, counts.get(pk, 0)) for pk in pks)
+
+
 class Domain(models.Model):
     id = models.AutoField(primary_key=True)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     name = models.CharField(max_length=1000, unique=True)
     slug = models.SlugField(max_length=1000)
     senses = models.ManyToManyField('Sense', through=Sense.domains.through, related_name='+', blank=True)
     broader = models.ManyToManyField("self", related_name="narrower", blank=True, symmetrical=False)
     owner = models.ForeignKey("auth.User", related_name="domains")
 
+    objects = CategoryManager()
+
     class Meta:
         ordering = ["name"]
+        indexes = [
+            models.Index(fields=['name', 'id'], name='domain_ordering_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -303,15 +549,21 @@ class Domain(models.Model):
 class SemanticClass(models.Model):
     id = models.AutoField(primary_key=True)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     name = models.CharField(max_length=1000, unique=True)
     slug = models.SlugField(max_length=1000)
     senses = models.ManyToManyField('Sense', through=Sense.semantic_classes.through, related_name='+', blank=True)
     broader = models.ManyToManyField("self", related_name="narrower", blank=True, symmetrical=False)
     owner = models.ForeignKey("auth.User", related_name="semantic_classes")
 
+    objects = CategoryManager()
+
     class Meta:
         ordering = ["name"]
         verbose_name_plural = "Semantic Classes"
+        indexes = [
+            models.Index(fields=['name', 'id'], name='semantic_class_ordering_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -329,9 +581,50 @@ class SemanticClass(models.Model):
         }
 
 
+class DomainClosure(models.Model):
+    """
+    Every (broader, narrower) pair of the domain hierarchy, with the length of
+    the shortest path between them. Maintained by api.closure.
+    """
+    id = models.AutoField(primary_key=True)
+    ancestor = models.ForeignKey(Domain, related_name="descendant_links", on_delete=models.CASCADE)
+    descendant = models.ForeignKey(Domain, related_name="ancestor_links", on_delete=models.CASCADE)
+    depth = models.IntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [
+            models.Index(fields=['descendant', 'depth'], name='domain_closure_descendant_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.ancestor_id) + ' > ' + str(self.descendant_id)
+
+
+class SemanticClassClosure(models.Model):
+    """
+    Every (broader, narrower) pair of the semantic class hierarchy, with the
+    length of the shortest path between them. Maintained by api.closure.
+    """
+    id = models.AutoField(primary_key=True)
+    ancestor = models.ForeignKey(SemanticClass, related_name="descendant_links", on_delete=models.CASCADE)
+    descendant = models.ForeignKey(SemanticClass, related_name="ancestor_links", on_delete=models.CASCADE)
+    depth = models.IntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [
+            models.Index(fields=['descendant', 'depth'], name='semantic_class_closure_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.ancestor_id) + ' > ' + str(self.descendant_id)
+
+
 class Annotation(models.Model):
     id = models.AutoField(primary_key=True)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     text = models.CharField(max_length=1000)
     slug = models.SlugField(max_length=1000)
     offset = models.IntegerField()
@@ -340,11 +633,15 @@ class Annotation(models.Model):
     artist = models.ForeignKey("Artist", related_name="annotations", blank=True, null=True)
     place = models.ForeignKey("Place", related_name="annotations", blank=True, null=True)
     rhymes = models.ManyToManyField("self", related_name="rhymes", blank=True, symmetrical=True)
+    rhyme_cluster = models.IntegerField(null=True, blank=True, db_index=True, editable=False)
     owner = models.ForeignKey("auth.User", related_name="annotations")
 
     class Meta:
         ordering = ["text"]
         unique_together = ("text", "offset", "example")
+        indexes = [
+            models.Index(fields=['text', 'id'], name='annotation_ordering_idx'),
+        ]
 
     def __str__(self):
         return self.text + " [" + self.example.text + "]"
@@ -374,9 +671,9 @@ class Annotation(models.Model):
             "slug": self.slug,
             "start_position": self.offset,
             "example": self.example.to_xref(),
-            "sense": self.sense.to_xref(),
-            "artist": self.artist.to_xref(),
-            "place": self.place.to_xref(),
+            "sense": self.sense.to_xref() if self.sense_id else None,
+            "artist": self.artist.to_xref() if self.artist_id else None,
+            "place": self.place.to_xref() if self.place_id else None,
             "rhymes": [r.to_xref() for r in self.rhymes.all()]
         }
 
@@ -385,10 +682,11 @@ class Annotation(models.Model):
             "text": self.text,
             "slug": self.slug,
             "start_position": self.offset,
-            "sense": self.sense.to_xref(),
-            "artist": self.artist.to_xref(),
-            "place": self.place.to_xref(),
-            "rhymes": [r.to_xref() for r in self.rhymes.all()]
+            "sense": self.sense.to_xref() if self.sense_id else None,
+            "artist": self.artist.to_xref() if self.artist_id else None,
+            "place": self.place.to_xref() if self.place_id else None,
+            # rhymes are symmetrical, so their own rhymes would lead straight back here
+            "rhymes": [dict(r) for r in self.rhymes.all()]
         }
 
 
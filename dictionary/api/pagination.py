@@ -0,0 +1,181 @@
+import json
+import operator
+from functools import reduce
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination keyed on every field of the queryset's ordering (its
+    explicit order_by, else the model's `Meta.ordering`) plus `id`. The cursor
+    holds the values of the last row of the page, so each page is one range
+    scan on the matching composite index, however deep it is.
+
+    Orderings that can't be keyed on (e.g. the computed rank of search
+    results, or related and nullable columns) are kept and paged by offset
+    instead.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            self.cursor = Cursor(offset=0, reverse=False, position=None)
+
+        self.ordering = self.get_ordering(request, queryset, view)
+        if self.ordering is None:
+            return self.paginate_by_offset(queryset)
+        return self.paginate_by_keyset(queryset)
+
+    def get_ordering(self, request, queryset, view):
+        """
+        The keyset ordering of `queryset`, or None when it has to be paged
+        by offset.
+        """
+        ordering = [self.keyset_field(queryset.model, field)
+                    for field in queryset.query.order_by or queryset.model._meta.ordering]
+        if None in ordering:
+            return None
+        if 'id' not in ordering and '-id' not in ordering:
+            ordering.append('id')
+        return tuple(ordering)
+
+    @staticmethod
+    def keyset_field(model, field):
+        """
+        `field` of an ordering with `pk` spelled `id`, or None unless it is a
+        non-null column of the model itself.
+        """
+        if not isinstance(field, str) or field == '?':
+            return None
+        descending, name = field.startswith('-'), field.lstrip('-')
+        if name == 'pk':
+            name = model._meta.pk.name
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete or model_field.is_relation or model_field.null:
+            return None
+        return '-' + name if descending else name
+
+    def paginate_by_keyset(self, queryset):
+        reverse = self.cursor.reverse
+        position = self.decode_position(self.cursor.position)
+        if reverse:
+            queryset = queryset.order_by(*[self.reverse_field(field) for field in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.keyset_filter(position, reverse))
+            except (TypeError, ValueError, DjangoValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_following
+        else:
+            self.has_next, self.has_previous = has_following, position is not None
+        return self.page
+
+    def paginate_by_offset(self, queryset):
+        self.ordering = None
+        offset = self.cursor.offset
+        results = list(queryset.order_by(*(list(queryset.query.order_by) + ['pk']))
+                       [offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        self.has_previous = offset > 0
+        return self.page
+
+    def keyset_filter(self, position, reverse):
+        clauses, equal = [], {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = '__gt' if field.startswith('-') == reverse else '__lt'
+            clauses.append(Q(**dict(equal, **{name + lookup: value})))
+            equal[name] = value
+        return reduce(operator.or_, clauses)
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def encode_position(values):
+        return json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in values], default=str)
+
+    def decode_position(self, position):
+        """
+        The ordering values held by a cursor, which must be one per field of
+        the ordering; a tampered cursor is not found.
+        """
+        if position is None:
+            return None
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _get_position_from_instance(self, instance, ordering):
+        return self.encode_position([getattr(instance, field.lstrip('-')) for field in ordering])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.ordering is None:
+            return self.encode_cursor(Cursor(offset=self.cursor.offset + self.page_size, reverse=False, position=None))
+        position = self._get_position_from_instance(self.page[-1], self.ordering) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.ordering is None:
+            return self.encode_cursor(Cursor(offset=max(self.cursor.offset - self.page_size, 0), reverse=False,
+                                             position=None))
+        position = self._get_position_from_instance(self.page[0], self.ordering) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+
+class SearchPagination(KeysetPagination):
+    """
+    Pages for the HTML search routes: `?page_size=` is honoured up to a hard cap.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+
+def paginate_search(request, queryset, prefix=""):
+    """
+    One bounded page of `queryset` plus its `<prefix>next`/`<prefix>previous`
+    links; `prefix` keeps the cursors of several result sets on one page apart.
+    """
+    paginator = SearchPagination()
+    paginator.cursor_query_param = prefix + paginator.cursor_query_param
+    page = paginator.paginate_queryset(queryset, request)
+    return page, {
+        prefix + "next": paginator.get_next_link(),
+        prefix + "previous": paginator.get_previous_link(),
+    }
@@ -0,0 +1,129 @@
+import logging
+from django.db.models import Prefetch
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from api.hyperlinks import build_path
+from api.models import Example, Annotation
+
+
+###
+# Example.rendered holds the example text with its annotations linked to their
+# senses, artists and places. Links are site-relative so the stored markup does
+# not depend on the request host. It is rebuilt by the receivers below whenever
+# the example or one of its annotations is saved or deleted; deleting a linked
+# sense, artist or place cascades to its annotations and so goes through them.
+###
+
+logger = logging.getLogger(__name__)
+
+LINK_TARGETS = (
+    ('sense_id', 'sense-detail'),
+    ('artist_id', 'artist-detail'),
+    ('place_id', 'place-detail'),
+)
+
+
+class AnnotationOffsetError(ValueError):
+    pass
+
+
+def build_link(annotation, base=""):
+    for attname, view_name in LINK_TARGETS:
+        pk = getattr(annotation, attname)
+        if pk is not None:
+            return '<a href="{}">{}</a>'.format(base + build_path(view_name, pk), annotation.text)
+    return "<span>{}</span>".format(annotation.text)
+
+
+def render_example(example, annotations, base="", errors=None):
+    """
+    `example.text` with each annotation replaced by its link, built in a single pass.
+    An annotation that overlaps an earlier one or runs outside the text raises
+    AnnotationOffsetError, unless an `errors` list is given, in which case the
+    error is appended to it and the annotation is left unlinked.
+    """
+    text = example.text
+    fragments, position = [], 0
+    for annotation in sorted(annotations, key=lambda a: a.offset):
+        start = annotation.offset
+        end = start + len(annotation.text)
+        problem = None
+        if start < 0 or end > len(text):
+            problem = 'Annotation "{}" at offset {} falls outside example {} ({} characters)'.format(
+                annotation.text, start, example.pk, len(text))
+        elif start < position:
+            problem = 'Annotation "{}" at offset {} overlaps the previous annotation in example {}'.format(
+                annotation.text, start, example.pk)
+        if problem:
+            if errors is None:
+                raise AnnotationOffsetError(problem)
+            errors.append(AnnotationOffsetError(problem))
+            continue
+        fragments.append(text[position:start])
+        fragments.append(build_link(annotation, base))
+        position = end
+    fragments.append(text[position:])
+    return "".join(fragments)
+
+
+def render_examples(examples, base="", errors=None):
+    """
+    Render a batch of examples whose `annotations` have been prefetched,
+    returning {example id: markup}.
+    """
+    return dict((example.pk, render_example(example, example.annotations.all(), base, errors))
+                for example in examples)
+
+
+def lenient_render(example, annotations):
+    errors = []
+    rendered = render_example(example, annotations, errors=errors)
+    for error in errors:
+        logger.warning(str(error))
+    return rendered
+
+
+def store_rendered_example(example_id, using='default'):
+    example = Example.objects.using(using).filter(pk=example_id).only('id', 'text').first()
+    if example is None:
+        return None
+    rendered = lenient_render(example, Annotation.objects.using(using).filter(example_id=example_id)
+                              .only('text', 'offset', 'sense_id', 'artist_id', 'place_id'))
+    Example.objects.using(using).filter(pk=example_id).update(rendered=rendered)
+    return rendered
+
+
+def store_rendered_examples(example_ids, using='default'):
+    """
+    store_rendered_example for a batch: the examples and their annotations are
+    read with two queries, then each markup is written.
+    """
+    annotations = Annotation.objects.using(using).only('text', 'offset', 'example_id', 'sense_id', 'artist_id',
+                                                       'place_id')
+    examples = Example.objects.using(using).filter(pk__in=example_ids).only('id', 'text') \
+        .prefetch_related(Prefetch('annotations', queryset=annotations))
+    for example in examples:
+        rendered = lenient_render(example, example.annotations.all())
+        Example.objects.using(using).filter(pk=example.pk).update(rendered=rendered)
+
+
+def rendered_example(example):
+    """
+    The stored markup for `example`, or if it is missing, markup rendered from
+    the (ideally prefetched) annotations. Reads never write it back; the
+    receivers below store it on the next change.
+    """
+    if example.rendered is None:
+        return lenient_render(example, example.annotations.all())
+    return example.rendered
+
+
+@receiver(post_save, sender=Example)
+def update_rendered_example(sender, instance=None, using='default', **kwargs):
+    instance.rendered = store_rendered_example(instance.pk, using)
+
+
+@receiver(post_save, sender=Annotation)
+@receiver(post_delete, sender=Annotation)
+def update_annotated_example(sender, instance=None, using='default', **kwargs):
+    store_rendered_example(instance.example_id, using)
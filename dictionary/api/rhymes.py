@@ -0,0 +1,195 @@
+from collections import defaultdict
+from django.db.models import Count, Q
+from django.db.models.signals import m2m_changed, pre_delete, post_delete
+from django.dispatch import receiver
+from api.caching import bump_generation
+from api.models import Annotation
+
+
+###
+# Rhyme families: the connected components of the Annotation.rhymes graph.
+#
+# Each annotation that rhymes with anything stores the id of its family in
+# `rhyme_cluster`, which is the smallest annotation id in the family, so
+# listing a family or the largest families is an indexed lookup rather than
+# a walk over the graph. Annotations that rhyme with nothing have none.
+#
+# The `cluster_rhymes` command rebuilds every family with union-find over the
+# whole through table. Between rebuilds the receivers below keep them
+# current. Added rhymes merge families by relabelling the larger ids to the
+# smallest. A removed rhyme can split a family, so that family is
+# re-clustered from the rhymes among its own members. The receivers write
+# with update() and refresh only the instance whose rhymes changed; code
+# holding other annotations across rhyme changes should save them with
+# explicit `update_fields`.
+###
+
+CHUNK_SIZE = 400
+
+
+class UnionFind(object):
+    """
+    Disjoint sets of annotation ids whose root is always the smallest member.
+    """
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        parent = self.parent
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+    def labels(self):
+        """
+        {member: root}, with None for members alone in their set.
+        """
+        roots = dict((x, self.find(x)) for x in self.parent)
+        sizes = defaultdict(int)
+        for root in roots.values():
+            sizes[root] += 1
+        return dict((x, root if sizes[root] > 1 else None) for x, root in roots.items())
+
+
+def rhyme_links(using='default'):
+    through = Annotation.rhymes.through
+    return through._default_manager.using(using)
+
+
+def store_clusters(labels, current, using='default'):
+    """
+    Write the `labels` ({pk: cluster}) that differ from `current`, one
+    UPDATE per cluster and chunk.
+    """
+    changed = defaultdict(list)
+    for pk, cluster in labels.items():
+        if current.get(pk) != cluster:
+            changed[cluster].append(pk)
+    annotations = Annotation.objects.using(using)
+    for cluster, pks in changed.items():
+        for i in range(0, len(pks), CHUNK_SIZE):
+            annotations.filter(pk__in=pks[i:i + CHUNK_SIZE]).update(rhyme_cluster=cluster)
+    return sum(len(pks) for pks in changed.values())
+
+
+def rebuild_clusters(using='default'):
+    """
+    Recompute every family from the through table. Returns how many
+    annotations changed family.
+    """
+    families = UnionFind()
+    for source, target in rhyme_links(using).values_list('from_annotation_id', 'to_annotation_id').iterator():
+        families.union(source, target)
+    current = dict(Annotation.objects.using(using).exclude(rhyme_cluster=None)
+                   .values_list('pk', 'rhyme_cluster').iterator())
+    labels = dict.fromkeys(current)
+    labels.update(families.labels())
+    changed = store_clusters(labels, current, using)
+    if changed:
+        # the receivers' writes come with an m2m_changed that does this
+        bump_generation(Annotation)
+    return changed
+
+
+def family_ids(pks, using='default'):
+    """
+    The families the annotations `pks` belong to.
+    """
+    pks = list(pks)
+    clusters = set()
+    for i in range(0, len(pks), CHUNK_SIZE):
+        clusters.update(Annotation.objects.using(using).filter(pk__in=pks[i:i + CHUNK_SIZE])
+                        .exclude(rhyme_cluster=None).values_list('rhyme_cluster', flat=True))
+    return clusters
+
+
+def split_clusters(clusters, using='default'):
+    """
+    Re-cluster the families `clusters` from the rhymes left among their
+    members, after rhymes were removed.
+    """
+    if not clusters:
+        return
+    current = dict(Annotation.objects.using(using).filter(rhyme_cluster__in=clusters)
+                   .values_list('pk', 'rhyme_cluster'))
+    families = UnionFind()
+    for pk in current:
+        families.find(pk)
+    links = rhyme_links(using).filter(from_annotation__rhyme_cluster__in=clusters,
+                                      to_annotation__rhyme_cluster__in=clusters)
+    for source, target in links.values_list('from_annotation_id', 'to_annotation_id'):
+        families.union(source, target)
+    store_clusters(families.labels(), current, using)
+
+
+def merge_clusters(pairs, using='default'):
+    """
+    Join the families of each (pk, pk) pair of newly rhyming annotations.
+    """
+    pairs = [(a, b) for a, b in pairs if a != b]
+    if not pairs:
+        return
+    pks = set(pk for pair in pairs for pk in pair)
+    annotations = Annotation.objects.using(using)
+    current = dict(annotations.filter(pk__in=pks).values_list('pk', 'rhyme_cluster'))
+    # an annotation stands for its whole family by the family's id
+    families = UnionFind()
+    for a, b in pairs:
+        families.union(current.get(a) or a, current.get(b) or b)
+    groups = defaultdict(set)
+    for node in families.parent:
+        groups[families.find(node)].add(node)
+    for root, nodes in groups.items():
+        annotations.filter(Q(pk__in=nodes) | Q(rhyme_cluster__in=nodes)).exclude(rhyme_cluster=root) \
+            .update(rhyme_cluster=root)
+
+
+def largest_families(limit, using='default'):
+    """
+    [(cluster, size, members)] for the `limit` largest families, biggest
+    first, in two queries.
+    """
+    annotations = Annotation.objects.using(using)
+    sizes = annotations.exclude(rhyme_cluster=None).order_by().values('rhyme_cluster') \
+        .annotate(size=Count('pk')).order_by('-size', 'rhyme_cluster')[:limit]
+    sizes = [(row['rhyme_cluster'], row['size']) for row in sizes]
+    members = defaultdict(list)
+    for annotation in annotations.filter(rhyme_cluster__in=[cluster for cluster, size in sizes]) \
+            .select_related('example').order_by('rhyme_cluster', 'text', 'pk'):
+        members[annotation.rhyme_cluster].append(annotation)
+    return [(cluster, size, members[cluster]) for cluster, size in sizes]
+
+
+@receiver(m2m_changed, sender=Annotation.rhymes.through)
+def maintain_clusters(sender, instance=None, action=None, pk_set=None, using='default', **kwargs):
+    if action == 'post_add':
+        merge_clusters([(instance.pk, pk) for pk in pk_set], using)
+    elif action == 'post_remove':
+        split_clusters(family_ids({instance.pk} | set(pk_set), using), using)
+    elif action == 'post_clear':
+        split_clusters(family_ids([instance.pk], using), using)
+    else:
+        return
+    # the clusters were written with update(), so a later save() of the
+    # instance mustn't put its old value back
+    instance.rhyme_cluster = Annotation.objects.using(using).filter(pk=instance.pk) \
+        .values_list('rhyme_cluster', flat=True).first()
+
+
+@receiver(pre_delete, sender=Annotation)
+def remember_cluster(sender, instance=None, using='default', **kwargs):
+    # the instance's own value may predate merges done with update()
+    instance._rhyme_clusters = family_ids([instance.pk], using)
+
+
+@receiver(post_delete, sender=Annotation)
+def split_deleted_cluster(sender, instance=None, using='default', **kwargs):
+    split_clusters(getattr(instance, '_rhyme_clusters', set()), using)
@@ -0,0 +1,158 @@
+import re
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from api.models import Song
+
+
+###
+# Full-text index over Song.lyrics.
+#
+# PostgreSQL: a `lyrics_vector` tsvector column on api_song with a GIN index.
+# SQLite: an FTS5 shadow table keyed on the song id (rowid).
+# Both are created by migration 0002 and kept in sync by the receivers below.
+#
+# Fuzzy (trigram) lookups use pg_trgm and the GIN trigram indexes from
+# migration 0003 on PostgreSQL; on SQLite `similarity()` is registered as a
+# pure-Python function, so the same SQL runs unindexed.
+###
+
+LYRICS_SEARCH_CONFIG = 'simple'
+LYRICS_FTS_TABLE = 'api_song_lyrics_fts'
+TRIGRAM_SIMILARITY_THRESHOLD = 0.3
+
+
+def lyric_tokens(text):
+    return re.findall(r"\w+", (text or "").lower())
+
+
+def fts5_query(q):
+    return " ".join('"' + token + '"' for token in lyric_tokens(q))
+
+
+def index_song_lyrics(song, using='default'):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("UPDATE api_song SET lyrics_vector = to_tsvector(%s, coalesce(lyrics, '')) WHERE id = %s",
+                           [LYRICS_SEARCH_CONFIG, song.pk])
+        elif connection.vendor == 'sqlite':
+            cursor.execute("DELETE FROM " + LYRICS_FTS_TABLE + " WHERE rowid = %s", [song.pk])
+            cursor.execute("INSERT INTO " + LYRICS_FTS_TABLE + " (rowid, lyrics) VALUES (%s, %s)",
+                           [song.pk, song.lyrics or ""])
+
+
+def index_songs_lyrics(songs, using='default'):
+    """
+    index_song_lyrics for songs inserted in bulk, which fire no post_save.
+    """
+    if not songs:
+        return
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("UPDATE api_song SET lyrics_vector = to_tsvector(%s, coalesce(lyrics, '')) "
+                           "WHERE id IN (" + ", ".join(["%s"] * len(songs)) + ")",
+                           [LYRICS_SEARCH_CONFIG] + [song.pk for song in songs])
+        elif connection.vendor == 'sqlite':
+            cursor.executemany("DELETE FROM " + LYRICS_FTS_TABLE + " WHERE rowid = %s", [[song.pk] for song in songs])
+            cursor.executemany("INSERT INTO " + LYRICS_FTS_TABLE + " (rowid, lyrics) VALUES (%s, %s)",
+                               [[song.pk, song.lyrics or ""] for song in songs])
+
+
+def unindex_song_lyrics(song, using='default'):
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM " + LYRICS_FTS_TABLE + " WHERE rowid = %s", [song.pk])
+
+
+def search_lyrics(queryset, q):
+    """
+    Restrict `queryset` to songs whose lyrics contain every word of `q`,
+    best match first. Each song gets a `lyrics_rank` (higher is better).
+    """
+    if not lyric_tokens(q):
+        return queryset.none()
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        tsquery = "plainto_tsquery('" + LYRICS_SEARCH_CONFIG + "', %s)"
+        queryset = queryset.extra(
+            select={'lyrics_rank': "ts_rank(api_song.lyrics_vector, " + tsquery + ")"},
+            select_params=[q],
+            where=["api_song.lyrics_vector @@ " + tsquery],
+            params=[q])
+    elif vendor == 'sqlite':
+        queryset = queryset.extra(
+            select={'lyrics_rank': "-bm25(" + LYRICS_FTS_TABLE + ")"},
+            tables=[LYRICS_FTS_TABLE],
+            where=[LYRICS_FTS_TABLE + ".rowid = api_song.id", LYRICS_FTS_TABLE + " MATCH %s"],
+            params=[fts5_query(q)])
+    else:
+        return queryset.filter(lyrics__icontains=q)
+    return queryset.order_by('-lyrics_rank', 'release_date')
+
+
+def lyric_match_positions(lyrics, q):
+    """
+    (start, end) character offsets of every word in `lyrics` matching a word of `q`.
+    """
+    tokens = set(lyric_tokens(q))
+    return [m.span() for m in re.finditer(r"\w+", lyrics or "") if m.group().lower() in tokens]
+
+
+@receiver(post_save, sender=Song)
+def update_song_lyrics_index(sender, instance=None, using='default', **kwargs):
+    index_song_lyrics(instance, using)
+
+
+@receiver(post_delete, sender=Song)
+def remove_song_lyrics_index(sender, instance=None, using='default', **kwargs):
+    unindex_song_lyrics(instance, using)
+
+
+def trigrams(text):
+    """
+    The trigram set pg_trgm extracts from `text`: each lower-cased word is
+    padded with two spaces in front and one behind.
+    """
+    found = set()
+    for word in re.findall(r"[^\W_]+", (text or "").lower()):
+        padded = "  " + word + " "
+        found.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return found
+
+
+def trigram_similarity(a, b):
+    left, right = trigrams(a), trigrams(b)
+    if not left or not right:
+        return 0.0
+    return len(left & right) / float(len(left | right))
+
+
+def search_similar(queryset, field_name, q, threshold=TRIGRAM_SIMILARITY_THRESHOLD):
+    """
+    Restrict `queryset` to rows whose `field_name` is trigram-similar to `q`,
+    most similar first. Each row gets a `similarity` between 0 and 1.
+    """
+    if not trigrams(q):
+        return queryset.none()
+    opts = queryset.model._meta
+    qn = connections[queryset.db].ops.quote_name
+    column = qn(opts.db_table) + "." + qn(opts.get_field(field_name).column)
+    where, params = ["similarity(" + column + ", %s) >= %s"], [q, threshold]
+    if connections[queryset.db].vendor == 'postgresql':
+        # pg_trgm's `%` operator is what lets the planner use the GIN trigram index
+        where, params = [column + " %% %s"] + where, [q] + params
+    return queryset.extra(
+        select={'similarity': "similarity(" + column + ", %s)"},
+        select_params=[q],
+        where=where,
+        params=params).order_by('-similarity')
+
+
+@receiver(connection_created)
+def register_trigram_similarity(sender, connection=None, **kwargs):
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function('similarity', 2, trigram_similarity)
@@ -1,14 +1,179 @@
+from functools import lru_cache
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.relations import ManyRelatedField
 from django.contrib.auth.models import User
-from api.models import Sense, Artist, Place, Song, Domain, SemanticClass, Annotation, Dictionary, Example
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import transaction
+from django.db.models import Manager, QuerySet
+from api.hyperlinks import FastHyperlinkedRelatedField, FastHyperlinkedIdentityField
+from api.models import Sense, Artist, Place, Song, Domain, SemanticClass, Annotation, Dictionary, Example, \
+    SENSE_RELATIONS
+from api.closure import circular_fields
 
 
-class SenseSerializer(serializers.HyperlinkedModelSerializer):
+def split_field_names(value):
+    return set(name.strip() for name in (value or "").split(",") if name.strip())
+
+
+def requested_fields(serializer_class, query_params):
+    """
+    The declared fields of `serializer_class` kept by `?fields=` and `?omit=`,
+    or None when neither is given. Unknown names are ignored.
+    """
+    fields, omit = split_field_names(query_params.get('fields')), split_field_names(query_params.get('omit'))
+    if not fields and not omit:
+        return None
+    names = serializer_class.Meta.fields
+    return frozenset(name for name in names if (not fields or name in fields) and name not in omit)
+
+
+def field_columns(model, field):
+    """
+    The lookups `field` reads from the row itself, or None if that can't be told.
+    """
+    if field.source == '*':
+        return ()
+    root = field.source.split('.')[0]
+    try:
+        model_field = model._meta.get_field(root)
+    except FieldDoesNotExist:
+        return None
+    if model_field.many_to_many or model_field.one_to_many:
+        return ()
+    return (field.source.replace('.', '__'),)
+
+
+@lru_cache(maxsize=None)
+def field_plans(serializer_class):
+    """
+    (name, columns, select_related, prefetch_related) for each readable field
+    of `serializer_class`, worked out once per class: dotted sources are
+    joined and many-valued relations are prefetched, except those its list
+    serializer loads itself. `columns` is None when it can't be told.
+    """
+    model = serializer_class.Meta.model
+    loaded = getattr(getattr(serializer_class.Meta, 'list_serializer_class', None), 'loaded_relations', ())
+    plans = []
+    for name, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        select = prefetch = None
+        if field.source != '*':
+            if isinstance(field, ManyRelatedField):
+                if field.source not in loaded:
+                    prefetch = field.source
+            elif '.' in field.source:
+                select = field.source.rsplit('.', 1)[0].replace('.', '__')
+        plans.append((name, field_columns(model, field), select, prefetch))
+    return tuple(plans)
+
+
+def queryset_plan(serializer_class, keep=None):
+    """
+    (select_related, prefetch_related, only) lookups covering the fields of
+    `serializer_class`, or just those in `keep`. `only` is None unless `keep`
+    narrows the columns.
+    """
+    model = serializer_class.Meta.model
+    select, prefetch, columns = [], [], set()
+    for name, found, related, many in field_plans(serializer_class):
+        if keep is not None and name not in keep:
+            continue
+        if columns is not None:
+            columns = columns.union(found) if found is not None else None
+        if related:
+            select.append(related)
+        if many:
+            prefetch.append(many)
+    if keep is None or columns is None:
+        only = None
+    else:
+        # pagination reads the ordering fields back off the last row
+        ordering = [name.lstrip('-') for name in model._meta.ordering]
+        only = tuple(sorted(columns.union(ordering, [model._meta.pk.name])))
+    return tuple(select), tuple(prefetch), only
+
+
+def apply_queryset_plan(queryset, serializer_class, keep=None):
+    select, prefetch, only = queryset_plan(serializer_class, keep)
+    # select_related() without arguments would follow every foreign key
+    if select:
+        queryset = queryset.select_related(*select)
+    if only is not None:
+        queryset = queryset.only(*only)
+    return queryset.prefetch_related(*prefetch)
+
+
+class ApiSerializer(serializers.HyperlinkedModelSerializer):
+    """
+    Hyperlinked serializer whose URLs come from the precompiled routes in
+    api.hyperlinks rather than reverse(). On reads, `?fields=` and `?omit=`
+    narrow the fields it renders. Updates that would make an object its own
+    ancestor in a hierarchy (see api.closure) are rejected.
+    """
+    serializer_related_field = FastHyperlinkedRelatedField
+    serializer_url_field = FastHyperlinkedIdentityField
+
+    def __init__(self, *args, **kwargs):
+        super(ApiSerializer, self).__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None and request.method in SAFE_METHODS:
+            keep = requested_fields(type(self), getattr(request, 'query_params', request.GET))
+            if keep is not None:
+                for name in set(self.fields) - keep:
+                    self.fields.pop(name)
+
+    def validate(self, attrs):
+        if self.instance is not None and not isinstance(self.instance, (list, QuerySet)):
+            circular = circular_fields(self.instance, attrs)
+            if circular:
+                raise serializers.ValidationError(dict(
+                    (name, ["This would make the object its own ancestor."]) for name in circular))
+        return attrs
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            try:
+                return super(ApiSerializer, self).create(validated_data)
+            except ValidationError as e:
+                raise serializers.ValidationError(e.messages)
+
+    def update(self, instance, validated_data):
+        # the relations are set one after another, so a write refused
+        # half-way must not leave the others behind
+        with transaction.atomic():
+            try:
+                return super(ApiSerializer, self).update(instance, validated_data)
+            except ValidationError as e:
+                raise serializers.ValidationError(e.messages)
+
+
+class SenseListSerializer(serializers.ListSerializer):
+    loaded_relations = tuple(relation for relation, _, _ in SENSE_RELATIONS)
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, Manager) else data
+        if self.child.needs_relations():
+            iterable = Sense.objects.load_relations(iterable)
+        return super(SenseListSerializer, self).to_representation(iterable)
+
+
+class SenseSerializer(ApiSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
-    highlight = serializers.HyperlinkedIdentityField(view_name='sense-highlight', format='html')
+    highlight = FastHyperlinkedIdentityField(view_name='sense-highlight', format='html')
+
+    def needs_relations(self):
+        return any(relation in self.fields for relation in SenseListSerializer.loaded_relations)
+
+    def to_representation(self, instance):
+        if self.needs_relations():
+            Sense.objects.load_relations([instance])
+        return super(SenseSerializer, self).to_representation(instance)
 
     class Meta:
         model = Sense
+        list_serializer_class = SenseListSerializer
         fields = (
             'url',
             'highlight',
@@ -33,9 +198,9 @@ class SenseSerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class ArtistSerializer(serializers.HyperlinkedModelSerializer):
+class ArtistSerializer(ApiSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
-    highlight = serializers.HyperlinkedIdentityField(view_name='artist-highlight', format='html')
+    highlight = FastHyperlinkedIdentityField(view_name='artist-highlight', format='html')
 
     class Meta:
         model = Artist
@@ -53,9 +218,9 @@ class ArtistSerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class PlaceSerializer(serializers.HyperlinkedModelSerializer):
+class PlaceSerializer(ApiSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
-    highlight = serializers.HyperlinkedIdentityField(view_name='place-highlight', format='html')
+    highlight = FastHyperlinkedIdentityField(view_name='place-highlight', format='html')
 
     class Meta:
         model = Place
@@ -73,9 +238,9 @@ class PlaceSerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class SongSerializer(serializers.HyperlinkedModelSerializer):
+class SongSerializer(ApiSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
-    highlight = serializers.HyperlinkedIdentityField(view_name='song-highlight', format='html')
+    highlight = FastHyperlinkedIdentityField(view_name='song-highlight', format='html')
 
     class Meta:
         model = Song
@@ -94,9 +259,9 @@ class SongSerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class DictionarySerializer(serializers.HyperlinkedModelSerializer):
+class DictionarySerializer(ApiSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
-    highlight = serializers.HyperlinkedIdentityField(view_name='dictionary-highlight', format='html')
+    highlight = FastHyperlinkedIdentityField(view_name='dictionary-highlight', format='html')
 
     class Meta:
         model = Dictionary
@@ -109,9 +274,9 @@ class DictionarySerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class DomainSerializer(serializers.HyperlinkedModelSerializer):
+class DomainSerializer(ApiSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
-    highlight = serializers.HyperlinkedIdentityField(view_name='domain-highlight', format='html')
+    highlight = FastHyperlinkedIdentityField(view_name='domain-highlight', format='html')
 
     class Meta:
         model = Domain
@@ -126,9 +291,9 @@ class DomainSerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class SemanticClassSerializer(serializers.HyperlinkedModelSerializer):
+class SemanticClassSerializer(ApiSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
-    highlight = serializers.HyperlinkedIdentityField(view_name='semanticclass-highlight', format='html')
+    highlight = FastHyperlinkedIdentityField(view_name='semanticclass-highlight', format='html')
 
     class Meta:
         model = SemanticClass
@@ -143,9 +308,9 @@ class SemanticClassSerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class ExampleSerializer(serializers.HyperlinkedModelSerializer):
+class ExampleSerializer(ApiSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
-    highlight = serializers.HyperlinkedIdentityField(view_name='example-highlight', format='html')
+    highlight = FastHyperlinkedIdentityField(view_name='example-highlight', format='html')
 
     class Meta:
         model = Example
@@ -161,9 +326,9 @@ class ExampleSerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class AnnotationSerializer(serializers.HyperlinkedModelSerializer):
+class AnnotationSerializer(ApiSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
-    highlight = serializers.HyperlinkedIdentityField(view_name='annotation-highlight', format='html')
+    highlight = FastHyperlinkedIdentityField(view_name='annotation-highlight', format='html')
 
     class Meta:
         model = Annotation
@@ -181,8 +346,8 @@ class AnnotationSerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
-    senses = serializers.HyperlinkedRelatedField(many=True, view_name='sense-detail', read_only=True)
+class UserSerializer(ApiSerializer):
+    senses = FastHyperlinkedRelatedField(many=True, view_name='sense-detail', read_only=True)
 
     class Meta:
         model = User
@@ -0,0 +1,181 @@
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITransactionTestCase
+
+from api.bulk import assign_ids
+from api.caching import payload_cache
+from api.models import Sense, Artist, Song, Example, Annotation
+from api.tests.test_views import BaseApiTest
+from api.utils import make_uri
+
+
+class BulkWriteTest(BaseApiTest):
+
+    def setUp(self):
+        super(BulkWriteTest, self).setUp()
+        self.artist = Artist.objects.create(owner=self.user, name="artist")
+        self.featured = Artist.objects.create(owner=self.user, name="featured")
+        self.song = Song.objects.create(owner=self.user, title="song", album="album", release_date="2001-01-01")
+        self.sense = Sense.objects.create(owner=self.user, headword="word", part_of_speech="noun")
+        self.song_uri = make_uri(self.host, 'songs', self.song.pk)
+        self.artist_uri = make_uri(self.host, 'artists', self.artist.pk)
+        self.examples_url = reverse('example-bulk')
+        self.annotations_url = reverse('annotation-bulk')
+
+    def example_rows(self, count):
+        return [{
+            "text": "line %d with a word" % i,
+            "from_song": self.song_uri,
+            "primary_artists": [self.artist_uri],
+            "featured_artists": [make_uri(self.host, 'artists', self.featured.pk)],
+            "annotations": [],
+        } for i in range(count)]
+
+    def post(self, url, rows):
+        return self.client.post(url, rows, format='json')
+
+    def test_create_examples(self):
+        response = self.post(self.examples_url, self.example_rows(3))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        examples = Example.objects.order_by('id')
+        self.assertEqual([e.text for e in examples], ["line 0 with a word", "line 1 with a word", "line 2 with a word"])
+        self.assertEqual([e.slug for e in examples], ["line-0-with-a-word", "line-1-with-a-word", "line-2-with-a-word"])
+        self.assertEqual(examples[0].rendered, "line 0 with a word")
+        self.assertEqual(list(examples[2].primary_artists.all()), [self.artist])
+        self.assertEqual(list(examples[2].featured_artists.all()), [self.featured])
+        self.assertEqual(response.data[2]['url'], make_uri(self.host, 'examples', examples[2].pk))
+
+    def test_query_count_does_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as few:
+            self.post(self.examples_url, self.example_rows(2))
+        Example.objects.all().delete()
+        with CaptureQueriesContext(connection) as many:
+            self.post(self.examples_url, self.example_rows(40))
+        self.assertEqual(Example.objects.count(), 40)
+        self.assertEqual(len(few), len(many))
+
+    def test_errors_are_reported_per_row(self):
+        Example.objects.create(owner=self.user, from_song=self.song, text="taken")
+        rows = self.example_rows(4)
+        rows[1]["from_song"] = make_uri(self.host, 'songs', 999)
+        rows[2]["text"] = "taken"
+        rows[3]["text"] = rows[0]["text"]
+        response = self.post(self.examples_url, rows)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('from_song', response.data[1])
+        self.assertIn('non_field_errors', response.data[2])
+        self.assertIn('non_field_errors', response.data[3])
+        self.assertEqual(Example.objects.count(), 1)
+
+    def test_reverse_relations_are_not_moved(self):
+        example = Example.objects.create(owner=self.user, from_song=self.song, text="a word")
+        annotation = Annotation.objects.create(owner=self.user, example=example, text="word", offset=2)
+        rows = self.example_rows(1)
+        rows[0]["annotations"] = [make_uri(self.host, 'annotations', annotation.pk)]
+        response = self.post(self.examples_url, rows)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('annotations', response.data[0])
+
+    def test_assign_ids_reads_back_by_natural_key(self):
+        names = ('title', 'album', 'release_date_string')
+        older = Song.objects.create(owner=self.user, title="song", album="album", release_date="2001-01-01")
+        songs = [Song(owner=self.user, title="song", album="album", release_date="2001-01-01"),
+                 Song(owner=self.user, title="other", album="album", release_date="2001-01-01")]
+        Song.objects.bulk_create(songs)
+        assign_ids(Song, songs, 'default', names)
+        self.assertEqual(sorted(song.pk for song in songs),
+                         sorted(Song.objects.exclude(pk__in=[older.pk, self.song.pk]).values_list('pk', flat=True)))
+        self.assertEqual(Song.objects.get(pk=songs[1].pk).title, "other")
+
+    def test_non_list_payload(self):
+        response = self.post(self.examples_url, {"text": "one"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('non_field_errors', response.data)
+
+    def test_create_annotations_renders_examples(self):
+        example = Example.objects.create(owner=self.user, from_song=self.song, text="a word and a rhyme")
+        other = Annotation.objects.create(owner=self.user, example=example, text="rhyme", offset=13)
+        example_uri = make_uri(self.host, 'examples', example.pk)
+        response = self.post(self.annotations_url, [
+            {"text": "word", "offset": 2, "example": example_uri,
+             "sense": make_uri(self.host, 'senses', self.sense.pk),
+             "rhymes": [make_uri(self.host, 'annotations', other.pk)]},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        annotation = Annotation.objects.get(text="word")
+        self.assertEqual(annotation.slug, "word")
+        self.assertEqual(list(other.rhymes.all()), [annotation])
+        self.assertEqual(list(annotation.rhymes.all()), [other])
+        example.refresh_from_db()
+        self.assertIn('<a href="/senses/%d/">word</a>' % self.sense.pk, example.rendered)
+
+    def test_update_examples(self):
+        created = self.post(self.examples_url, self.example_rows(2)).data
+        response = self.client.patch(self.examples_url, [
+            {"url": created[0]['url'], "text": "changed line", "featured_artists": []},
+            {"url": created[1]['url'], "primary_artists": [make_uri(self.host, 'artists', self.featured.pk)]},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first, second = Example.objects.order_by('id')
+        self.assertEqual((first.text, first.slug, first.rendered), ("changed line", "changed-line", "changed line"))
+        self.assertEqual(list(first.featured_artists.all()), [])
+        self.assertEqual(list(first.primary_artists.all()), [self.artist])
+        self.assertEqual(second.text, "line 1 with a word")
+        self.assertEqual(list(second.primary_artists.all()), [self.featured])
+
+    def test_update_needs_urls(self):
+        self.post(self.examples_url, self.example_rows(1))
+        response = self.client.patch(self.examples_url, [
+            {"text": "no url"},
+            {"url": make_uri(self.host, 'examples', 999), "text": "missing"},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('url', response.data[0])
+        self.assertIn('url', response.data[1])
+
+
+class BulkCommitTest(APITransactionTestCase):
+    """
+    Cache invalidation waits for the commit, which TestCase never reaches.
+    """
+
+    def setUp(self):
+        payload_cache().clear()
+        self.user = User.objects.create(username="test", email="ad@min.com", password="admin", is_superuser=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.host = "testserver"
+        self.song = Song.objects.create(owner=self.user, title="song", album="album", release_date="2001-01-01")
+        self.sense = Sense.objects.create(owner=self.user, headword="word", part_of_speech="noun")
+        self.annotations_url = reverse('annotation-bulk')
+
+    def post(self, url, rows):
+        return self.client.post(url, rows, format='json')
+
+    def test_create_invalidates_caches(self):
+        example = Example.objects.create(owner=self.user, from_song=self.song, text="a word")
+        highlight_url = reverse('sense-highlight', kwargs={'pk': self.sense.pk})
+        etag = self.client.get(highlight_url)['ETag']
+        self.client.get(reverse('annotation-list'))
+        self.post(self.annotations_url, [{"text": "word", "offset": 2,
+                                          "example": make_uri(self.host, 'examples', example.pk),
+                                          "sense": make_uri(self.host, 'senses', self.sense.pk)}])
+        response = self.client.get(highlight_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "a <a")
+        self.assertEqual(self.client.get(reverse('annotation-list'))['X-Cache'], "MISS")
+
+    def test_failed_upkeep_writes_nothing(self):
+        example = Example.objects.create(owner=self.user, from_song=self.song, text="a word")
+        row = {"text": "word", "offset": 2, "example": make_uri(self.host, 'examples', example.pk)}
+        with mock.patch('api.bulk.touch', side_effect=RuntimeError), \
+                mock.patch('api.bulk.invalidate') as invalidate, self.assertRaises(RuntimeError):
+            self.post(self.annotations_url, [row])
+        self.assertFalse(Annotation.objects.exists())
+        self.assertFalse(invalidate.called)
@@ -0,0 +1,205 @@
+import warnings
+from django.core.cache.backends.base import CacheKeyWarning
+from django.urls import reverse
+from rest_framework import status
+
+from api.caching import payload_cache, collect_tags, object_tag, generations, generation_key, bump_generation
+from api.models import Sense, Artist, Song, Example, Annotation
+from api.tests.test_views import BaseApiTest
+
+
+class StrictCacheKeysMixin(object):
+    """
+    Fail on keys memcached would refuse, which the local cache only warns about.
+    """
+
+    def setUp(self):
+        super(StrictCacheKeysMixin, self).setUp()
+        catcher = warnings.catch_warnings()
+        catcher.__enter__()
+        self.addCleanup(catcher.__exit__)
+        warnings.simplefilter('error', CacheKeyWarning)
+
+
+class PayloadCacheTest(StrictCacheKeysMixin, BaseApiTest):
+
+    def setUp(self):
+        super(PayloadCacheTest, self).setUp()
+        self.sense = Sense.objects.create(owner=self.user, headword="test sense", part_of_speech="noun")
+        self.song = Song.objects.create(owner=self.user, title="song", album="album", release_date="2001-01-01")
+        self.example = Example.objects.create(owner=self.user, from_song=self.song, text="a test sense here")
+        self.annotation = Annotation.objects.create(owner=self.user, example=self.example, text="test sense",
+                                                    offset=2, sense=self.sense)
+        self.detail_url = reverse('sense-detail', kwargs={'pk': self.sense.pk})
+        self.highlight_url = reverse('sense-highlight', kwargs={'pk': self.sense.pk})
+
+    def test_retrieve_is_read_through(self):
+        first = self.client.get(self.detail_url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            second = self.client.get(self.detail_url)
+        self.assertEqual(first.data, second.data)
+
+    def test_highlight_is_read_through(self):
+        first = self.client.get(self.highlight_url)
+        with self.assertNumQueries(1):
+            second = self.client.get(self.highlight_url)
+        self.assertEqual(first.content, second.content)
+
+    def test_edit_drops_retrieve(self):
+        self.client.get(self.detail_url)
+        self.sense.definition = "changed"
+        self.sense.save()
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data['definition'], "changed")
+
+    def test_example_edit_drops_sense_page(self):
+        self.client.get(self.highlight_url)
+        self.example.text = "A test sense here"
+        self.example.save()
+        response = self.client.get(self.highlight_url)
+        self.assertContains(response, 'A <a href="/senses/')
+
+    def test_new_annotation_drops_sense_page(self):
+        response = self.client.get(self.highlight_url)
+        self.assertNotContains(response, "another ")
+        example_ = Example.objects.create(owner=self.user, from_song=self.song, text="another test sense")
+        Annotation.objects.create(owner=self.user, example=example_, text="test sense", offset=8, sense=self.sense)
+        response = self.client.get(self.highlight_url)
+        self.assertContains(response, "another ")
+
+    def test_moved_annotation_drops_previous_page(self):
+        self.client.get(self.highlight_url)
+        other = Sense.objects.create(owner=self.user, headword="other sense", part_of_speech="noun")
+        self.annotation.sense = other
+        self.annotation.save()
+        response = self.client.get(self.highlight_url)
+        self.assertNotContains(response, "a test sense here")
+
+    def test_m2m_change_drops_both_sides(self):
+        other = Sense.objects.create(owner=self.user, headword="other sense", part_of_speech="noun")
+        other_url = reverse('sense-highlight', kwargs={'pk': other.pk})
+        self.client.get(self.highlight_url)
+        self.client.get(other_url)
+        other.synonyms.add(self.sense)
+        self.assertContains(self.client.get(self.highlight_url), "other sense")
+        self.assertContains(self.client.get(other_url), "test sense")
+
+    def test_m2m_clear_drops_far_side(self):
+        artist = Artist.objects.create(owner=self.user, name="artist")
+        self.example.primary_artists.add(artist)
+        url = reverse('example-detail', kwargs={'pk': self.example.pk})
+        self.assertEqual(len(self.client.get(url).data['primary_artists']), 1)
+        artist.primary_examples.clear()
+        self.assertEqual(self.client.get(url).data['primary_artists'], [])
+
+    def test_shared_tag_drops_every_payload(self):
+        self.client.get(self.detail_url)
+        self.client.get(self.highlight_url)
+        # both payloads carry the sense's tag
+        self.sense.definition = "changed"
+        self.sense.save()
+        self.assertEqual(self.client.get(self.detail_url).data['definition'], "changed")
+        self.assertContains(self.client.get(self.highlight_url), "changed")
+
+    def test_unrelated_edit_keeps_payload(self):
+        self.client.get(self.highlight_url)
+        Artist.objects.create(owner=self.user, name="unrelated")
+        with self.assertNumQueries(1):
+            self.client.get(self.highlight_url)
+
+    def test_keys_vary_by_scheme(self):
+        self.client.get(self.detail_url)
+        response = self.client.get(self.detail_url, secure=True)
+        self.assertTrue(response.data['url'].startswith("https://"))
+
+    def test_sparse_fields_share_a_safe_key(self):
+        first = self.client.get(self.detail_url + "?fields=headword, url")
+        self.assertEqual(set(first.data), {'headword', 'url'})
+        with self.assertNumQueries(1):
+            second = self.client.get(self.detail_url + "?fields=url,headword")
+        self.assertEqual(first.data, second.data)
+
+    def test_collect_tags_follows_foreign_keys(self):
+        tags = collect_tags({'annotations': Annotation.objects.all()})
+        self.assertIn(object_tag(Annotation, self.annotation.pk), tags)
+        self.assertIn(object_tag(Example, self.example.pk), tags)
+        self.assertIn(object_tag(Sense, self.sense.pk), tags)
+
+
+
+class ResultCacheTest(StrictCacheKeysMixin, BaseApiTest):
+
+    def setUp(self):
+        super(ResultCacheTest, self).setUp()
+        self.sense = Sense.objects.create(owner=self.user, headword="test sense", part_of_speech="noun")
+        self.list_url = reverse('sense-list')
+        self.search_url = reverse('sense-search')
+
+    def test_list_is_cached(self):
+        self.assertEqual(self.client.get(self.list_url)['X-Cache'], "MISS")
+        with self.assertNumQueries(0):
+            response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], "HIT")
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_params_are_normalized(self):
+        self.client.get(self.list_url, {"headword": "test sense", "part_of_speech": "noun"})
+        response = self.client.get(self.list_url + "?part_of_speech=noun&headword=test+sense")
+        self.assertEqual(response['X-Cache'], "HIT")
+        response = self.client.get(self.list_url, {"headword": "other"})
+        self.assertEqual(response['X-Cache'], "MISS")
+
+    def test_write_moves_generation(self):
+        self.client.get(self.list_url)
+        Sense.objects.create(owner=self.user, headword="new sense", part_of_speech="noun")
+        response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], "MISS")
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_related_write_moves_generation(self):
+        self.client.get(self.list_url)
+        song = Song.objects.create(owner=self.user, title="song", album="album", release_date="2001-01-01")
+        self.assertEqual(self.client.get(self.list_url)['X-Cache'], "HIT")
+        example = Example.objects.create(owner=self.user, from_song=song, text="test sense")
+        Annotation.objects.create(owner=self.user, example=example, text="test sense", offset=0, sense=self.sense)
+        response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], "MISS")
+        self.assertEqual(len(response.data['results'][0]['annotations']), 1)
+
+    def test_m2m_change_moves_generation(self):
+        other = Sense.objects.create(owner=self.user, headword="other sense", part_of_speech="noun")
+        self.client.get(self.list_url)
+        other.synonyms.add(self.sense)
+        self.assertEqual(self.client.get(self.list_url)['X-Cache'], "MISS")
+
+    def test_search_is_cached(self):
+        self.client.get(self.search_url, {"q": "test"})
+        response = self.client.get(self.search_url, {"q": "test"})
+        self.assertEqual(response['X-Cache'], "HIT")
+        self.assertContains(response, "csrfmiddlewaretoken")
+
+    def test_generations_survive_eviction(self):
+        before = generations([Sense])[0]
+        bump_generation(Sense)
+        self.assertEqual(generations([Sense])[0], before + 1)
+        payload_cache().delete(generation_key(Sense))
+        self.assertNotEqual(generations([Sense])[0], before + 1)
+
+    def test_stats(self):
+        self.client.get(self.list_url)
+        self.client.get(self.list_url)
+        self.client.get(self.search_url)
+        self.client.get(reverse('place-clusters'))
+        self.client.get(reverse('annotation-rhyme-families'))
+        response = self.client.get(reverse('cache-stats'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('cache-stats'))
+        self.assertEqual(response.data, {
+            'api.sense.list': {'hits': 1, 'misses': 1},
+            'api.sense.search': {'hits': 0, 'misses': 1},
+            'api.place.clusters': {'hits': 0, 'misses': 1},
+            'api.annotation.rhyme_families': {'hits': 0, 'misses': 1},
+        })
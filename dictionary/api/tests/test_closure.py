@@ -0,0 +1,237 @@
+from unittest import mock
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.text import slugify
+from rest_framework import status
+
+from api.caching import payload_cache
+from api.models import Sense, SenseClosure, Place, PlaceClosure, Artist, Song, Example, Domain, SemanticClass
+from api.tests.test_views import BaseApiTest
+
+
+class TaxonomyTest(BaseApiTest):
+
+    def setUp(self):
+        super(TaxonomyTest, self).setUp()
+        self.weapon, self.gun, self.pistol, self.glock, self.knife, self.barrel = [
+            Sense.objects.create(owner=self.user, headword=headword, part_of_speech="noun", definition=headword)
+            for headword in ("weapon", "gun", "pistol", "glock", "knife", "barrel")]
+        self.gun.hypernyms.add(self.weapon)
+        self.knife.hypernyms.add(self.weapon)
+        self.weapon.hyponyms.add(self.gun)
+        self.pistol.hypernyms.add(self.gun)
+        self.glock.hypernyms.add(self.pistol)
+
+    def depths(self, queryset):
+        return [(sense.headword, sense.depth) for sense in queryset]
+
+    def test_descendants(self):
+        self.assertEqual(self.depths(Sense.objects.descendants(self.weapon)),
+                         [("gun", 1), ("knife", 1), ("pistol", 2), ("glock", 3)])
+
+    def test_ancestors(self):
+        self.assertEqual(self.depths(Sense.objects.ancestors(self.glock)), [("pistol", 1), ("gun", 2), ("weapon", 3)])
+        self.assertEqual(Sense.objects.depth(self.glock), 3)
+        self.assertEqual(Sense.objects.depth(self.weapon), 0)
+
+    def test_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(Sense.objects.descendants(self.weapon))
+        self.assertEqual(len(queries), 1)
+
+    def test_remove_and_clear(self):
+        self.pistol.hypernyms.remove(self.gun)
+        self.assertEqual(self.depths(Sense.objects.ancestors(self.glock)), [("pistol", 1)])
+        self.pistol.hypernyms.add(self.gun)
+        self.weapon.hyponyms.clear()
+        self.assertEqual(list(Sense.objects.descendants(self.weapon)), [])
+        self.assertEqual(self.depths(Sense.objects.ancestors(self.glock)), [("pistol", 1), ("gun", 2)])
+
+    def test_shortest_path(self):
+        self.glock.hypernyms.add(self.weapon)
+        self.assertEqual(self.depths(Sense.objects.ancestors(self.glock)), [("pistol", 1), ("weapon", 1), ("gun", 2)])
+
+    def test_delete(self):
+        self.gun.delete()
+        self.assertEqual(self.depths(Sense.objects.ancestors(self.glock)), [("pistol", 1)])
+
+    def assertCircular(self, add, *senses):
+        with self.assertRaises(ValidationError), transaction.atomic():
+            add(*senses)
+
+    def test_cycles_are_rejected(self):
+        self.assertCircular(self.weapon.hypernyms.add, self.glock)
+        self.assertCircular(self.glock.hyponyms.add, self.weapon)
+        self.assertCircular(self.gun.hypernyms.add, self.gun)
+        self.assertEqual(list(self.weapon.hypernyms.all()), [])
+
+    def test_meronyms(self):
+        self.gun.meronyms.add(self.barrel)
+        self.assertEqual(self.depths(Sense.objects.ancestors(self.barrel, 'meronyms')), [("gun", 1)])
+        self.assertEqual(self.depths(Sense.objects.descendants(self.gun, 'meronyms')), [("barrel", 1)])
+        self.assertFalse(SenseClosure.objects.filter(taxonomy='hypernyms', descendant=self.barrel).exists())
+        self.assertCircular(self.barrel.meronyms.add, self.gun)
+
+    def test_endpoints(self):
+        response = self.client.get(reverse('sense-descendants', kwargs={'pk': self.weapon.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(s['headword'], s['depth']) for s in response.data],
+                         [("gun", 1), ("knife", 1), ("pistol", 2), ("glock", 3)])
+        response = self.client.get(reverse('sense-ancestors', kwargs={'pk': self.glock.pk}), {'fields': 'headword'})
+        self.assertEqual(response.data, [{"headword": "pistol", "depth": 1}, {"headword": "gun", "depth": 2},
+                                         {"headword": "weapon", "depth": 3}])
+        response = self.client.get(reverse('sense-ancestors', kwargs={'pk': self.glock.pk}), {'taxonomy': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_serializer_rejects_cycles(self):
+        url = reverse('sense-detail', kwargs={'pk': self.weapon.pk})
+        glock = reverse('sense-detail', kwargs={'pk': self.glock.pk})
+        response = self.client.patch(url, {"hypernyms": [glock]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("hypernyms", response.data)
+
+    def test_serializer_rejects_cycles_across_both_ends(self):
+        url = reverse('sense-detail', kwargs={'pk': self.barrel.pk})
+        response = self.client.patch(url, {
+            "hypernyms": [reverse('sense-detail', kwargs={'pk': self.glock.pk})],
+            "hyponyms": [reverse('sense-detail', kwargs={'pk': self.weapon.pk})]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(sorted(response.data), ["hypernyms", "hyponyms"])
+        self.assertEqual(list(self.barrel.hypernyms.all()), [])
+        self.assertEqual(list(self.barrel.hyponyms.all()), [])
+
+    def test_signal_guard_rolls_the_update_back(self):
+        url = reverse('sense-detail', kwargs={'pk': self.barrel.pk})
+        with mock.patch('api.serializers.circular_fields', return_value=[]):
+            response = self.client.patch(url, {
+                "definition": "changed",
+                "hyponyms": [reverse('sense-detail', kwargs={'pk': self.knife.pk})],
+                "hypernyms": [reverse('sense-detail', kwargs={'pk': self.barrel.pk})]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Sense.objects.get(pk=self.barrel.pk).definition, "barrel")
+        self.assertEqual(list(self.barrel.hyponyms.all()), [])
+
+
+class PlaceHierarchyTest(BaseApiTest):
+
+    def setUp(self):
+        super(PlaceHierarchyTest, self).setUp()
+        self.usa, self.texas, self.houston, self.third_ward, self.queens = [
+            Place.objects.create(owner=self.user, name=name.split(", ")[0], full_name=name, slug=slugify(name))
+            for name in ("USA", "Texas, USA", "Houston, Texas, USA", "Third Ward, Houston, Texas, USA",
+                         "Queens, New York, USA")]
+        self.usa.contains.add(self.texas, self.queens)
+        self.texas.contains.add(self.houston)
+        self.third_ward.within.add(self.houston)
+
+        self.ugk = Artist.objects.create(owner=self.user, name="UGK", slug="ugk", origin=self.third_ward)
+        self.dj_screw = Artist.objects.create(owner=self.user, name="DJ Screw", slug="dj-screw", origin=self.houston)
+        self.pimp_c = Artist.objects.create(owner=self.user, name="Pimp C", slug="pimp-c", origin=self.texas)
+        Artist.objects.create(owner=self.user, name="Nas", slug="nas", origin=self.queens)
+
+        song = Song.objects.create(owner=self.user, title="Pocket Full of Stones", album="Too Hard to Swallow",
+                                   release_date="1992-11-10", release_date_string="1992-11-10")
+        self.example = Example.objects.create(owner=self.user, from_song=song, text="Third Ward, Houston")
+        self.example.mentions_place.add(self.third_ward, self.houston)
+
+    def names(self, url, **params):
+        response = self.client.get(reverse(url), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(item.get('full_name') or item.get('name') or item.get('text') for item in response.data['results'])
+
+    def test_places(self):
+        self.assertEqual(self.names('place-list', within="texas-usa"), ["Houston, Texas, USA"])
+        self.assertEqual(self.names('place-list', within="texas-usa", recursive=1),
+                         ["Houston, Texas, USA", "Third Ward, Houston, Texas, USA"])
+        self.assertEqual(len(self.names('place-list', within="usa", recursive=1)), 4)
+
+    def test_artists(self):
+        self.assertEqual(self.names('artist-list', within="texas-usa"), ["DJ Screw", "Pimp C"])
+        self.assertEqual(self.names('artist-list', within="texas-usa", recursive=1), ["DJ Screw", "Pimp C", "UGK"])
+
+    def test_examples(self):
+        self.assertEqual(self.names('example-list', within="texas-usa", recursive=1), ["Third Ward, Houston"])
+        self.assertEqual(self.names('example-list', within="queens-new-york-usa", recursive=1), [])
+
+    def test_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(Artist.objects.filter(origin__in=Place.objects.within("usa", True, True).values('pk')))
+        self.assertEqual(len(queries), 1)
+
+    def test_upkeep(self):
+        self.texas.contains.remove(self.houston)
+        self.assertEqual(self.names('artist-list', within="usa", recursive=1), ["Nas", "Pimp C"])
+        self.houston.delete()
+        self.assertFalse(PlaceClosure.objects.filter(descendant=self.third_ward).exists())
+        with self.assertRaises(ValidationError), transaction.atomic():
+            self.queens.contains.add(self.usa)
+
+
+class CategoryHierarchyTest(BaseApiTest):
+
+    def setUp(self):
+        super(CategoryHierarchyTest, self).setUp()
+        payload_cache().clear()
+        self.crime, self.drugs, self.weed, self.cars = [
+            Domain.objects.create(owner=self.user, name=name, slug=slugify(name))
+            for name in ("Crime", "Drugs", "Weed", "Cars")]
+        self.drugs.broader.add(self.crime)
+        self.weed.broader.add(self.drugs)
+        self.senses = dict((headword, Sense.objects.create(owner=self.user, headword=headword,
+                                                           part_of_speech="noun", definition=headword))
+                           for headword in ("heist", "kilo", "blunt", "chronic", "candy paint"))
+        self.senses["heist"].domains.add(self.crime)
+        self.senses["kilo"].domains.add(self.drugs, self.crime)
+        self.senses["blunt"].domains.add(self.weed)
+        self.senses["chronic"].domains.add(self.weed)
+        self.senses["candy paint"].domains.add(self.cars)
+
+    def headwords(self, domain, **params):
+        response = self.client.get(reverse('domain-senses', kwargs={'pk': domain.pk}), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['headword'] for item in response.data['results']]
+
+    def test_subtree_senses(self):
+        self.assertEqual(self.headwords(self.crime), ["blunt", "chronic", "heist", "kilo"])
+        self.assertEqual(self.headwords(self.crime, recursive=0), ["heist", "kilo"])
+        self.assertEqual(self.headwords(self.weed), ["blunt", "chronic"])
+
+    def test_counts(self):
+        counts = Domain.objects.subtree_sense_counts([d.pk for d in (self.crime, self.drugs, self.weed, self.cars)])
+        self.assertEqual(counts, {self.crime.pk: 4, self.drugs.pk: 3, self.weed.pk: 2, self.cars.pk: 1})
+
+    def test_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(Domain.objects.subtree_senses(self.crime))
+        self.assertEqual(len(queries), 1)
+
+    def test_highlight(self):
+        url = reverse('domain-highlight', kwargs={'pk': self.crime.pk})
+        response = self.client.get(url, {'page_size': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.context['sense_count'], 4)
+        self.assertEqual([s.headword for s in response.context['senses']], ["blunt", "chronic", "heist"])
+        self.assertEqual([(d.name, d.sense_count) for d in response.context['narrower']], [("Drugs", 3)])
+        self.assertIsNotNone(response.context['next'])
+        self.assertNotIn('ETag', response)
+
+    def test_counts_follow_writes(self):
+        url = reverse('domain-highlight', kwargs={'pk': self.crime.pk})
+        self.client.get(url)
+        self.weed.broader.remove(self.drugs)
+        self.assertEqual(self.client.get(url).context['sense_count'], 2)
+        self.senses["candy paint"].domains.add(self.weed)
+        self.cars.broader.add(self.crime)
+        self.assertEqual(self.client.get(url).context['sense_count'], 3)
+
+    def test_semantic_classes(self):
+        person, hustler = [SemanticClass.objects.create(owner=self.user, name=name, slug=slugify(name))
+                           for name in ("Person", "Hustler")]
+        hustler.broader.add(person)
+        self.senses["kilo"].semantic_classes.add(hustler)
+        response = self.client.get(reverse('semanticclass-senses', kwargs={'pk': person.pk}))
+        self.assertEqual([item['headword'] for item in response.data['results']], ["kilo"])
+        with self.assertRaises(ValidationError), transaction.atomic():
+            person.broader.add(hustler)
@@ -0,0 +1,112 @@
+from datetime import timedelta
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import status
+
+from api.models import Sense, Song, Example, Annotation
+from api.tests.test_views import BaseApiTest
+
+
+class ConditionalGetTest(BaseApiTest):
+
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.sense = Sense.objects.create(owner=self.user, headword="test sense", part_of_speech="noun")
+        self.detail_url = reverse('sense-detail', kwargs={'pk': self.sense.pk})
+        self.highlight_url = reverse('sense-highlight', kwargs={'pk': self.sense.pk})
+
+    def test_GET_sets_validators(self):
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_highlight_has_its_own_etag(self):
+        detail_etag = self.client.get(self.detail_url)['ETag']
+        response = self.client.get(self.highlight_url, HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.highlight_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_sparse_fields_have_their_own_etag(self):
+        full = self.client.get(self.detail_url)['ETag']
+        response = self.client.get(self.detail_url + "?fields=headword,url", HTTP_IF_NONE_MATCH=full)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.detail_url + "?fields=url,headword&omit=nothing",
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_edit_changes_etag(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        self.sense.definition = "changed"
+        self.sense.save()
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_related_changes_change_etag(self):
+        etag = self.client.get(self.highlight_url)['ETag']
+        other = Sense.objects.create(owner=self.user, headword="other sense", part_of_speech="noun")
+        other.hypernyms.add(self.sense)
+        response = self.client.get(self.highlight_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        song_ = Song.objects.create(owner=self.user, title="song", album="album", release_date="2001-01-01")
+        example_ = Example.objects.create(owner=self.user, from_song=song_, text="test sense")
+        Annotation.objects.create(owner=self.user, example=example_, text="test sense", offset=0, sense=self.sense)
+        response = self.client.get(self.highlight_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_clear_changes_far_side_etag(self):
+        other = Sense.objects.create(owner=self.user, headword="other sense", part_of_speech="noun")
+        other.hypernyms.add(self.sense)
+        etag = self.client.get(self.highlight_url)['ETag']
+        other.hypernyms.clear()
+        response = self.client.get(self.highlight_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def annotate(self):
+        song_ = Song.objects.create(owner=self.user, title="song", album="album", release_date="2001-01-01")
+        example_ = Example.objects.create(owner=self.user, from_song=song_, text="test sense here")
+        return Annotation.objects.create(owner=self.user, example=example_, text="test sense", offset=0,
+                                         sense=self.sense)
+
+    def test_moved_annotation_changes_previous_etag(self):
+        annotation = self.annotate()
+        etag = self.client.get(self.highlight_url)['ETag']
+        annotation.sense = Sense.objects.create(owner=self.user, headword="other sense", part_of_speech="noun")
+        annotation.save()
+        response = self.client.get(self.highlight_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotContains(response, "test sense here")
+
+    def test_example_edit_changes_annotated_etags(self):
+        example_ = self.annotate().example
+        etag = self.client.get(self.highlight_url)['ETag']
+        example_.text = "test sense there"
+        example_.save()
+        response = self.client.get(self.highlight_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "</a> there")
+
+    def test_if_modified_since(self):
+        later = http_date((timezone.now() + timedelta(days=1)).timestamp())
+        response = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=later)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        earlier = http_date((timezone.now() - timedelta(days=1)).timestamp())
+        response = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=earlier)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_missing_object_is_not_found(self):
+        response = self.client.get(reverse('sense-detail', kwargs={'pk': 999}), HTTP_IF_NONE_MATCH='"x"')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
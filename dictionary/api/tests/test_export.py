@@ -0,0 +1,107 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from api.export import EXPORTS, export_records
+from api.models import Sense, Artist, Place, Song, Example, Annotation
+from api.tests.test_views import BaseApiTest
+
+
+class ExportTest(BaseApiTest):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.place = Place.objects.create(owner=self.user, name="Houston", full_name="Houston, Texas, USA",
+                                          slug="houston")
+        self.artist = Artist.objects.create(owner=self.user, name="UGK", slug="ugk", origin=self.place)
+        Artist.objects.create(owner=self.user, name="Nobody", slug="nobody")
+        self.sense = Sense.objects.create(owner=self.user, headword="candy", part_of_speech="noun",
+                                          definition="paint")
+
+    def create_examples(self, count):
+        for i in range(count):
+            song = Song.objects.create(owner=self.user, title="song %d" % i, album="album",
+                                       release_date="1996-01-01", release_date_string="1996-01-01")
+            song.primary_artists.add(self.artist)
+            example = Example.objects.create(owner=self.user, from_song=song, text="candy paint %d" % i)
+            example.primary_artists.add(self.artist)
+            first = Annotation.objects.create(owner=self.user, example=example, text="candy", offset=0,
+                                              sense=self.sense)
+            second = Annotation.objects.create(owner=self.user, example=example, text="paint", offset=6)
+            first.rhymes.add(second)
+            self.sense.mentioned_in.add(example)
+            self.place.mentioned_in.add(example)
+
+    def lines(self, name):
+        response = self.client.get(reverse('export', kwargs={'name': name}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b"".join(response.streaming_content).decode('utf-8').splitlines()]
+
+    def test_every_model_streams(self):
+        self.create_examples(2)
+        for name, (model, select, prefetch) in EXPORTS.items():
+            self.assertEqual(len(self.lines(name)), model.objects.count(), name)
+
+    def test_records(self):
+        self.create_examples(1)
+        songs = self.lines('songs')
+        self.assertEqual(songs[0]['primary_artists'], [{"name": "UGK", "slug": "ugk"}])
+        artists = dict((a['name'], a) for a in self.lines('artists'))
+        self.assertEqual(artists['UGK']['origin']['name'], "Houston")
+        self.assertIsNone(artists['Nobody']['origin'])
+        annotations = dict((a['text'], a) for a in self.lines('annotations'))
+        self.assertEqual(annotations['candy']['rhymes'][0]['text'], "paint")
+        self.assertIsNone(annotations['paint']['sense'])
+        self.assertEqual(self.lines('senses')[0]['mentioned_in'][0]['text'], "candy paint 0")
+
+    def test_song_xref(self):
+        self.create_examples(1)
+        xref = Song.objects.get().to_xref()
+        self.assertEqual(xref['primary_artists'], [{"name": "UGK", "slug": "ugk"}])
+
+    def count_queries(self, name):
+        with CaptureQueriesContext(connection) as queries:
+            records = list(export_records(name))
+        return len(records), len(queries)
+
+    def test_queries_per_chunk(self):
+        self.create_examples(2)
+        few = dict((name, self.count_queries(name)) for name in EXPORTS)
+        self.create_examples(6)
+        for name in EXPORTS:
+            self.assertEqual(self.count_queries(name)[1], few[name][1], name)
+
+    def test_chunks(self):
+        self.create_examples(5)
+        texts = [record['text'] for record in export_records('examples', chunk_size=2)]
+        self.assertEqual(sorted(texts), sorted(Example.objects.values_list('text', flat=True)))
+
+    def test_unknown_model(self):
+        response = self.client.get(reverse('export', kwargs={'name': 'users'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_requires_authentication(self):
+        response = APIClient().get(reverse('export', kwargs={'name': 'senses'}))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_command(self):
+        self.create_examples(3)
+        directory = tempfile.mkdtemp()
+        try:
+            out = io.StringIO()
+            call_command('export', directory, '--model', 'examples', '--model', 'songs', stdout=out)
+            self.assertEqual(sorted(os.listdir(directory)), ["examples.ndjson", "songs.ndjson"])
+            with open(os.path.join(directory, "examples.ndjson"), encoding='utf-8') as f:
+                self.assertEqual(len(f.readlines()), 3)
+            self.assertIn("Exported 3 songs", out.getvalue())
+        finally:
+            shutil.rmtree(directory)
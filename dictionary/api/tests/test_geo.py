@@ -0,0 +1,123 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.text import slugify
+from rest_framework import status
+
+from api.caching import payload_cache
+from api.geo import encode, box_filter, covering_cells, cell_ranges, cluster_precision, MAX_COVER_CELLS
+from api.models import Place, Artist
+from api.tests.test_views import BaseApiTest
+
+PLACES = (
+    ("Houston, Texas, USA", "29.760427", "-95.369803"),
+    ("Port Arthur, Texas, USA", "29.885500", "-93.939900"),
+    ("Dallas, Texas, USA", "32.776664", "-96.796988"),
+    ("Queens, New York, USA", "40.728224", "-73.794852"),
+    ("Brooklyn, New York, USA", "40.678178", "-73.944158"),
+    ("London, England", "51.507351", "-0.127758"),
+    ("Fiji", "-17.713371", "178.065033"),
+    ("Somewhere", None, None),
+)
+
+
+class GeohashTest(BaseApiTest):
+
+    def test_encode(self):
+        self.assertEqual(encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertEqual(encode(-25.382708, -49.265506, 5), "6gkzw")
+
+    def test_covering(self):
+        cells = covering_cells(29.0, -96.0, 30.5, -93.5)
+        self.assertLessEqual(len(cells), MAX_COVER_CELLS)
+        for latitude, longitude in ((29.760427, -95.369803), (29.8855, -93.9399)):
+            self.assertTrue(any(encode(latitude, longitude).startswith(cell) for cell in cells))
+        self.assertEqual(cell_ranges(["9v", "9y", "9z"]), [["9v", "9w"], ["9y", "b"]])
+
+    def test_cluster_precision(self):
+        self.assertEqual(cluster_precision(0), 1)
+        self.assertLess(cluster_precision(5), cluster_precision(12))
+
+
+class PlaceGeoTest(BaseApiTest):
+
+    def setUp(self):
+        super(PlaceGeoTest, self).setUp()
+        payload_cache().clear()
+        self.places = dict((name.split(", ")[0], Place.objects.create(
+            owner=self.user, name=name.split(", ")[0], full_name=name, slug=slugify(name),
+            latitude=latitude, longitude=longitude)) for name, latitude, longitude in PLACES)
+        for name, origin in (("UGK", "Port Arthur"), ("DJ Screw", "Houston"), ("Nas", "Queens"),
+                             ("Jay-Z", "Brooklyn"), ("Biggie", "Brooklyn")):
+            Artist.objects.create(owner=self.user, name=name, slug=slugify(name), origin=self.places[origin])
+
+    def names(self, url, **params):
+        response = self.client.get(reverse(url), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(item.get('full_name') or item.get('name') for item in response.data['results'])
+
+    def test_geohash_kept(self):
+        houston = self.places["Houston"]
+        self.assertEqual(houston.geohash, encode(houston.latitude, houston.longitude))
+        self.assertEqual(self.places["Somewhere"].geohash, "")
+        houston.latitude, houston.longitude = "51.507351", "-0.127758"
+        houston.save()
+        self.assertTrue(Place.objects.get(pk=houston.pk).geohash.startswith("gcpvj"))
+
+    def test_bbox(self):
+        self.assertEqual(self.names('place-list', bbox="-97,29,-93,30"),
+                         ["Houston, Texas, USA", "Port Arthur, Texas, USA"])
+        self.assertEqual(self.names('artist-list', bbox="-74,40.6,-73.7,40.8"), ["Biggie", "Jay-Z", "Nas"])
+        self.assertEqual(self.names('place-list', bbox="170,-20,-170,-10"), ["Fiji"])
+
+    def test_bad_bbox(self):
+        response = self.client.get(reverse('place-list'), {'bbox': "1,2,3"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('bbox', response.data)
+
+    def test_bbox_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(Place.objects.filter(box_filter(29, -97, 33, -93)))
+        self.assertEqual(len(queries), 1)
+
+    def test_nearest(self):
+        response = self.client.get(reverse('place-nearest'), {'lat': 29.7, 'lng': -95.4, 'k': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['full_name'] for item in response.data],
+                         ["Houston, Texas, USA", "Port Arthur, Texas, USA", "Dallas, Texas, USA"])
+        self.assertLess(response.data[0]['distance'], 10)
+        response = self.client.get(reverse('place-nearest'), {'lat': 0, 'lng': 0, 'k': 100})
+        self.assertEqual(len(response.data), 7)
+
+    def test_nearest_validation(self):
+        for params in ({'lat': 29.7}, {'lat': 95, 'lng': 0}, {'lat': 0, 'lng': 0, 'k': 0},
+                       {'lat': 'nan', 'lng': 0}, {'lat': 0, 'lng': 'inf'}, {'lat': 0, 'lng': '-Infinity'}):
+            response = self.client.get(reverse('place-nearest'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def features(self, **params):
+        response = self.client.get(reverse('place-clusters'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['type'], "FeatureCollection")
+        return response.data['features']
+
+    def test_clusters(self):
+        world = self.features(zoom=0)
+        self.assertEqual(sum(f['properties']['count'] for f in world if f['properties']['layer'] == 'places'), 7)
+        self.assertEqual(sum(f['properties']['count'] for f in world if f['properties']['layer'] == 'artists'), 5)
+        self.assertLess(len(world), 12)
+        close = self.features(zoom=12, layer='artists', bbox="-74,40.6,-73.7,40.8")
+        self.assertEqual(sorted(f['properties']['count'] for f in close), [1, 2])
+        nas = [f for f in close if f['properties']['count'] == 1][0]
+        self.assertEqual(nas['properties']['name'], "Nas")
+        self.assertAlmostEqual(nas['geometry']['coordinates'][0], -73.794852, places=5)
+
+    def test_clusters_cached(self):
+        self.client.get(reverse('place-clusters'), {'zoom': 3})
+        self.assertEqual(self.client.get(reverse('place-clusters'), {'zoom': 3})['X-Cache'], "HIT")
+        Place.objects.create(owner=self.user, name="Atlanta", full_name="Atlanta, Georgia, USA", slug="atlanta",
+                             latitude="33.748995", longitude="-84.387982")
+        response = self.client.get(reverse('place-clusters'), {'zoom': 3})
+        self.assertEqual(response['X-Cache'], "MISS")
+        self.assertEqual(sum(f['properties']['count'] for f in response.data['features']
+                             if f['properties']['layer'] == 'places'), 8)
@@ -0,0 +1,51 @@
+from unittest import mock
+from django.urls import reverse
+from rest_framework.reverse import reverse as drf_reverse
+
+from api.hyperlinks import build_url, build_path, url_template
+from api.models import Sense, SemanticClass
+from api.serializers import SenseSerializer, SemanticClassSerializer
+from api.tests.test_views import BaseApiTest
+from api.utils import make_uri
+
+
+class HyperlinksTest(BaseApiTest):
+
+    def setUp(self):
+        super(HyperlinksTest, self).setUp()
+        self.sense = Sense.objects.create(owner=self.user, headword="test sense", part_of_speech="noun")
+
+    def test_paths_match_reverse(self):
+        for view_name in ('sense-detail', 'semanticclass-detail', 'artist-highlight'):
+            self.assertEqual(build_path(view_name, 42), reverse(view_name, kwargs={'pk': 42}))
+        self.assertEqual(build_path('sense-highlight', 42, 'html'),
+                         reverse('sense-highlight', kwargs={'pk': 42, 'format': 'html'}))
+
+    def test_urls_match_drf_reverse(self):
+        request = self.factory.get('/')
+        self.assertEqual(build_url('song-detail', 7, request),
+                         drf_reverse('song-detail', kwargs={'pk': 7}, request=request))
+        request = self.factory.get('/', {'format': 'json'})
+        self.assertEqual(build_url('song-detail', 7, request),
+                         drf_reverse('song-detail', kwargs={'pk': 7}, request=request))
+
+    def test_other_routes_are_not_precompiled(self):
+        self.assertIsNone(url_template('sense-list'))
+        self.assertIsNone(url_template('user-highlight'))
+
+    def test_make_uri(self):
+        self.assertEqual(make_uri(self.host, 'senses', 3), "http://" + self.host + "/senses/3/")
+        self.assertEqual(make_uri(self.host, 'semantic-classes', 3), "http://" + self.host + "/semantic-classes/3/")
+
+    def test_serializers_do_not_reverse(self):
+        semantic_class = SemanticClass.objects.create(owner=self.user, name="class")
+        semantic_class.senses.add(self.sense)
+        request = self.factory.get('/')
+        expected = SemanticClassSerializer(semantic_class, context={'request': request}).data
+        with mock.patch('rest_framework.reverse.django_reverse', side_effect=AssertionError):
+            data = SemanticClassSerializer(semantic_class, context={'request': request}).data
+            SenseSerializer(self.sense, context={'request': request}).data
+        self.assertEqual(data, expected)
+        self.assertEqual(data['url'], "http://" + self.host + "/semantic-classes/%d/" % semantic_class.pk)
+        self.assertEqual(data['highlight'], "http://" + self.host + "/semantic-classes/%d/highlight/"
+                         % semantic_class.pk)
@@ -0,0 +1,102 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from api.tests.test_models import BaseTest
+from api.models import Sense, Place
+from api.management.commands.import_dump import iter_json_array, iter_ndjson
+
+
+class ImportDumpTest(BaseTest):
+
+    def setUp(self):
+        super(ImportDumpTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def senses(self, count):
+        return [{"type": "sense", "headword": "word %d" % i, "part_of_speech": "noun", "definition": "def %d" % i}
+                for i in range(count)]
+
+    def write(self, name, records, ndjson=True):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            if ndjson:
+                f.write("\n".join(json.dumps(record) for record in records) + "\n")
+            else:
+                json.dump(records, f, indent=2)
+        return path
+
+    def run_import(self, path, *args):
+        out = io.StringIO()
+        call_command('import_dump', path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_ndjson(self):
+        records = self.senses(5) + [{"type": "place", "full_name": "Houston, Texas, USA"}]
+        out = self.run_import(self.write("dump.ndjson", records), "--batch-size", "2")
+        self.assertEqual(Sense.objects.count(), 5)
+        self.assertEqual(Place.objects.get().full_name, "Houston, Texas, USA")
+        self.assertIn("rows/s", out)
+        self.assertIn("Imported 6 records", out)
+
+    def test_json_array(self):
+        path = self.write("dump.json", self.senses(3), ndjson=False)
+        self.run_import(path)
+        self.assertEqual(sorted(Sense.objects.values_list('headword', flat=True)), ["word 0", "word 1", "word 2"])
+
+    def test_what_for_untyped_records(self):
+        records = [{"full_name": "Queens, New York, USA"}]
+        self.run_import(self.write("places.ndjson", records), "--what", "place")
+        self.assertEqual(Place.objects.count(), 1)
+
+    def resume(self, name, ndjson):
+        records = self.senses(5)
+        records[3]["type"] = "unknown"
+        path = self.write(name, records, ndjson)
+        with self.assertRaises(CommandError):
+            self.run_import(path, "--batch-size", "2")
+        # the failed batch is rolled back; the first one stays committed
+        self.assertEqual(Sense.objects.count(), 2)
+        Sense.objects.all().delete()
+
+        records[3]["type"] = "sense"
+        self.write(name, records, ndjson)
+        out = self.run_import(path, "--batch-size", "2", "--resume")
+        self.assertIn("Resuming after 2 records", out)
+        self.assertEqual(sorted(Sense.objects.values_list('headword', flat=True)), ["word 2", "word 3", "word 4"])
+
+    def test_resume_ndjson(self):
+        self.resume("dump.ndjson", True)
+
+    def test_resume_json_array(self):
+        self.resume("dump.json", False)
+
+    def test_resume_needs_checkpoint(self):
+        with self.assertRaises(CommandError):
+            self.run_import(self.write("dump.ndjson", self.senses(1)), "--resume")
+
+    def test_json_array_across_chunks(self):
+        records = [{"text": "x" * 50, "n": i, "nested": {"list": [1, 2, {"a": "]"}]}} for i in range(20)]
+        stream = io.StringIO(json.dumps(records))
+        self.assertEqual(list(iter_json_array(stream, chunk_size=7)), records)
+
+    def test_json_array_must_hold_objects(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO("[1, 2]")))
+        self.assertEqual(list(iter_json_array(io.StringIO(" [ ] "))), [])
+
+    def test_ndjson_offsets_count_bytes(self):
+        data = '{"headword": "caf\u00e9"}\n\n{"headword": "na\u00efve"}\n'.encode('utf-8')
+        records = list(iter_ndjson(io.BytesIO(data)))
+        self.assertEqual([(count, record["headword"]) for count, offset, record in records],
+                         [(1, "caf\u00e9"), (2, "na\u00efve")])
+        self.assertEqual(records[-1][1], len(data))
+        offset = records[0][1]
+        self.assertEqual(list(iter_ndjson(io.BytesIO(data[offset:]), 1, offset)), records[1:])
@@ -70,6 +70,39 @@ class SenseModelTest(BaseTest):
             sense.full_clean()
 
 
+    def test_load_relations(self):
+        weapon = Sense.objects.create(owner=self.user, headword="weapon", part_of_speech="noun")
+        gat = Sense.objects.create(owner=self.user, headword="gat", part_of_speech="noun")
+        strap = Sense.objects.create(owner=self.user, headword="strap", part_of_speech="noun")
+        barrel = Sense.objects.create(owner=self.user, headword="barrel", part_of_speech="noun")
+        gat.hypernyms.add(weapon)
+        strap.hypernyms.add(weapon)
+        gat.synonyms.add(strap)
+        gat.meronyms.add(barrel)
+
+        senses = list(Sense.objects.filter(headword__in=["weapon", "gat"]).order_by('headword'))
+        gat_, weapon_ = senses
+        with self.assertNumQueries(1):
+            Sense.objects.load_relations(senses)
+        with self.assertNumQueries(0):
+            self.assertEqual(list(weapon_.hyponyms.all()), [gat, strap])
+            self.assertEqual(list(weapon_.hypernyms.all()), [])
+            self.assertEqual(list(gat_.hypernyms.all()), [weapon])
+            self.assertEqual(list(gat_.synonyms.all()), [strap])
+            self.assertEqual(list(gat_.meronyms.all()), [barrel])
+        with self.assertNumQueries(0):
+            Sense.objects.load_relations(senses)
+
+    def test_to_dict_uses_loaded_relations(self):
+        gat = Sense.objects.create(owner=self.user, headword="gat", part_of_speech="noun")
+        strap = Sense.objects.create(owner=self.user, headword="strap", part_of_speech="noun")
+        gat.antonyms.add(strap)
+        gat = Sense.objects.get(pk=gat.pk)
+        with self.assertNumQueries(2):
+            result = gat.to_dict()
+        self.assertEqual(result["antonyms"], [strap.to_xref()])
+
+
 class ArtistModelTest(BaseTest):
 
     data = {
@@ -0,0 +1,100 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.pagination import Cursor
+from rest_framework.request import Request
+
+from api.caching import payload_cache
+from api.models import Sense, Song
+from api.pagination import KeysetPagination
+from api.tests.test_views import BaseApiTest
+
+
+class KeysetPaginationTest(BaseApiTest):
+
+    list_url = reverse('sense-list')
+
+    def create_senses(self, count):
+        # repeated headwords so pages have to break ties on `created` and `id`
+        for i in range(count):
+            Sense.objects.create(owner=self.user, headword="sense %d" % (i % 3), part_of_speech="noun",
+                                 definition="definition %d" % i)
+
+    def walk(self, url, direction='next'):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([r['definition'] for r in response.data['results']])
+            url = response.data[direction]
+        return pages
+
+    def test_pages_cover_the_ordering_once(self):
+        self.create_senses(25)
+        pages = self.walk(self.list_url)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        expected = [s.definition for s in Sense.objects.order_by('headword', 'created', 'id')]
+        self.assertEqual([d for page in pages for d in page], expected)
+
+    def test_previous_links_walk_back(self):
+        self.create_senses(25)
+        forwards = self.walk(self.list_url)
+        last = self.client.get(self.list_url).data['next']
+        last = self.client.get(last).data['next']
+        backwards = self.walk(last, direction='previous')
+        self.assertEqual(backwards, list(reversed(forwards)))
+
+    def test_deep_pages_cost_the_same(self):
+        self.create_senses(40)
+        response = self.client.get(self.list_url)
+        payload_cache().clear()
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.list_url)
+        url = response.data['next']
+        for _ in range(2):
+            url = self.client.get(url).data['next']
+        payload_cache().clear()
+        with CaptureQueriesContext(connection) as deep:
+            self.client.get(url)
+        self.assertEqual(len(first), len(deep))
+
+    def test_ordering_appends_id(self):
+        paginator = KeysetPagination()
+        self.assertEqual(paginator.get_ordering(None, Sense.objects.all(), None), ('headword', 'created', 'id'))
+        self.assertEqual(paginator.get_ordering(None, Song.objects.all(), None), ('title', 'album', 'id'))
+
+    def test_explicit_ordering_is_keyed(self):
+        for i in range(7):
+            Song.objects.create(owner=self.user, title="song %d" % i, album="album",
+                                release_date="2001-01-0%d" % (i % 3 + 1))
+        queryset = Song.objects.order_by('-release_date')
+        paginator = KeysetPagination()
+        self.assertEqual(paginator.get_ordering(None, queryset, None), ('-release_date', 'id'))
+        self.assertIsNone(paginator.get_ordering(None, Song.objects.order_by('primary_artists__name'), None))
+        titles, url = [], '/songs/'
+        while url:
+            paginator = KeysetPagination()
+            paginator.page_size = 3
+            with CaptureQueriesContext(connection) as queries:
+                page = paginator.paginate_queryset(queryset, Request(self.factory.get(url)))
+            self.assertNotIn("OFFSET", queries[-1]['sql'])
+            titles += [song.title for song in page]
+            url = paginator.get_next_link()
+        self.assertEqual(titles, [song.title for song in queryset.order_by('-release_date', 'id')])
+
+    def test_tampered_cursors_are_not_found(self):
+        self.create_senses(3)
+        paginator = KeysetPagination()
+        paginator.base_url = "http://testserver" + self.list_url
+        for position in ('5', '["x", "y", "z"]', '[null, null, null]', '["sense 0"]', '{"a": 1}', 'not json'):
+            url = paginator.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+
+    def test_ranked_results_keep_their_order(self):
+        for i, lyrics in enumerate(["cat", "cat cat cat", "cat cat"]):
+            Song.objects.create(owner=self.user, title="song %d" % i, album="album", release_date="2001-01-01",
+                                release_date_string=str(i), lyrics=lyrics)
+        response = self.client.get(reverse('song-list'), {"lyrics": "cat"})
+        self.assertEqual([r['lyrics'] for r in response.data['results']], ["cat cat cat", "cat cat", "cat"])
@@ -0,0 +1,131 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from api.caching import payload_cache
+from api.models import Sense, Artist, Place, Song, Domain, SemanticClass, Annotation, Dictionary, Example
+from api.serializers import queryset_plan, field_plans, SenseSerializer, ArtistSerializer, ExampleSerializer
+from api.tests.test_views import BaseApiTest
+
+
+class QuerysetPlanTest(BaseApiTest):
+
+    list_urls = [reverse(name) for name in (
+        'sense-list', 'artist-list', 'place-list', 'song-list', 'dictionary-list', 'domain-list',
+        'semanticclass-list', 'example-list', 'annotation-list', 'user-list')]
+
+    def populate(self, i):
+        place = Place.objects.create(owner=self.user, full_name="place %d" % i, name="place %d" % i)
+        place.within.add(Place.objects.create(owner=self.user, full_name="region %d" % i, name="region %d" % i))
+        artist = Artist.objects.create(owner=self.user, name="artist %d" % i, origin=place)
+        song = Song.objects.create(owner=self.user, title="song %d" % i, album="album", release_date="2001-01-01",
+                                   release_date_string=str(i))
+        song.primary_artists.add(artist)
+        song.featured_artists.add(Artist.objects.create(owner=self.user, name="featured %d" % i))
+        example = Example.objects.create(owner=self.user, from_song=song, text="sense %d" % i)
+        example.primary_artists.add(artist)
+        sense = Sense.objects.create(owner=self.user, headword="sense %d" % i, part_of_speech="noun")
+        sense.synonyms.add(Sense.objects.create(owner=self.user, headword="synonym %d" % i, part_of_speech="noun"))
+        domain = Domain.objects.create(owner=self.user, name="domain %d" % i)
+        domain.senses.add(sense)
+        semantic_class = SemanticClass.objects.create(owner=self.user, name="class %d" % i)
+        semantic_class.senses.add(sense)
+        dictionary = Dictionary.objects.create(owner=self.user, name="dictionary %d" % i)
+        dictionary.senses.add(sense)
+        annotation = Annotation.objects.create(owner=self.user, example=example, text="sense", offset=0, sense=sense)
+        annotation.rhymes.add(Annotation.objects.create(owner=self.user, example=example, text="%d" % i,
+                                                        offset=6, artist=artist))
+
+    def count_queries(self, url):
+        payload_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        self.populate(0)
+        single = dict((url, self.count_queries(url)) for url in self.list_urls)
+        for i in range(1, 12):
+            self.populate(i)
+        full = dict((url, self.count_queries(url)) for url in self.list_urls)
+        self.assertEqual(single, full)
+
+    def test_plan_follows_declared_fields(self):
+        select, prefetch, only = queryset_plan(ArtistSerializer)
+        self.assertEqual(select, ('owner',))
+        self.assertEqual(prefetch, ('also_known_as', 'members', 'primary_songs', 'featured_songs', 'annotations'))
+        self.assertIsNone(only)
+        self.assertIn('annotations', queryset_plan(ExampleSerializer)[1])
+
+    def test_plan_leaves_out_relations_loaded_by_the_list_serializer(self):
+        self.assertEqual(queryset_plan(SenseSerializer)[1], ('domains', 'semantic_classes', 'annotations'))
+
+    def test_plans_are_cached_per_class_only(self):
+        queryset_plan(ArtistSerializer)
+        size = field_plans.cache_info().currsize
+        for name in ('name', 'slug', 'origin', 'members'):
+            queryset_plan(ArtistSerializer, frozenset([name]))
+        self.assertEqual(field_plans.cache_info().currsize, size)
+        self.assertEqual(queryset_plan(ArtistSerializer, frozenset(['members'])), ((), ('members',), ('created', 'id', 'name')))
+
+
+class SparseFieldsTest(BaseApiTest):
+
+    def setUp(self):
+        super(SparseFieldsTest, self).setUp()
+        self.song = Song.objects.create(owner=self.user, title="song", album="album", release_date="2001-01-01",
+                                        release_date_string="2001", lyrics="some lyrics")
+        self.sense = Sense.objects.create(owner=self.user, headword="test sense", part_of_speech="noun")
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, " ".join(q['sql'] for q in queries.captured_queries)
+
+    def test_fields_select_columns(self):
+        response, sql = self.get(reverse('song-list'), {"fields": "title,album"})
+        self.assertEqual(response.data['results'], [{"title": "song", "album": "album"}])
+        self.assertNotIn("lyrics", sql)
+        self.assertNotIn("api_example", sql)
+
+    def test_omit_drops_fields_and_prefetches(self):
+        response, sql = self.get(reverse('song-list'), {"omit": "lyrics,examples,owner"})
+        result = response.data['results'][0]
+        self.assertNotIn('lyrics', result)
+        self.assertNotIn('examples', result)
+        self.assertIn('primary_artists', result)
+        self.assertNotIn("lyrics", sql)
+        self.assertNotIn("api_example", sql)
+        self.assertNotIn("auth_user", sql)
+
+    def test_dotted_source_is_joined(self):
+        response, sql = self.get(reverse('song-list'), {"fields": "title,owner"})
+        self.assertEqual(response.data['results'], [{"title": "song", "owner": "test"}])
+        self.assertNotIn("lyrics", sql)
+
+    def test_unneeded_sense_relations_are_not_loaded(self):
+        response, sql = self.get(reverse('sense-list'), {"fields": "url,headword"})
+        self.assertEqual(list(response.data['results'][0]), ['url', 'headword'])
+        self.assertNotIn("UNION", sql)
+        response, sql = self.get(reverse('sense-list'), {"fields": "headword,synonyms"})
+        self.assertEqual(response.data['results'][0]['synonyms'], [])
+        self.assertIn("UNION", sql)
+
+    def test_retrieve_honours_fields(self):
+        url = reverse('song-detail', kwargs={'pk': self.song.pk})
+        self.assertEqual(self.client.get(url, {"fields": "title"}).data, {"title": "song"})
+        self.assertIn('lyrics', self.client.get(url).data)
+
+    def test_unknown_fields_are_ignored(self):
+        response, sql = self.get(reverse('song-list'), {"fields": "title,nonsense"})
+        self.assertEqual(response.data['results'], [{"title": "song"}])
+
+    def test_pages_follow_on(self):
+        for i in range(10):
+            Song.objects.create(owner=self.user, title="song %d" % i, album="album", release_date="2001-01-01",
+                                release_date_string="2001")
+        response = self.client.get(reverse('song-list'), {"fields": "title"})
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['results'], [{"title": "song 9"}])
@@ -0,0 +1,125 @@
+from api.tests.test_models import BaseTest
+from api.models import Annotation, Example, Song, Artist, Place, Sense
+from api.rendering import render_example, render_examples, build_link, rendered_example, AnnotationOffsetError
+
+
+class RenderingTest(BaseTest):
+
+    def setUp(self):
+        super(RenderingTest, self).setUp()
+        self.artist = Artist.objects.create(owner=self.user, name="Test artist")
+        self.place = Place.objects.create(owner=self.user, full_name="test city, test state, test country")
+        self.sense = Sense.objects.create(owner=self.user, headword="Test headword", part_of_speech="noun")
+        self.song = Song.objects.create(owner=self.user, title="Test song", album="Test album", release_date="2017-03-30")
+        self.example = Example.objects.create(owner=self.user, from_song=self.song, text="Cat in the hat")
+
+    def stored(self):
+        return Example.objects.get(pk=self.example.pk).rendered
+
+    def test_build_link(self):
+        cat = Annotation(text="Cat", offset=0, example=self.example, sense=self.sense)
+        self.assertEqual(build_link(cat), '<a href="/senses/1/">Cat</a>')
+        cat.sense = None
+        self.assertEqual(build_link(cat), '<span>Cat</span>')
+
+    def test_build_link_targets(self):
+        cat = Annotation(text="Cat", offset=0, example=self.example, artist=self.artist)
+        self.assertEqual(build_link(cat, "http://testserver"), '<a href="http://testserver/artists/1/">Cat</a>')
+        cat.artist = None
+        cat.place = self.place
+        self.assertEqual(build_link(cat, "http://testserver"), '<a href="http://testserver/places/1/">Cat</a>')
+
+    def test_render_stored_annotations(self):
+        Annotation.objects.create(owner=self.user, text="Cat", offset=0, example=self.example, sense=self.sense)
+        Annotation.objects.create(owner=self.user, text="the", offset=7, example=self.example, place=self.place)
+        Annotation.objects.create(owner=self.user, text="hat", offset=11, example=self.example)
+        self.assertEqual(render_example(self.example, self.example.annotations.all(), base="http://testserver"),
+                         '<a href="http://testserver/senses/1/">Cat</a> in <a href="http://testserver/places/1/">the</a> '
+                         '<span>hat</span>')
+
+    def test_render_example(self):
+        annotations = [
+            Annotation(text="hat", offset=11, example=self.example),
+            Annotation(text="Cat", offset=0, example=self.example, sense=self.sense),
+            Annotation(text="the", offset=7, example=self.example, place=self.place),
+        ]
+        self.assertEqual(render_example(self.example, annotations),
+                         '<a href="/senses/1/">Cat</a> in <a href="/places/1/">the</a> <span>hat</span>')
+
+    def test_render_example_with_base(self):
+        annotations = [Annotation(text="Cat", offset=0, example=self.example, sense=self.sense)]
+        self.assertEqual(render_example(self.example, annotations, base="http://testserver"),
+                         '<a href="http://testserver/senses/1/">Cat</a> in the hat')
+
+    def test_render_example_rejects_bad_offsets(self):
+        overlapping = [
+            Annotation(text="Cat in", offset=0, example=self.example),
+            Annotation(text="in the", offset=4, example=self.example),
+        ]
+        with self.assertRaises(AnnotationOffsetError):
+            render_example(self.example, overlapping)
+        with self.assertRaises(AnnotationOffsetError):
+            render_example(self.example, [Annotation(text="hat and", offset=11, example=self.example)])
+        with self.assertRaises(AnnotationOffsetError):
+            render_example(self.example, [Annotation(text="Cat", offset=-1, example=self.example)])
+
+    def test_render_example_collects_bad_offsets(self):
+        annotations = [
+            Annotation(text="Cat in", offset=0, example=self.example, sense=self.sense),
+            Annotation(text="in the", offset=4, example=self.example, place=self.place),
+            Annotation(text="hats", offset=11, example=self.example),
+        ]
+        errors = []
+        self.assertEqual(render_example(self.example, annotations, errors=errors),
+                         '<a href="/senses/1/">Cat in</a> the hat')
+        self.assertEqual(len(errors), 2)
+
+    def test_render_examples(self):
+        other = Example.objects.create(owner=self.user, from_song=self.song, text="Bat in the bag")
+        Annotation.objects.create(owner=self.user, text="Cat", offset=0, example=self.example, sense=self.sense)
+        Annotation.objects.create(owner=self.user, text="bag", offset=11, example=other, place=self.place)
+        examples = list(Example.objects.prefetch_related('annotations'))
+        with self.assertNumQueries(0):
+            rendered = render_examples(examples)
+        self.assertEqual(rendered, {
+            self.example.pk: '<a href="/senses/1/">Cat</a> in the hat',
+            other.pk: 'Bat in the <a href="/places/1/">bag</a>',
+        })
+
+    def test_bad_annotation_is_stored_unlinked(self):
+        Annotation.objects.create(owner=self.user, text="Cat", offset=0, example=self.example, sense=self.sense)
+        with self.assertLogs('api.rendering', level='WARNING'):
+            Annotation.objects.create(owner=self.user, text="Cat in", offset=0, example=self.example, artist=self.artist)
+        self.assertIn('<a href="/', self.stored())
+
+    def test_new_example_is_rendered(self):
+        self.assertEqual(self.stored(), "Cat in the hat")
+
+    def test_rendering_follows_annotations(self):
+        cat = Annotation.objects.create(owner=self.user, text="Cat", offset=0, example=self.example, sense=self.sense)
+        self.assertEqual(self.stored(), '<a href="/senses/1/">Cat</a> in the hat')
+        cat.sense = None
+        cat.artist = self.artist
+        cat.save()
+        self.assertEqual(self.stored(), '<a href="/artists/1/">Cat</a> in the hat')
+        cat.delete()
+        self.assertEqual(self.stored(), "Cat in the hat")
+
+    def test_rendering_follows_deleted_targets(self):
+        Annotation.objects.create(owner=self.user, text="Cat", offset=0, example=self.example, sense=self.sense)
+        self.sense.delete()
+        self.assertEqual(self.stored(), "Cat in the hat")
+
+    def test_rendering_follows_example_text(self):
+        Annotation.objects.create(owner=self.user, text="Cat", offset=0, example=self.example, sense=self.sense)
+        self.example.text = "Cat in the bag"
+        self.example.save()
+        self.assertEqual(self.stored(), '<a href="/senses/1/">Cat</a> in the bag')
+
+    def test_rendered_example_renders_missing_markup(self):
+        Annotation.objects.create(owner=self.user, text="Cat", offset=0, example=self.example, sense=self.sense)
+        Example.objects.filter(pk=self.example.pk).update(rendered=None)
+        example_ = Example.objects.prefetch_related('annotations').get(pk=self.example.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(rendered_example(example_), '<a href="/senses/1/">Cat</a> in the hat')
+        self.assertIsNone(self.stored())
@@ -0,0 +1,120 @@
+import io
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+
+from api.models import Song, Example, Annotation
+from api.rhymes import UnionFind, largest_families
+from api.tests.test_views import BaseApiTest
+from api.utils import make_uri
+
+
+class RhymeFamilyTest(BaseApiTest):
+
+    def setUp(self):
+        super(RhymeFamilyTest, self).setUp()
+        song = Song.objects.create(owner=self.user, title="song", album="album", release_date="2001-01-01")
+        self.example = Example.objects.create(owner=self.user, from_song=song,
+                                              text="cake bake make lake fame game name flame")
+        self.a = {}
+        for offset, word in enumerate(self.example.text.split()[:-1]):
+            self.a[word] = Annotation.objects.create(owner=self.user, example=self.example, text=word,
+                                                     offset=offset * 5)
+        self.a["cake"].rhymes.add(self.a["bake"])
+        self.a["make"].rhymes.add(self.a["lake"])
+        self.a["fame"].rhymes.add(self.a["game"])
+
+    def clusters(self):
+        return dict(Annotation.objects.values_list('text', 'rhyme_cluster'))
+
+    def family(self, word):
+        cluster = Annotation.objects.get(pk=self.a[word].pk).rhyme_cluster
+        return sorted(Annotation.objects.filter(rhyme_cluster=cluster).values_list('text', flat=True)) \
+            if cluster is not None else []
+
+    def test_union_find(self):
+        families = UnionFind()
+        for a, b in ((5, 3), (3, 9), (7, 8)):
+            families.union(a, b)
+        families.find(11)
+        self.assertEqual(families.labels(), {3: 3, 5: 3, 9: 3, 7: 7, 8: 7, 11: None})
+
+    def test_merge(self):
+        self.assertEqual(self.family("cake"), ["bake", "cake"])
+        self.assertEqual(self.family("name"), [])
+        self.a["lake"].rhymes.add(self.a["bake"])
+        self.assertEqual(self.family("make"), ["bake", "cake", "lake", "make"])
+        self.assertEqual(self.clusters()["make"], self.a["cake"].pk)
+
+    def test_split(self):
+        self.a["lake"].rhymes.add(self.a["bake"])
+        self.a["bake"].rhymes.remove(self.a["lake"])
+        self.assertEqual(self.family("cake"), ["bake", "cake"])
+        self.assertEqual(self.family("lake"), ["lake", "make"])
+        self.a["cake"].rhymes.clear()
+        self.assertEqual(self.family("bake"), [])
+        self.assertIsNone(self.clusters()["cake"])
+
+    def test_delete(self):
+        self.a["lake"].rhymes.add(self.a["bake"])
+        Annotation.objects.get(pk=self.a["cake"].pk).delete()
+        self.assertEqual(self.family("make"), ["bake", "lake", "make"])
+        self.assertEqual(self.clusters()["make"], self.a["bake"].pk)
+
+    def test_save_keeps_cluster(self):
+        cake = self.a["cake"]
+        cake.text = "cake"
+        cake.save()
+        self.assertEqual(self.family("bake"), ["bake", "cake"])
+
+    def test_save_of_deleted_row_inserts(self):
+        name = self.a["name"]
+        Annotation.objects.filter(pk=name.pk).delete()
+        name.save()
+        self.assertTrue(Annotation.objects.filter(pk=name.pk).exists())
+
+    def test_rebuild(self):
+        Annotation.objects.update(rhyme_cluster=None)
+        Annotation.objects.filter(pk=self.a["name"].pk).update(rhyme_cluster=12345)
+        out = io.StringIO()
+        call_command('cluster_rhymes', stdout=out)
+        self.assertIn("3 families", out.getvalue())
+        self.assertIsNone(self.clusters()["name"])
+        self.assertEqual(self.family("game"), ["fame", "game"])
+
+    def test_bulk_write(self):
+        uri = make_uri(self.host, 'annotations', self.a["fame"].pk)
+        response = self.client.post(reverse('annotation-bulk'), [
+            {"text": "flame", "offset": 35, "example": make_uri(self.host, 'examples', self.example.pk),
+             "rhymes": [uri, make_uri(self.host, 'annotations', self.a["name"].pk)]}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.family("name"), ["fame", "flame", "game", "name"])
+
+    def test_largest_families(self):
+        self.a["lake"].rhymes.add(self.a["bake"])
+        with CaptureQueriesContext(connection) as queries:
+            families = largest_families(5)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual([(size, [a.text for a in members]) for cluster, size, members in families],
+                         [(4, ["bake", "cake", "lake", "make"]), (2, ["fame", "game"])])
+
+    def test_endpoint(self):
+        url = reverse('annotation-rhyme-families')
+        response = self.client.get(url, {'limit': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['size'], 2)
+        self.assertEqual(response.data[0]['members'][0]['url'], make_uri(self.host, 'annotations', self.a["bake"].pk))
+        self.assertEqual(self.client.get(url, {'limit': 1})['X-Cache'], "HIT")
+        self.a["lake"].rhymes.add(self.a["bake"])
+        self.assertEqual(self.client.get(url, {'limit': 1}).data[0]['size'], 4)
+        self.assertEqual(self.client.get(url, {'limit': 0}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_moves_cached_families_on(self):
+        url = reverse('annotation-rhyme-families')
+        self.client.get(url)
+        Annotation.objects.filter(pk=self.a["make"].pk).update(rhyme_cluster=None)
+        call_command('cluster_rhymes', stdout=io.StringIO())
+        self.assertEqual(self.client.get(url)['X-Cache'], "MISS")
@@ -0,0 +1,86 @@
+from api.tests.test_models import BaseTest
+from api.models import Song, Sense, Artist, Place
+from api.search import search_lyrics, lyric_match_positions, lyric_tokens, fts5_query, \
+    trigrams, trigram_similarity, search_similar
+from api.filters import SongFilter, SenseFilter, ArtistFilter, PlaceFilter
+
+
+class LyricsSearchTest(BaseTest):
+
+    def create_a_song(self, title, lyrics):
+        song_ = Song(owner=self.user, title=title, album="Test album", release_date="2017-03-30",
+                     release_date_string=title, lyrics=lyrics)
+        song_.save()
+        return song_
+
+    def test_lyric_tokens(self):
+        self.assertEqual(lyric_tokens("Cat in the HAT!"), ["cat", "in", "the", "hat"])
+        self.assertEqual(lyric_tokens(None), [])
+
+    def test_fts5_query_quotes_tokens(self):
+        self.assertEqual(fts5_query('cat" OR hat*'), '"cat" "or" "hat"')
+
+    def test_search_lyrics(self):
+        once = self.create_a_song("once", "Cat in the hat\nbat in the bag")
+        twice = self.create_a_song("twice", "Cat in the hat\nThis song is about the cat in the hat")
+        self.create_a_song("never", "Something else entirely")
+        results = list(search_lyrics(Song.objects.all(), "cat hat"))
+        self.assertEqual(results, [twice, once])
+        self.assertGreater(results[0].lyrics_rank, results[1].lyrics_rank)
+
+    def test_search_lyrics_requires_every_word(self):
+        self.create_a_song("once", "Cat in the hat")
+        self.assertEqual(search_lyrics(Song.objects.all(), "cat bag").count(), 0)
+        self.assertEqual(search_lyrics(Song.objects.all(), "").count(), 0)
+
+    def test_index_follows_saves_and_deletes(self):
+        song_ = self.create_a_song("once", "Cat in the hat")
+        song_.lyrics = "Bat in the bag"
+        song_.save()
+        self.assertEqual(search_lyrics(Song.objects.all(), "cat").count(), 0)
+        self.assertEqual(search_lyrics(Song.objects.all(), "bat").count(), 1)
+        song_.delete()
+        self.create_a_song("twice", "Bat in the hat")
+        self.assertEqual(search_lyrics(Song.objects.all(), "bag").count(), 0)
+
+    def test_lyric_match_positions(self):
+        lyrics = "Cat in the hat\nThe cat's back"
+        self.assertEqual(lyric_match_positions(lyrics, "cat"), [(0, 3), (19, 22)])
+        self.assertEqual(lyric_match_positions(None, "cat"), [])
+
+    def test_song_filter_uses_index(self):
+        match = self.create_a_song("once", "Cat in the hat")
+        self.create_a_song("twice", "Concatenation")
+        self.assertEqual(list(SongFilter({"lyrics": "cat"}, queryset=Song.objects.all()).qs), [match])
+
+
+class TrigramSearchTest(BaseTest):
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams("Cat"), {"  c", " ca", "cat", "at "})
+        self.assertEqual(trigrams("a b"), {"  a", " a ", "  b", " b "})
+        self.assertEqual(trigrams(""), set())
+
+    def test_trigram_similarity(self):
+        self.assertEqual(trigram_similarity("benjamins", "Benjamins"), 1.0)
+        self.assertAlmostEqual(trigram_similarity("benjamens", "benjamins"), 7 / 13.0)
+        self.assertEqual(trigram_similarity("benjamins", ""), 0.0)
+
+    def test_search_similar(self):
+        benjamins = Sense.objects.create(owner=self.user, headword="benjamins", part_of_speech="noun")
+        benji = Sense.objects.create(owner=self.user, headword="benjis", part_of_speech="noun")
+        Sense.objects.create(owner=self.user, headword="cheddar", part_of_speech="noun")
+        results = list(search_similar(Sense.objects.all(), "headword", "benjamens"))
+        self.assertEqual(results, [benjamins, benji])
+        self.assertAlmostEqual(results[0].similarity, 7 / 13.0)
+        self.assertEqual(search_similar(Sense.objects.all(), "headword", "!!").count(), 0)
+
+    def test_fuzzy_filters(self):
+        sense_ = Sense.objects.create(owner=self.user, headword="benjamins", part_of_speech="noun")
+        artist_ = Artist.objects.create(owner=self.user, name="Ghostface Killah")
+        place_ = Place.objects.create(owner=self.user, name="Staten Island", full_name="Staten Island, New York, USA")
+        self.assertEqual(list(SenseFilter({"headword_fuzzy": "benjamens"}, queryset=Sense.objects.all()).qs), [sense_])
+        self.assertEqual(list(SenseFilter({"headword": "benjamens"}, queryset=Sense.objects.all()).qs), [])
+        self.assertEqual(list(ArtistFilter({"name_fuzzy": "ghostfase killa"}, queryset=Artist.objects.all()).qs), [artist_])
+        self.assertEqual(list(PlaceFilter({"full_name_fuzzy": "staten iland new york"}, queryset=Place.objects.all()).qs),
+                         [place_])
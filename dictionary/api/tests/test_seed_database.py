@@ -1,10 +1,15 @@
 import copy
 import responses
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TransactionTestCase
 
 from api.tests.test_models import BaseTest
 from api.models import Sense, Artist, Song, Example, Place
 from api.management.commands.seed_database import extract_dict, persist, get_random_thing, random_pipeline, \
-    inject_owner, remove_image, process_origin, extract_and_process_artists
+    inject_owner, remove_image, process_origin, extract_and_process_artists, seed_pipeline, \
+    persist_records, IdentityMap
 
 
 null = None
@@ -43,6 +48,55 @@ class SeedDatabaseTest(BaseTest):
         r = random_pipeline(self.user, "blah")
         self.assertTrue(r is None)
 
+    @responses.activate
+    def test_get_random_thing_retries(self):
+        url = "http://localhost:8001/data/senses/random"
+        statuses = [503, 503, 200]
+        responses.add_callback(responses.GET, url, content_type='application/json',
+                               callback=lambda request: (statuses.pop(0), {}, '{"definition": "test definition"}'))
+        r = get_random_thing(base_url="http://localhost:8001/data/", retries=2, backoff=0)
+        self.assertEqual(r["definition"], "test definition")
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_get_random_thing_gives_up(self):
+        url = "http://localhost:8001/data/senses/random"
+        responses.add(responses.GET, url, body='{}', status=500, content_type='application/json')
+        r = get_random_thing(base_url="http://localhost:8001/data", retries=1, backoff=0)
+        self.assertIsNone(r)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_get_random_thing_does_not_retry_client_errors(self):
+        url = "http://localhost:8001/data/senses/random"
+        responses.add(responses.GET, url, body='{}', status=404, content_type='application/json')
+        with self.assertLogs('api.management.commands.seed_database', 'ERROR'):
+            r = get_random_thing(base_url="http://localhost:8001/data", retries=2, backoff=0)
+        self.assertIsNone(r)
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_get_random_thing_bad_json(self):
+        url = "http://localhost:8001/data/senses/random"
+        responses.add(responses.GET, url, body='<html>', status=200, content_type='text/html')
+        with self.assertLogs('api.management.commands.seed_database', 'ERROR'):
+            r = get_random_thing(base_url="http://localhost:8001/data", retries=2, backoff=0)
+        self.assertIsNone(r)
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_seed_pipeline(self):
+        counter = iter(range(100))
+        responses.add_callback(responses.GET, "http://localhost:8001/data/senses/random",
+                               content_type='application/json',
+                               callback=lambda request: (200, {}, '{"headword": "headword %d", "definition": "d", '
+                                                                  '"part_of_speech": "noun"}' % next(counter)))
+        persisted = seed_pipeline(self.user, "sense", count=7, concurrency=3, batch_size=3,
+                                  base_url="http://localhost:8001/data")
+        self.assertEqual(len(persisted), 7)
+        self.assertEqual(len(responses.calls), 7)
+        self.assertEqual(Sense.objects.filter(headword__startswith="headword").count(), 7)
+
     def test_inject_owner(self):
         data = {
             "a": "a",
@@ -254,6 +308,44 @@ class SeedDatabaseSongTest(BaseTest):
         extracted = extract_dict(self.result, self.user, "song")
         persisted = persist("song", extracted)
         self.assertIsInstance(persisted, Song)
+        self.assertEqual([a.name for a in persisted.primary_artists.all()], ["PMD"])
+        self.assertEqual([a.name for a in persisted.featured_artists.all()], ["Zone 7"])
+
+    def test_extract_and_process_featured_artists(self):
+        extracted = extract_dict(self.result, self.user, "song")
+        featured_artists, primary_artists, data_dict = extract_and_process_artists(extracted)
+        self.assertEqual([a.name for a in primary_artists], ["PMD"])
+        self.assertEqual([a.name for a in featured_artists], ["Zone 7"])
+
+    def test_persist_records_shares_artists(self):
+        records = []
+        for i in range(5):
+            extracted = extract_dict(dict(self.result, title="Song %d" % i), self.user, "song")
+            records.append(("song", extracted))
+        identity = IdentityMap()
+        songs = persist_records(records, identity)
+        self.assertEqual(len(set(song.pk for song in songs)), 5)
+        self.assertEqual(Artist.objects.count(), 2)
+        self.assertEqual(Place.objects.count(), 1)
+        self.assertEqual(Song.objects.filter(primary_artists__slug="pmd").count(), 5)
+
+        # everything is known now: a savepoint and one read per through table
+        with self.assertNumQueries(4):
+            again = persist_records(records, identity)
+        self.assertEqual(again, songs)
+        self.assertEqual(Song.objects.get(pk=songs[0].pk).featured_artists.count(), 1)
+
+    def test_persist_records_skips_bad_records(self):
+        records = [("song", extract_dict(dict(self.result, title="Song %d" % i), self.user, "song")) for i in range(3)]
+        records[1][1]["release_date"] = "not a date"
+        records.append(("example", extract_dict({"title": "no text"}, self.user, "example")))
+        with self.assertLogs('api.management.commands.seed_database', 'ERROR') as logs:
+            persisted = persist_records(records)
+        self.assertEqual(len(logs.records), 2)
+        self.assertIsNone(persisted[1])
+        self.assertIsNone(persisted[3])
+        self.assertEqual(sorted(Song.objects.values_list('title', flat=True)), ["Song 0", "Song 2"])
+        self.assertEqual([a.name for a in persisted[2].primary_artists.all()], ["PMD"])
 
 
 class SeedDatabaseExampleTest(BaseTest):
@@ -317,3 +409,14 @@ class SeedDatabaseExampleTest(BaseTest):
         self.assertEqual(Song.objects.count(), 1)
         self.assertIsInstance(persisted.from_song, Song)
 
+
+class SeedDatabaseCommitTest(TransactionTestCase):
+
+    def test_caches_are_invalidated_after_commit(self):
+        user = User.objects.create(username="test", email="ad@min.com", password="admin", is_superuser=True)
+        extracted = extract_dict({"headword": "headword", "part_of_speech": "noun", "definition": "d"}, user)
+        with mock.patch('api.bulk.invalidate') as invalidate:
+            with transaction.atomic():
+                sense = persist("sense", extracted)
+                self.assertFalse(invalidate.called)
+        self.assertIn("tag:api.sense:%d" % sense.pk, invalidate.call_args[0][0])
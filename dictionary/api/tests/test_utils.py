@@ -2,8 +2,7 @@ from api.tests.test_models import BaseTest
 from api.serializers import AnnotationSerializer, ExampleSerializer
 from api.utils import clean_up_date, slugify, extract_rhymes, \
     build_example_serializer, build_annotation_serializer, \
-    serialize_examples, clean_text, render_example_with_annotations, \
-    build_annotation_link, build_songs_from_queryset, build_examples_from_queryset, \
+    serialize_examples, clean_text, build_songs_from_queryset, build_examples_from_queryset, \
     build_examples_from_annotations
 from api.models import Annotation, Example, Song, Artist, Place, Sense
 
@@ -70,6 +69,27 @@ class UtilTest(BaseTest):
         self.assertIsInstance(rhymes[0]["right"], Annotation)
         self.assertIsInstance(rhymes[0]["left"], Annotation)
 
+    def test_extract_rhymes_batches_and_deduplicates(self):
+        artist_ = self.create_an_artist()
+        song_ = self.create_a_song(artist_)
+        example_ = self.create_an_example(song_, artist_)
+        other = Example(owner=self.user, from_song=song_, text="Bat in the bag")
+        other.save()
+        cat = Annotation.objects.create(owner=self.user, text="Cat", offset=0, example=example_)
+        hat = Annotation.objects.create(owner=self.user, text="hat", offset=11, example=example_)
+        bat = Annotation.objects.create(owner=self.user, text="Bat", offset=0, example=other)
+        cat.rhymes.add(hat, bat)
+        hat.rhymes.add(bat)
+
+        with self.assertNumQueries(1):
+            rhymes = extract_rhymes(Annotation.objects.filter(example=example_))
+            pairs = [(r['left'].text, r['right'].text) for r in rhymes]
+        self.assertEqual(pairs, [("hat", "Cat"), ("Bat", "Cat"), ("Bat", "hat")])
+
+        with self.assertNumQueries(1):
+            rhymes = extract_rhymes([bat])
+        self.assertEqual([(r['left'], r['right']) for r in rhymes], [(cat, bat), (hat, bat)])
+
     def create_an_example(self, song_, artist_):
         example_ = Example(owner=self.user, from_song=song_, **self.example_data)
         example_.save()
@@ -126,45 +146,6 @@ class UtilTest(BaseTest):
         cleaned = clean_text(bad_apostrophe)
         self.assertEqual(cleaned, okay_apostrophe)
 
-    def test_build_annotation_link(self):
-        artist_ = self.create_an_artist()
-        place_ = self.create_a_place()
-        sense_ = self.create_a_sense()
-        song_ = self.create_a_song(artist_)
-        example_ = self.create_an_example(song_, artist_)
-        cat = Annotation(text="Cat", offset=example_.text.index("Cat"), example=example_, sense=sense_, owner=self.user)
-        link = build_annotation_link(self.host, cat)
-        self.assertEqual(link, '<a href="http://testserver/senses/1/">Cat</a>')
-        cat.sense = None
-        cat.artist = artist_
-        cat.save()
-        link = build_annotation_link(self.host, cat)
-        self.assertEqual(link, '<a href="http://testserver/artists/1/">Cat</a>')
-        cat.artist = None
-        cat.place = place_
-        cat.save()
-        link = build_annotation_link(self.host, cat)
-        self.assertEqual(link, '<a href="http://testserver/places/1/">Cat</a>')
-        cat.place = None
-        link = build_annotation_link(self.host, cat)
-        self.assertEqual(link, '<span>Cat</span>')
-
-    def test_render_example_with_annotations(self):
-        artist_ = self.create_an_artist()
-        place_ = self.create_a_place()
-        sense_ = self.create_a_sense()
-        song_ = self.create_a_song(artist_)
-        example_ = self.create_an_example(song_, artist_)
-        cat = Annotation(text="Cat", offset=example_.text.index("Cat"), example=example_, sense=sense_, owner=self.user)
-        cat.save()
-        the = Annotation(text="the", offset=example_.text.index("the"), example=example_, place=place_, owner=self.user)
-        the.save()
-        hat = Annotation(text="hat", offset=example_.text.index("hat"), example=example_, owner=self.user)
-        hat.save()
-        rendered = '<a href="http://testserver/senses/1/">Cat</a> in <a href="http://testserver/places/1/">the</a> <span>hat</span>'
-        result = render_example_with_annotations(self.request, example_)
-        self.assertEqual(result, rendered)
-
     def test_build_songs_from_queryset(self):
         artist_ = self.create_an_artist()
         song_ = self.create_a_song(artist_)
@@ -204,3 +185,20 @@ class UtilTest(BaseTest):
         cat.save()
         results = build_examples_from_annotations(Annotation.objects.all(), self.request)
         self.assertEqual(len(results), 1)
+
+    def test_build_examples_from_annotations_uses_prefetch_plan(self):
+        artist_ = self.create_an_artist()
+        sense_ = self.create_a_sense()
+        song_ = self.create_a_song(artist_)
+        example_ = self.create_an_example(song_, artist_)
+        Annotation(text="Cat", offset=0, example=example_, sense=sense_, owner=self.user).save()
+        Annotation(text="hat", offset=11, example=example_, artist=artist_, owner=self.user).save()
+        annotations = list(Annotation.objects.all())
+        with self.assertNumQueries(5):
+            results = build_examples_from_annotations(annotations, self.request)
+        with self.assertNumQueries(0):
+            for result in results:
+                list(result['annotations'])
+                list(result['primary_artists'])
+                list(result['featured_artists'])
+        self.assertEqual(results[0]['rendered'], '<a href="/senses/1/">Cat</a> in the <a href="/artists/1/">hat</a>')
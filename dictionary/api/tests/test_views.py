@@ -6,9 +6,12 @@ from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 
 from api.models import Sense, Artist, Place, Song, Domain, SemanticClass, Annotation, Dictionary, Example
 from api.forms import ArtistForm, PlaceForm
+from api.caching import payload_cache
 from api.utils import make_uri
 
 ###
@@ -19,6 +22,7 @@ from api.utils import make_uri
 class BaseApiTest(APITestCase):
 
     def setUp(self):
+        payload_cache().clear()
         self.user = User.objects.create(username="test", email="ad@min.com", password="admin", is_superuser=True)
         self.client = APIClient()
         self.client.force_authenticate(user=self.user)
@@ -69,20 +73,48 @@ class SenseApiTest(BaseApiTest):
         self.create_a_sense()
         response = self.client.get(self.list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def create_a_sense(self):
         self.client.post(self.list_url, self.data, format='json')
 
+    def test_GET_list_senses_with_relations(self):
+        self.create_a_sense()
+        weapon = Sense.objects.get()
+        gat = Sense.objects.create(owner=self.user, headword="gat", part_of_speech="noun")
+        gat.hypernyms.add(weapon)
+        response = self.client.get(self.list_url)
+        results = dict((r['headword'], r) for r in response.data['results'])
+        self.assertEqual(results['gat']['hypernyms'], [make_uri(self.host, 'senses', weapon.id)])
+        self.assertEqual(results['test sense']['hyponyms'], [make_uri(self.host, 'senses', gat.id)])
+        self.assertEqual(results['test sense']['hypernyms'], [])
+
     def test_GET_search_all_senses(self):
         self.create_a_sense()
         response = self.client.get(self.search_url, {"q": "test"})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['senses'].count(), 1)
-        sense_ = response.data['senses'].first()
+        self.assertEqual(len(response.data['senses']), 1)
+        sense_ = response.data['senses'][0]
         self.assertEqual(sense_.headword, self.data['headword'])
         self.assertEqual(sense_.part_of_speech, self.data['part_of_speech'])
 
+    def test_GET_search_senses_is_paginated(self):
+        for i in range(12):
+            Sense.objects.create(owner=self.user, headword="sense %02d" % i, part_of_speech="noun")
+        response = self.client.get(self.search_url, {"page_size": 5})
+        self.assertEqual([s.headword for s in response.data['senses']], ["sense %02d" % i for i in range(5)])
+        self.assertIsNone(response.data['previous'])
+        self.assertContains(response, "Next page")
+        response = self.client.get(response.data['next'])
+        self.assertEqual([s.headword for s in response.data['senses']], ["sense %02d" % i for i in range(5, 10)])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_GET_search_senses_caps_page_size(self):
+        for i in range(55):
+            Sense.objects.create(owner=self.user, headword="sense %02d" % i, part_of_speech="noun")
+        response = self.client.get(self.search_url, {"page_size": 1000})
+        self.assertEqual(len(response.data['senses']), 50)
+
     def test_GET_a_sense(self):
         self.create_a_sense()
         response = self.client.get(self.detail_url)
@@ -93,6 +125,34 @@ class SenseApiTest(BaseApiTest):
         response = self.client.get(self.highlight_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def cite_sense(self, sense_, count):
+        start = Example.objects.count()
+        for i in range(start, start + count):
+            artist_ = Artist.objects.create(owner=self.user, name="artist %d" % i, slug="artist-%d" % i)
+            feat_ = Artist.objects.create(owner=self.user, name="feat %d" % i, slug="feat-%d" % i)
+            place_ = Place.objects.create(owner=self.user, name="place %d" % i, full_name="place %d" % i)
+            song_ = Song.objects.create(owner=self.user, title="song %d" % i, album="album", release_date=date(2001, 1, 1),
+                                        release_date_string="2001")
+            song_.primary_artists.add(artist_)
+            song_.featured_artists.add(feat_)
+            example_ = Example.objects.create(owner=self.user, from_song=song_, text="test sense in place %d" % i)
+            cited = Annotation.objects.create(owner=self.user, example=example_, text="test sense", offset=0, sense=sense_)
+            mention = Annotation.objects.create(owner=self.user, example=example_, text="place", offset=14, place=place_)
+            cited.rhymes.add(mention)
+
+    def test_GET_a_sense_highlight_query_count_is_constant(self):
+        self.create_a_sense()
+        sense_ = Sense.objects.get()
+        self.cite_sense(sense_, 1)
+        with CaptureQueriesContext(connection) as one_citation:
+            self.client.get(self.highlight_url)
+        self.cite_sense(sense_, 10)
+        with CaptureQueriesContext(connection) as many_citations:
+            response = self.client.get(self.highlight_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['examples']), 11)
+        self.assertEqual(len(one_citation), len(many_citations))
+
 
 class ArtistApiTest(BaseApiTest):
 
@@ -116,7 +176,7 @@ class ArtistApiTest(BaseApiTest):
         self.create_an_artist()
         response = self.client.get(self.list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def create_an_artist(self):
         self.client.post(self.list_url, self.data, format='json')
@@ -125,8 +185,8 @@ class ArtistApiTest(BaseApiTest):
         self.create_an_artist()
         response = self.client.get(self.search_url, {"q": "test"})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['artists'].count(), 1)
-        artist_ = response.data['artists'].first()
+        self.assertEqual(len(response.data['artists']), 1)
+        artist_ = response.data['artists'][0]
         self.assertEqual(artist_.name, self.data['name'])
 
     def test_GET_search_all_artists_uses_artist_form(self):
@@ -168,7 +228,7 @@ class PlaceApiTest(BaseApiTest):
         self.create_a_place()
         response = self.client.get(self.list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def create_a_place(self):
         self.client.post(self.list_url, self.data, format='json')
@@ -177,8 +237,8 @@ class PlaceApiTest(BaseApiTest):
         self.create_a_place()
         response = self.client.get(self.search_url, {"q": "test"})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['places'].count(), 1)
-        place_ = response.data['places'].first()
+        self.assertEqual(len(response.data['places']), 1)
+        place_ = response.data['places'][0]
         self.assertEqual(place_.full_name, self.data['full_name'])
 
     def test_GET_a_place(self):
@@ -235,7 +295,7 @@ class SongApiTest(BaseApiTest):
 
         response = self.client.get(self.list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def create_a_song(self):
         response = self.client.post(self.artist_list_url, self.artist_data, format='json')
@@ -256,6 +316,15 @@ class SongApiTest(BaseApiTest):
         song_ = response.data['song_titles'][0]
         self.assertEqual(song_["title"], self.song_data['title'])
 
+    def test_GET_search_songs_pages_titles_and_lyrics_separately(self):
+        self.create_a_song()
+        response = self.client.get(self.search_url, {"q": "lyrics"})
+        self.assertEqual(len(response.data['song_titles']), 0)
+        self.assertEqual(len(response.data['song_lyrics']), 1)
+        self.assertEqual(response.data['song_lyrics'][0]['lyrics_matches'], [(5, 11)])
+        self.assertIsNone(response.data['next'])
+        self.assertIsNone(response.data['lyrics_next'])
+
     def test_GET_a_song(self):
         self.create_a_song()
         response = self.client.get(self.detail_url)
@@ -323,7 +392,7 @@ class ExampleApiTest(BaseApiTest):
 
         response = self.client.get(self.list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 1)
         example_ = response.data['results'][0]
         self.assertEqual(example_['text'], self.example_data['text'])
         test_example = Example.objects.get()
@@ -407,7 +476,7 @@ class DomainApiTest(BaseApiTest):
         self.create_a_domain()
         response = self.client.get(self.list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def create_a_domain(self):
         self.client.post(self.list_url, self.data, format='json')
@@ -416,8 +485,8 @@ class DomainApiTest(BaseApiTest):
         self.create_a_domain()
         response = self.client.get(self.search_url, {"q": "test"})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['domains'].count(), 1)
-        domain_ = response.data['domains'].first()
+        self.assertEqual(len(response.data['domains']), 1)
+        domain_ = response.data['domains'][0]
         self.assertEqual(domain_.name, self.data['name'])
 
     def test_GET_a_domain(self):
@@ -452,7 +521,7 @@ class SemanticClassApiTest(BaseApiTest):
         self.create_a_semantic_class()
         response = self.client.get(self.list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def create_a_semantic_class(self):
         self.client.post(self.list_url, self.data, format='json')
@@ -461,8 +530,8 @@ class SemanticClassApiTest(BaseApiTest):
         self.create_a_semantic_class()
         response = self.client.get(self.search_url, {"q": "test"})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['semantic_classes'].count(), 1)
-        semantic_class_ = response.data['semantic_classes'].first()
+        self.assertEqual(len(response.data['semantic_classes']), 1)
+        semantic_class_ = response.data['semantic_classes'][0]
         self.assertEqual(semantic_class_.name, self.data['name'])
 
     def test_GET_a_semantic_class(self):
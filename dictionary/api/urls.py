@@ -20,5 +20,7 @@ router.register(r'users', views.UserViewSet)
 urlpatterns = [
 
     url(r'^', include(router.urls)),
+    url(r'^cache-stats/$', views.ResultCacheStatsView.as_view(), name='cache-stats'),
+    url(r'^export/(?P<name>[a-z-]+)/$', views.ExportView.as_view(), name='export'),
 
 ]
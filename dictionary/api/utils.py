@@ -1,25 +1,39 @@
 import re
+from django.db.models import Prefetch, QuerySet, prefetch_related_objects
+from api.hyperlinks import build_path, detail_view_name
+from api.rendering import rendered_example
+from api.search import lyric_match_positions
 from api.serializers import AnnotationSerializer, ExampleSerializer
-from api.models import Sense, Place, Artist
+from api.models import Annotation
 
 
 def extract_rhymes(annotations):
-    rhyme_set = set()
-    for a in annotations:
-        for r in a.rhymes.all():
-            rhyme_set.add((r, a))
-    rhymes = []
-    for rhyme in rhyme_set:
-        rhymes.append({
-            'left': rhyme[0],
-            'right': rhyme[1]
-        })
-    return rhymes
+    """
+    Rhyme pairs touching `annotations` (a queryset or a list), read with one
+    query against the rhymes through table. Each unordered pair appears once,
+    ordered by annotation ids; `left` is the rhyming partner where only one
+    side of the pair is in `annotations`.
+    """
+    if isinstance(annotations, QuerySet):
+        ids = annotations.values('id')
+    else:
+        ids = [a.pk for a in annotations]
+    through = Annotation.rhymes.through
+    links = through.objects.filter(from_annotation__in=ids).select_related('from_annotation', 'to_annotation') \
+        .order_by('from_annotation_id', 'to_annotation_id')
+    pairs = {}
+    for link in links:
+        key = tuple(sorted((link.from_annotation_id, link.to_annotation_id)))
+        if key not in pairs:
+            pairs[key] = {
+                'left': link.to_annotation,
+                'right': link.from_annotation
+            }
+    return [pairs[key] for key in sorted(pairs)]
 
 
 def make_uri(host, object_type, pk):
-    uri = "http://" + host + "/" + object_type + "/" + str(pk) + "/"
-    return uri
+    return "http://" + host + build_path(detail_view_name(object_type), pk)
 
 
 def build_annotation_serializer(request, example, text="", offset=None):
@@ -101,58 +115,70 @@ def clean_text(text):
     return t1
 
 
-def render_example_with_annotations(request, example):
-    host = request.get_host()
-    buffer = 0
-    rendered = example.text
-    for annotation in example.annotations.order_by('offset'):
-        link = build_annotation_link(host, annotation)
-        start = buffer + annotation.offset
-        end = start + len(annotation.text)
-        rendered = rendered[:start] + link + rendered[end:]
-        buffer += len(link) - len(annotation.text)
-    return rendered
-
-
-def build_annotation_link(host, annotation):
-    link = '<a href="{}">{}</a>'
-    uri = "#"
-    target = annotation.get_link()
-    if target:
-        if isinstance(target, Sense):
-            uri = make_uri(host, "senses", target.id)
-        if isinstance(target, Artist):
-            uri = make_uri(host, "artists", target.id)
-        if isinstance(target, Place):
-            uri = make_uri(host, "places", target.id)
-        return link.format(uri, annotation.text)
-    return "<span>{}</span>".format(annotation.text)
-
-
-def build_examples_from_annotations(annotations, request):
+def rendering_annotations():
+    return Annotation.objects.select_related('sense', 'artist', 'place').order_by('offset')
+
+
+def example_prefetch_plan(prefix=""):
+    """
+    Lookups that let `build_examples_from_queryset` run without further queries.
+    `prefix` is the path from the queryset's model to Example, e.g. "example__".
+    """
+    return [
+        prefix + "from_song",
+        prefix + "primary_artists",
+        prefix + "featured_artists",
+        Prefetch(prefix + "annotations", queryset=rendering_annotations()),
+    ]
+
+
+def annotation_prefetch_plan():
+    """
+    Lookups that let `build_examples_from_annotations` run without further queries.
+    """
+    return [
+        "example__from_song__primary_artists",
+        "example__from_song__featured_artists",
+        Prefetch("example__annotations", queryset=rendering_annotations()),
+    ]
+
+
+def apply_prefetch_plan(objects, plan):
+    if isinstance(objects, QuerySet):
+        return objects.prefetch_related(*plan)
+    objects = list(objects)
+    prefetch_related_objects(objects, *plan)
+    return objects
+
+
+def build_examples_from_annotations(annotations, request, prefetch=None):
+    if prefetch is None:
+        prefetch = annotation_prefetch_plan()
     return [
         {
             "id": a.example.id,
             "text": a.example.text,
-            "rendered": render_example_with_annotations(request, a.example),
+            "rendered": rendered_example(a.example),
             "song": a.example.from_song,
             'annotations': a.example.annotations.all(),
             "primary_artists": a.example.from_song.primary_artists.all(),
-            "featured_artists": a.example.from_song.featured_artists.first(),
-        } for a in annotations]
+            "featured_artists": a.example.from_song.featured_artists.all(),
+        } for a in apply_prefetch_plan(annotations, prefetch)]
 
 
-def build_examples_from_queryset(queryset, request):
+def build_examples_from_queryset(queryset, request, prefetch=None):
+    if prefetch is None:
+        prefetch = example_prefetch_plan()
     return [
         {
             'id': example.id,
             'text': example.text,
-            "rendered": render_example_with_annotations(request, example),
+            "rendered": rendered_example(example),
             'song': example.from_song,
             'annotations': example.annotations.all(),
             'primary_artists': example.primary_artists.all(),
             'featured_artists': example.featured_artists.all(),
-        } for example in queryset]
+        } for example in apply_prefetch_plan(queryset, prefetch)]
 
 
 def build_songs_from_queryset(queryset, request, example_filter):
@@ -164,5 +190,7 @@ def build_songs_from_queryset(queryset, request, example_filter):
             "album": song.album,
             "primary_artists": song.primary_artists.all(),
             "featured_artists": song.featured_artists.all(),
+            "lyrics_rank": getattr(song, "lyrics_rank", None),
+            "lyrics_matches": lyric_match_positions(song.lyrics, example_filter) if example_filter else [],
             "examples": build_examples_from_queryset(song.examples.filter(text__icontains=example_filter), request) if example_filter is not None else []
-        } for song in queryset]
+        } for song in apply_prefetch_plan(queryset, ["primary_artists", "featured_artists"])]
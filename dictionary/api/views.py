@@ -1,12 +1,27 @@
+import math
 from django.contrib.auth.models import User
+from django.http import Http404, StreamingHttpResponse
 from rest_framework import permissions, renderers, viewsets, filters
 from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-
+from rest_framework.views import APIView
+
+from api.bulk import BulkWriteMixin
+from api.caching import CachedPayloadMixin, CachedResultsMixin, cached_values, result_cache_stats
+from api.conditional import ConditionalGetMixin
+from api.export import EXPORTS, export_lines
+from api.hyperlinks import build_url
+from api.geo import nearest, clusters, cluster_features, parse_bbox, box_filter
 from api.filters import ArtistFilter, SongFilter, PlaceFilter, SenseFilter, ExampleFilter
-from api.models import Sense, Artist, Place, Song, Domain, SemanticClass, Annotation, Dictionary, Example
+from api.pagination import paginate_search
+from api.models import Sense, Artist, Place, Song, Domain, SemanticClass, Annotation, Dictionary, Example, \
+    SENSE_TAXONOMIES
 from api.forms import AnnotationForm, ArtistForm, DomainForm, ExampleForm, PlaceForm, SemanticClassForm, SenseForm, SongForm
-from api.serializers import SenseSerializer, UserSerializer, ArtistSerializer, PlaceSerializer, \
+from api.rendering import render_example
+from api.rhymes import largest_families
+from api.search import search_lyrics
+from api.serializers import apply_queryset_plan, requested_fields, SenseSerializer, UserSerializer, ArtistSerializer, PlaceSerializer, \
     SongSerializer, DomainSerializer, SemanticClassSerializer, AnnotationSerializer, DictionarySerializer, \
     ExampleSerializer
 from api.utils import slugify, extract_rhymes, clean_up_date, build_example_serializer, \
@@ -14,7 +29,23 @@ from api.utils import slugify, extract_rhymes, clean_up_date, build_example_seri
     build_examples_from_queryset, build_songs_from_queryset
 
 
-class SenseViewSet(viewsets.ModelViewSet):
+class PlannedQuerysetMixin(object):
+    """
+    Lists run on the queryset plan derived from the serializer's fields (or
+    those picked by `?fields=`/`?omit=`), so a page costs the same number of
+    queries whatever its size and reads only the columns it renders.
+    """
+
+    def get_queryset(self):
+        queryset = super(PlannedQuerysetMixin, self).get_queryset()
+        if self.action == 'list':
+            serializer_class = self.get_serializer_class()
+            keep = requested_fields(serializer_class, self.request.query_params)
+            return apply_queryset_plan(queryset, serializer_class, keep)
+        return queryset
+
+
+class SenseViewSet(PlannedQuerysetMixin, ConditionalGetMixin, CachedPayloadMixin, CachedResultsMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list`, `create`, `retrieve`,
     `update` and `destroy` actions.
@@ -29,26 +60,33 @@ class SenseViewSet(viewsets.ModelViewSet):
 
     @list_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def search(self, request, *args, **kwargs):
-        queryset = self.queryset.order_by('headword')
+        data = dict(self.cached_results(self.get_search_data), form=SenseForm())
+        return Response(data, template_name="api/_search.html")
+
+    def get_search_data(self):
+        queryset = self.queryset
         q = self.request.query_params.get('q', None)
-        form = SenseForm()
         if q is not None:
             queryset = queryset.filter(definition__icontains=q)
+        senses, links = paginate_search(self.request, queryset)
         data = {
             "label": "Senses",
-            "senses": queryset,
-            "form": form,
+            "senses": senses,
             "form_action": "sense-list"
         }
-        return Response(data, template_name="api/_search.html")
+        data.update(links)
+        return data
 
     @detail_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def highlight(self, request, *args, **kwargs):
-        sense = self.get_object()
+        return Response(self.get_cached_highlight_data(), template_name="api/sense.html")
+
+    def get_highlight_data(self, sense):
+        sense = Sense.objects.load_relations([sense])[0]
         annotations = sense.annotations.all()
         rhymes = extract_rhymes(annotations)
-        examples = build_examples_from_annotations(annotations, request)
-        data = {
+        examples = build_examples_from_annotations(annotations, self.request)
+        return {
             'sense': sense,
             'examples': examples,
             'rhymes': rhymes,
@@ -61,14 +99,61 @@ class SenseViewSet(viewsets.ModelViewSet):
             'holonyms': sense.holonyms.all(),
             'meronyms': sense.meronyms.all()
         }
-        return Response(data, template_name="api/sense.html")
+
+    @detail_route()
+    def ancestors(self, request, *args, **kwargs):
+        return self.taxonomy_response(Sense.objects.ancestors)
+
+    @detail_route()
+    def descendants(self, request, *args, **kwargs):
+        return self.taxonomy_response(Sense.objects.descendants)
+
+    def taxonomy_response(self, walk):
+        """
+        The senses `walk` finds from this one in the `?taxonomy=` (hypernyms
+        or meronyms), nearest first, each with its `depth`.
+        """
+        taxonomy = request_taxonomy(self.request)
+        senses = list(walk(self.get_object(), taxonomy))
+        data = self.get_serializer(senses, many=True).data
+        for sense, item in zip(senses, data):
+            item['depth'] = sense.depth
+        return Response(data)
 
     def perform_create(self, serializer):
         headword_slug = slugify(serializer.validated_data['headword'])
         serializer.save(owner=self.request.user, headword_slug=headword_slug)
 
 
-class ArtistViewSet(viewsets.ModelViewSet):
+def request_taxonomy(request):
+    taxonomy = request.query_params.get('taxonomy', 'hypernyms')
+    if taxonomy not in [name for name, _, _ in SENSE_TAXONOMIES]:
+        raise ValidationError({'taxonomy': ["Expected one of: %s." % ", ".join(t for t, _, _ in SENSE_TAXONOMIES)]})
+    return taxonomy
+
+
+MAX_NEAREST = 100
+MAX_FAMILIES = 100
+MAX_ZOOM = 20
+CLUSTER_LAYERS = ('places', 'artists')
+
+
+def request_number(request, name, parse=float, default=None, low=None, high=None):
+    value = request.query_params.get(name)
+    if value is None and default is not None:
+        return default
+    try:
+        number = parse(value)
+    except (TypeError, ValueError):
+        raise ValidationError({name: ["A number is required."]})
+    if not math.isfinite(number):
+        raise ValidationError({name: ["A finite number is required."]})
+    if (low is not None and number < low) or (high is not None and number > high):
+        raise ValidationError({name: ["Expected a number from %s to %s." % (low, high)]})
+    return number
+
+
+class ArtistViewSet(PlannedQuerysetMixin, ConditionalGetMixin, CachedPayloadMixin, CachedResultsMixin, viewsets.ModelViewSet):
     queryset = Artist.objects.all()
     serializer_class = ArtistSerializer
     filter_backends = (filters.DjangoFilterBackend,)
@@ -77,26 +162,33 @@ class ArtistViewSet(viewsets.ModelViewSet):
 
     @list_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def search(self, request, *args, **kwargs):
-        queryset = self.queryset.order_by('name')
+        data = dict(self.cached_results(self.get_search_data), form=ArtistForm())
+        return Response(data, template_name="api/_search.html")
+
+    def get_search_data(self):
+        queryset = self.queryset
         q = self.request.query_params.get('q', None)
-        form = ArtistForm()
         if q is not None:
             queryset = queryset.filter(name__icontains=q)
+        artists, links = paginate_search(self.request, queryset)
         data = {
             "label": "Artists",
-            "artists": queryset,
-            "form": form,
+            "artists": artists,
             "form_action": "artist-list"
         }
-        return Response(data, template_name="api/_search.html")
+        data.update(links)
+        return data
 
     @detail_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def highlight(self, request, *args, **kwargs):
-        artist = self.get_object()
+        return Response(self.get_cached_highlight_data(), template_name="api/artist.html")
+
+    def get_highlight_data(self, artist):
+        request = self.request
         annotations = artist.annotations.all()
         rhymes = extract_rhymes(annotations)
         examples = build_examples_from_annotations(annotations, request)
-        data = {
+        return {
             "artist": artist,
             "also_known_as": artist.also_known_as.all(),
             "members": artist.members.all(),
@@ -108,45 +200,93 @@ class ArtistViewSet(viewsets.ModelViewSet):
             "primary_songs": build_songs_from_queryset(artist.primary_songs.order_by('release_date'), request, None),
             "featured_songs": build_songs_from_queryset(artist.featured_songs.order_by('release_date'), request, None),
         }
-        return Response(data, template_name="api/artist.html")
 
     def perform_create(self, serializer):
         slug = slugify(serializer.validated_data['name'])
         serializer.save(owner=self.request.user, slug=slug)
 
 
-class PlaceViewSet(viewsets.ModelViewSet):
+class PlaceViewSet(PlannedQuerysetMixin, ConditionalGetMixin, CachedPayloadMixin, CachedResultsMixin, viewsets.ModelViewSet):
     queryset = Place.objects.all()
     serializer_class = PlaceSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = PlaceFilter
     permission_classes = (permissions.IsAuthenticated,)
+    cached_result_actions = ('list', 'search', 'clusters')
 
     @list_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def search(self, request, *args, **kwargs):
-        queryset = self.queryset.order_by('name')
+        data = dict(self.cached_results(self.get_search_data), form=PlaceForm())
+        return Response(data, template_name="api/_search.html")
+
+    def get_search_data(self):
+        queryset = self.queryset
         q = self.request.query_params.get('q', None)
-        form = PlaceForm()
         if q is not None:
             queryset = queryset.filter(full_name__icontains=q)
+        places, links = paginate_search(self.request, queryset)
         data = {
             "label": "Places",
-            "places": queryset,
-            "form": form,
+            "places": places,
             "form_action": "place-list"
         }
-        return Response(data, template_name="api/_search.html")
+        data.update(links)
+        return data
+
+    @list_route()
+    def nearest(self, request, *args, **kwargs):
+        """
+        The `?k=` places nearest `?lat=`/`?lng=`, each with its `distance` in km.
+        """
+        latitude = request_number(request, 'lat', low=-90, high=90)
+        longitude = request_number(request, 'lng', low=-180, high=180)
+        k = request_number(request, 'k', int, default=10, low=1, high=MAX_NEAREST)
+        places = nearest(self.filter_queryset(self.get_queryset()), latitude, longitude, k)
+        data = self.get_serializer(places, many=True).data
+        for place, item in zip(places, data):
+            item['distance'] = round(place.distance, 3)
+        return Response(data)
+
+    @list_route()
+    def clusters(self, request, *args, **kwargs):
+        """
+        GeoJSON markers for places and artist origins, one per occupied cell
+        at `?zoom=`, optionally within `?bbox=` and limited to one `?layer=`.
+        """
+        return Response(self.cached_results(self.get_cluster_data))
+
+    def get_cluster_data(self):
+        zoom = request_number(self.request, 'zoom', int, default=0, low=0, high=MAX_ZOOM)
+        layer = self.request.query_params.get('layer')
+        if layer is not None and layer not in CLUSTER_LAYERS:
+            raise ValidationError({'layer': ["Expected one of: %s." % ", ".join(CLUSTER_LAYERS)]})
+        layers = {'places': (Place.objects.all(), ""), 'artists': (Artist.objects.all(), "origin__")}
+        bbox = self.request.query_params.get('bbox')
+        features = []
+        for name in CLUSTER_LAYERS:
+            if layer not in (None, name):
+                continue
+            queryset, prefix = layers[name]
+            if bbox:
+                try:
+                    queryset = queryset.filter(box_filter(*parse_bbox(bbox), prefix=prefix))
+                except ValueError as e:
+                    raise ValidationError({'bbox': [str(e)]})
+            features.extend(cluster_features(clusters(queryset, zoom, prefix), name))
+        return {"type": "FeatureCollection", "features": features}
 
     @detail_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def highlight(self, request, *args, **kwargs):
-        place = self.get_object()
+        return Response(self.get_cached_highlight_data(), template_name="api/place.html")
+
+    def get_highlight_data(self, place):
         annotations = place.annotations.all()
         rhymes = extract_rhymes(annotations)
         contains = place.contains.all()
         within = place.within.all()
         artists = place.artists.all()
-        examples = build_examples_from_annotations(annotations, request)
-        data = {
+        examples = build_examples_from_annotations(annotations, self.request)
+        return {
             'place': place,
             'contains': contains,
             'within': within,
@@ -154,7 +294,6 @@ class PlaceViewSet(viewsets.ModelViewSet):
             'rhymes': rhymes,
             'examples': examples,
         }
-        return Response(data, template_name="api/place.html")
 
     def perform_create(self, serializer):
         full_name = serializer.validated_data['full_name']
@@ -163,7 +302,7 @@ class PlaceViewSet(viewsets.ModelViewSet):
         serializer.save(owner=self.request.user, slug=slug, name=name)
 
 
-class SongViewSet(viewsets.ModelViewSet):
+class SongViewSet(PlannedQuerysetMixin, ConditionalGetMixin, CachedPayloadMixin, CachedResultsMixin, viewsets.ModelViewSet):
     queryset = Song.objects.all()
     serializer_class = SongSerializer
     filter_backends = (filters.DjangoFilterBackend,)
@@ -172,35 +311,37 @@ class SongViewSet(viewsets.ModelViewSet):
 
     @list_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def search(self, request, *args, **kwargs):
-        queryset = self.queryset.order_by('title')
+        data = dict(self.cached_results(self.get_search_data), form=SongForm())
+        return Response(data, template_name="api/_search.html")
+
+    def get_search_data(self):
+        queryset = self.queryset
         q = self.request.query_params.get('q', None)
-        form = SongForm()
-        data = {"label": "Songs", "form": form, "form_action": "song-list"}
+        data = {"label": "Songs", "form_action": "song-list"}
         if q is not None:
-            titles = queryset.filter(title__icontains=q)
-            lyrics = queryset.filter(lyrics__icontains=q).order_by('release_date')
-            data['song_titles'] = build_songs_from_queryset(titles, request, "")
-            data['song_lyrics'] = build_songs_from_queryset(lyrics, request, q)
+            titles, links = paginate_search(self.request, queryset.filter(title__icontains=q))
+            lyrics, lyrics_links = paginate_search(self.request, search_lyrics(queryset, q), prefix="lyrics_")
+            data['song_lyrics'] = build_songs_from_queryset(lyrics, self.request, q)
+            data.update(lyrics_links)
         else:
-            data['song_titles'] = build_songs_from_queryset(queryset, request, "")
-
-        return Response(data, template_name="api/_search.html")
+            titles, links = paginate_search(self.request, queryset)
+        data['song_titles'] = build_songs_from_queryset(titles, self.request, None)
+        data.update(links)
+        return data
 
     @detail_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def highlight(self, request, *args, **kwargs):
-        song = self.get_object()
-        primary_artists = song.primary_artists.all()
-        featured_artists = song.featured_artists.all()
-        examples = song.examples.all()
-        example_serializer = build_example_serializer(request, song, "")
-        data = {
+        data = dict(self.get_cached_highlight_data())
+        data["example_serializer"] = build_example_serializer(request, data["song"], "")
+        return Response(data, template_name="api/song.html")
+
+    def get_highlight_data(self, song):
+        return {
             "song": song,
-            "primary_artists": primary_artists,
-            "featured_artists": featured_artists,
-            "examples": examples,
-            "example_serializer": example_serializer
+            "primary_artists": song.primary_artists.all(),
+            "featured_artists": song.featured_artists.all(),
+            "examples": song.examples.all(),
         }
-        return Response(data, template_name="api/song.html")
 
     def perform_create(self, serializer):
         release_date_string = serializer.validated_data['release_date_string']
@@ -211,7 +352,7 @@ class SongViewSet(viewsets.ModelViewSet):
         serializer.save(owner=self.request.user, slug=slug, release_date=release_date)
 
 
-class DictionaryViewSet(viewsets.ModelViewSet):
+class DictionaryViewSet(PlannedQuerysetMixin, ConditionalGetMixin, CachedResultsMixin, viewsets.ModelViewSet):
     queryset = Dictionary.objects.all()
     serializer_class = DictionarySerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -230,33 +371,81 @@ class DictionaryViewSet(viewsets.ModelViewSet):
         serializer.save(owner=self.request.user, slug=slug)
 
 
-class DomainViewSet(viewsets.ModelViewSet):
+class SubtreeSensesMixin(object):
+    """
+    Sense listings for domains and semantic classes that take in every
+    narrower node at any depth, a page at a time. Each node's subtree sense
+    count is cached until the model or its senses are next written.
+
+    The highlight page depends on the whole subtree, not just the node's own
+    `updated`, so only `retrieve` answers conditional GETs.
+    """
+    conditional_actions = ('retrieve',)
+
+    def subtree_sense_counts(self, nodes):
+        model = self.queryset.model
+        return cached_values(model._meta.label_lower + ".subtree_senses", [model, Sense], [node.pk for node in nodes],
+                             model.objects.subtree_sense_counts)
+
+    def get_subtree_data(self, node):
+        senses, links = paginate_search(self.request, self.queryset.model.objects.subtree_senses(node))
+        narrower = list(node.narrower.all())
+        counts = self.subtree_sense_counts([node] + narrower)
+        for child in narrower:
+            child.sense_count = counts[child.pk]
+        data = {
+            "senses": senses,
+            "sense_count": counts[node.pk],
+            "narrower": narrower
+        }
+        data.update(links)
+        return data
+
+    @detail_route()
+    def senses(self, request, *args, **kwargs):
+        """
+        The senses of this node and everything narrower, or with
+        `?recursive=0` only its own.
+        """
+        node = self.get_object()
+        if request.query_params.get('recursive') in ('0', 'false', 'False'):
+            queryset = Sense.objects.filter(pk__in=node.senses.values('pk'))
+        else:
+            queryset = self.queryset.model.objects.subtree_senses(node)
+        keep = requested_fields(SenseSerializer, request.query_params)
+        page = self.paginate_queryset(apply_queryset_plan(queryset, SenseSerializer, keep))
+        serializer = SenseSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+
+class DomainViewSet(SubtreeSensesMixin, PlannedQuerysetMixin, ConditionalGetMixin, CachedResultsMixin, viewsets.ModelViewSet):
     queryset = Domain.objects.all()
     serializer_class = DomainSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
     @list_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def search(self, request, *args, **kwargs):
-        queryset = self.queryset.order_by('name')
+        data = dict(self.cached_results(self.get_search_data), form=DomainForm())
+        return Response(data, template_name="api/_search.html")
+
+    def get_search_data(self):
+        queryset = self.queryset
         q = self.request.query_params.get('q', None)
-        form = DomainForm()
         if q is not None:
             queryset = queryset.filter(name__icontains=q)
+        domains, links = paginate_search(self.request, queryset)
         data = {
             "label": "Domains",
-            "domains": queryset,
-            "form": form,
+            "domains": domains,
             "form_action": "domain-list"
         }
-        return Response(data, template_name="api/_search.html")
+        data.update(links)
+        return data
 
     @detail_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def highlight(self, request, *args, **kwargs):
         domain = self.get_object()
-        data = {
-            "domain": domain,
-            "senses": domain.senses.all()
-        }
+        data = dict(self.get_subtree_data(domain), domain=domain)
         return Response(data, template_name="api/domain.html")
 
     def perform_create(self, serializer):
@@ -264,33 +453,34 @@ class DomainViewSet(viewsets.ModelViewSet):
         serializer.save(owner=self.request.user, slug=slug)
 
 
-class SemanticClassViewSet(viewsets.ModelViewSet):
+class SemanticClassViewSet(SubtreeSensesMixin, PlannedQuerysetMixin, ConditionalGetMixin, CachedResultsMixin, viewsets.ModelViewSet):
     queryset = SemanticClass.objects.all()
     serializer_class = SemanticClassSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
     @list_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def search(self, request, *args, **kwargs):
-        queryset = self.queryset.order_by('name')
+        data = dict(self.cached_results(self.get_search_data), form=SemanticClassForm())
+        return Response(data, template_name="api/_search.html")
+
+    def get_search_data(self):
+        queryset = self.queryset
         q = self.request.query_params.get('q', None)
-        form = SemanticClassForm()
         if q is not None:
             queryset = queryset.filter(name__icontains=q)
+        semantic_classes, links = paginate_search(self.request, queryset)
         data = {
             "label": "Semantic Classes",
-            "semantic_classes": queryset,
-            "form": form,
+            "semantic_classes": semantic_classes,
             "form_action": "semanticclass-list"
         }
-        return Response(data, template_name="api/_search.html")
+        data.update(links)
+        return data
 
     @detail_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def highlight(self, request, *args, **kwargs):
         semantic_class = self.get_object()
-        data = {
-            "semantic_class": semantic_class,
-            "senses": semantic_class.senses.all()
-        }
+        data = dict(self.get_subtree_data(semantic_class), semantic_class=semantic_class)
         return Response(data, template_name="api/semantic_class.html")
 
     def perform_create(self, serializer):
@@ -298,7 +488,7 @@ class SemanticClassViewSet(viewsets.ModelViewSet):
         serializer.save(owner=self.request.user, slug=slug)
 
 
-class ExampleViewSet(viewsets.ModelViewSet):
+class ExampleViewSet(BulkWriteMixin, PlannedQuerysetMixin, ConditionalGetMixin, CachedPayloadMixin, CachedResultsMixin, viewsets.ModelViewSet):
     queryset = Example.objects.all()
     serializer_class = ExampleSerializer
     filter_backends = (filters.DjangoFilterBackend,)
@@ -307,37 +497,41 @@ class ExampleViewSet(viewsets.ModelViewSet):
 
     @list_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def search(self, request, *args, **kwargs):
+        data = dict(self.cached_results(self.get_search_data), form=ExampleForm())
+        return Response(data, template_name="api/_search.html")
+
+    def get_search_data(self):
         queryset = self.queryset
         q = self.request.query_params.get('q', None)
-        form = ExampleForm()
         if q is not None:
             queryset = queryset.filter(text__icontains=q)
+        examples, links = paginate_search(self.request, queryset)
         data = {
             "label": "Examples",
-            "examples": build_examples_from_queryset(queryset, request),
-            "form": form,
+            "examples": build_examples_from_queryset(examples, self.request),
             "form_action": "example-list"
         }
-        return Response(data, template_name="api/_search.html")
+        data.update(links)
+        return data
 
     @detail_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def highlight(self, request, *args, **kwargs):
-        example = self.get_object()
-        song = example.from_song
-        annotations = example.annotations.all()
-        rhymes = extract_rhymes(annotations)
-        annotation_serializer = build_annotation_serializer(request, example)
+        data = dict(self.get_cached_highlight_data())
+        annotation_serializer = build_annotation_serializer(request, data['example'])
         annotation_serializer.is_valid()
-        data = {
+        data['annotation_serializer'] = annotation_serializer
+        return Response(data, template_name="api/example.html")
+
+    def get_highlight_data(self, example):
+        annotations = example.annotations.select_related('sense', 'artist', 'place')
+        return {
             'example': example,
             'primary_artists': example.primary_artists.all(),
             'featured_artists': example.featured_artists.all(),
-            'song': song,
+            'song': example.from_song,
             'annotations': annotations,
-            'rhymes': rhymes,
-            'annotation_serializer': annotation_serializer
+            'rhymes': extract_rhymes(annotations),
         }
-        return Response(data, template_name="api/example.html")
 
     def perform_create(self, serializer):
         text = serializer.validated_data['text']
@@ -350,44 +544,106 @@ class ExampleViewSet(viewsets.ModelViewSet):
         #     return redirect('/')
         serializer.save(owner=self.request.user, slug=slug)
 
+    def get_bulk_attributes(self, data, instance=None):
+        attributes = {'slug': slugify(data['text'])} if 'text' in data else {}
+        if instance is None:
+            attributes['owner'] = self.request.user
+            attributes['rendered'] = render_example(Example(text=data['text']), [])
+        return attributes
 
-class AnnotationViewSet(viewsets.ModelViewSet):
+
+class AnnotationViewSet(BulkWriteMixin, PlannedQuerysetMixin, ConditionalGetMixin, CachedPayloadMixin, CachedResultsMixin, viewsets.ModelViewSet):
     queryset = Annotation.objects.all()
     serializer_class = AnnotationSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    cached_result_actions = ('list', 'search', 'rhyme_families')
 
     @list_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def search(self, request, *args, **kwargs):
+        data = dict(self.cached_results(self.get_search_data), form=AnnotationForm())
+        return Response(data, template_name="api/_search.html")
+
+    def get_search_data(self):
         queryset = self.queryset
         q = self.request.query_params.get('q', None)
-        form = AnnotationForm()
         if q is not None:
             queryset = queryset.filter(text__icontains=q)
+        annotations, links = paginate_search(self.request, queryset)
         data = {
             "label": "Annotations",
-            "annotations": queryset,
-            "form": form,
+            "annotations": annotations,
             "form_action": "annotation-list"
         }
-        return Response(data, template_name="api/_search.html")
+        data.update(links)
+        return data
 
     @detail_route(renderer_classes=[renderers.TemplateHTMLRenderer])
     def highlight(self, request, *args, **kwargs):
-        annotation = self.get_object()
-        data = {
+        return Response(self.get_cached_highlight_data(), template_name="api/annotation.html")
+
+    def get_highlight_data(self, annotation):
+        return {
             "annotation": annotation
         }
-        return Response(data, template_name="api/annotation.html")
+
+    @list_route(url_path='rhyme-families')
+    def rhyme_families(self, request, *args, **kwargs):
+        """
+        The `?limit=` largest rhyme families, biggest first, with their members.
+        """
+        return Response(self.cached_results(self.get_rhyme_family_data))
+
+    def get_rhyme_family_data(self):
+        limit = request_number(self.request, 'limit', int, default=20, low=1, high=MAX_FAMILIES)
+        families = []
+        for cluster, size, members in largest_families(limit):
+            families.append({
+                "cluster": cluster,
+                "size": size,
+                "members": [dict(dict(annotation), url=build_url('annotation-detail', annotation.pk, self.request),
+                                 example=annotation.example.text) for annotation in members]
+            })
+        return families
 
     def perform_create(self, serializer):
         slug = slugify(serializer.validated_data['text'])
         serializer.save(owner=self.request.user, slug=slug)
 
+    def get_bulk_attributes(self, data, instance=None):
+        attributes = {'slug': slugify(data['text'])} if 'text' in data else {}
+        if instance is None:
+            attributes['owner'] = self.request.user
+        return attributes
+
 
 # User views
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(PlannedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     This viewset automatically provides `list` and `detail` actions.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+
+
+class ResultCacheStatsView(APIView):
+    """
+    Hit and miss counts of the list and search result caches.
+    """
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request, format=None):
+        return Response(result_cache_stats())
+
+
+class ExportView(APIView):
+    """
+    Every row of one model as newline-delimited JSON, streamed.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, name, format=None):
+        if name not in EXPORTS:
+            raise Http404
+        response = StreamingHttpResponse(export_lines(name), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="%s.ndjson"' % name
+        return response
@@ -23,6 +23,15 @@ if 'TRAVIS' in os.environ:
     }
     SECRET_KEY = '1234567890'
     ALLOWED_HOSTS = []
+    CACHES = {
+        'default': {
+            'BACKEND':  'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'payloads': {
+            'BACKEND':  'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'payloads',
+        },
+    }
 
 else:
     DATABASES = {
@@ -37,6 +46,15 @@ else:
     }
     SECRET_KEY = env['SECRET_KEY']
     ALLOWED_HOSTS = [env['HOST'], ]
+    CACHES = {
+        'default': {
+            'BACKEND':  'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'payloads': {
+            'BACKEND':  env.get('PAYLOAD_CACHE_BACKEND', 'django.core.cache.backends.memcached.PythonMemcachedCache'),
+            'LOCATION': env.get('PAYLOAD_CACHE_LOCATION', '127.0.0.1:11211'),
+        },
+    }
 
 DEBUG = True
 
@@ -129,6 +147,7 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 
 REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
     'DEFAULT_FILTER_BACKENDS': ('rest_framework.filters.DjangoFilterBackend',),
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.BasicAuthentication',